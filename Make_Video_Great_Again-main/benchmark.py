@@ -0,0 +1,384 @@
+# benchmark.py —— 性能基准测试：多种数据规模、冷/热分离、分位数与峰值内存、基线对比
+# -*- coding: utf-8 -*-
+"""
+用法：
+    python -m benchmark --sizes small medium --repeat 5
+    python -m benchmark --sizes small --save-baseline          # 保存为基线
+    python -m benchmark --sizes small --baseline results/benchmarks/baseline.json --threshold 0.2
+    python -m benchmark --sizes large --shards 0 1 2 4   # 只运行分片相似用户搜索：延迟/吞吐 vs 分片数
+    python -m benchmark --sizes small --ingest 1 100 1000   # 只运行增量写入：吞吐 vs 每批条数
+每种规模在临时目录中生成数据；冷启动 = 运行前清空相关缓存，热运行 = 缓存已就绪
+结果写入 results/benchmarks/，与基线相比 p50 变慢超过阈值时以退出码 1 结束
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+BENCHMARK_DIR = 'results/benchmarks'
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+# 数据规模：名称 -> (视频数, 用户数, 每用户最少操作数, 每用户最多操作数)
+SIZES = {
+    'tiny': (2000, 200, 100, 200),
+    'small': (20000, 2000, 100, 200),
+    'medium': (100000, 10000, 100, 200),
+    'large': (300000, 30000, 100, 200),
+}
+SAMPLE_IDS = 8  # 每次重复时查询的用户/视频数
+
+# 基准测试只输出警告，避免各任务模块的日志写入临时目录
+logging.basicConfig(level=logging.WARNING)
+warnings.filterwarnings('ignore', module='statsmodels')  # ARIMA 拟合的收敛提示
+
+
+def _percentiles(times):
+    times = np.asarray(times) * 1000
+    return {
+        "n": int(len(times)),
+        "min_ms": round(float(times.min()), 3),
+        "mean_ms": round(float(times.mean()), 3),
+        "p50_ms": round(float(np.percentile(times, 50)), 3),
+        "p95_ms": round(float(np.percentile(times, 95)), 3),
+        "max_ms": round(float(times.max()), 3),
+    }
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _peak_memory(reset, fn):
+    """单独运行一次冷启动并用 tracemalloc 记录峰值（计时运行不开启 tracemalloc，避免干扰耗时）"""
+    reset()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024 / 1024, 2)
+
+
+def _max_rss_mb():
+    """进程最大常驻内存（MB）；没有 resource 模块时退回当前常驻内存，都无法获取时返回 None"""
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 下单位为字节，Linux 下为 KB
+        return round(max_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    import memory_budget
+    rss = memory_budget.current_rss()
+    return None if rss is None else round(rss / 1024 / 1024, 1)
+
+
+def _benchmarks(user_ids, video_ids):
+    """返回 名称 -> (冷启动前的重置函数, 被测函数)"""
+    from data_cache import DataCache
+    import task1_similar_users
+    import task2_recommend_videos
+    import task3_predict_heat
+    import task4_user_clustering
+    import task5_video_clustering
+    import user_features
+
+    def reset_matrix():
+        user_features.clear_cache()
+        task1_similar_users.clear_cache()
+
+    def reset_recommend():
+        reset_matrix()
+        task2_recommend_videos.clear_cache()
+
+    def reset_daily():
+        DataCache._daily_counts = None
+
+    def reset_clusters(module):
+        def reset():
+            user_features.clear_cache()
+            module.clear_cache()
+        return reset
+
+    def each(fn, ids):
+        def run():
+            for item_id in ids:
+                fn(int(item_id))
+        return run
+
+    return {
+        'datacache_load': (DataCache.clear_cache, DataCache.preload_all),
+        'daily_counts': (reset_daily, DataCache.load_daily_counts),
+        'matrix_build': (reset_matrix, task1_similar_users.initialize_matrix),
+        'task1_similar_users': (reset_matrix, each(task1_similar_users.find_similar_users, user_ids)),
+        'task2_recommend': (reset_recommend, each(task2_recommend_videos.recommend_videos, user_ids)),
+        'task3_heat': (reset_daily, each(task3_predict_heat.predict_video_heat, video_ids)),
+        'task4_cluster_users': (reset_clusters(task4_user_clustering),
+                                lambda: task4_user_clustering.cluster_users(10)),
+        'task5_cluster_videos': (reset_clusters(task5_video_clustering),
+                                 lambda: task5_video_clustering.cluster_videos(5)),
+    }
+
+
+@contextlib.contextmanager
+def _generated_data(name):
+    """在临时目录中生成指定规模的数据（固定随机种子），返回生成耗时（秒），退出时删除目录"""
+    import generate_videos
+    import generate_users_operations
+
+    num_videos, num_users, min_ops, max_ops = SIZES[name]
+    workdir = tempfile.mkdtemp(prefix=f'benchmark_{name}_')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    os.makedirs('data', exist_ok=True)
+    os.makedirs('results', exist_ok=True)
+    try:
+        random.seed(42)
+        np.random.seed(42)
+        start = time.perf_counter()
+        generate_videos.generate_videos(force=True, num_videos=num_videos)
+        generate_users_operations.generate_users_operations(
+            force=True, num_users=num_users, min_ops=min_ops, max_ops=max_ops)
+        yield time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_size(name, repeat, cold_repeat, only=None):
+    """在临时目录中生成指定规模的数据并运行全部基准"""
+    from data_cache import DataCache
+
+    num_videos, num_users, _, _ = SIZES[name]
+    with _generated_data(name) as generate_seconds:
+        # 数据生成只测一次
+        results = {"generate": {"cold": _percentiles([generate_seconds])}}
+
+        DataCache.clear_cache()
+        rng = np.random.default_rng(42)
+        user_ids = rng.choice(DataCache.load_users()['id'].to_numpy(), SAMPLE_IDS, replace=False)
+        video_ids = rng.choice(DataCache.load_videos()['id'].to_numpy(), SAMPLE_IDS, replace=False)
+
+        for bench, (reset, fn) in _benchmarks(user_ids, video_ids).items():
+            if only and bench not in only:
+                continue
+            cold = []
+            for _ in range(cold_repeat):
+                reset()
+                cold.append(_timed(fn))
+            warm = [_timed(fn) for _ in range(repeat)]
+            results[bench] = {
+                "cold": _percentiles(cold),
+                "warm": _percentiles(warm),
+                "peak_mb": _peak_memory(reset, fn),
+            }
+            print(f"[{name}] {bench}: 冷 p50 {results[bench]['cold']['p50_ms']:.1f}ms, "
+                  f"热 p50 {results[bench]['warm']['p50_ms']:.1f}ms, "
+                  f"峰值 {results[bench]['peak_mb']:.1f}MB", file=sys.stderr)
+
+        DataCache.clear_cache()
+        return {
+            "videos": num_videos, "users": num_users,
+            "operations": int(sum(1 for _ in open('data/operations.csv')) - 1),
+            "benchmarks": results,
+        }
+
+
+def run_sharded(name, shard_counts, queries, batch_size):
+    """
+    分片相似用户搜索：对每个分片数测量单次查询延迟与批量查询吞吐
+    分片数 0 表示不分片（进程内 find_similar_users_batch），作为对照
+    """
+    from data_cache import DataCache
+    import task1_similar_users
+    from sharded_similarity import ShardedSimilarity
+
+    with _generated_data(name):
+        DataCache.clear_cache()
+        unique_users = task1_similar_users.initialize_matrix()[2]
+        rng = np.random.default_rng(42)
+        user_ids = rng.choice(np.asarray(unique_users), queries).tolist()
+        batches = [user_ids[i:i + batch_size] for i in range(0, len(user_ids), batch_size)]
+
+        results = {}
+        for n_shards in shard_counts:
+            index = ShardedSimilarity(n_shards).start() if n_shards else None
+            try:
+                query = index.find_similar_users_batch if index else task1_similar_users.find_similar_users_batch
+                query(user_ids[:1])  # 预热
+                latencies = [_timed(lambda uid=uid: query([uid])) for uid in user_ids]
+                start = time.perf_counter()
+                for batch in batches:
+                    query(batch)
+                elapsed = time.perf_counter() - start
+            finally:
+                if index:
+                    index.close()
+            results[str(n_shards)] = {
+                "single": _percentiles(latencies),
+                "batch_size": batch_size,
+                "batch_qps": round(len(user_ids) / elapsed, 1),
+            }
+            print(f"[{name}] 分片数 {n_shards}: 单次 p50 {results[str(n_shards)]['single']['p50_ms']:.2f}ms, "
+                  f"批量吞吐 {results[str(n_shards)]['batch_qps']:.0f} 次/秒", file=sys.stderr)
+
+        DataCache.clear_cache()
+        return results
+
+
+def run_ingestion(name, batch_sizes, events):
+    """
+    增量写入：派生数据全部预热后，按不同批大小写入 events 条随机操作，测量每批延迟与吞吐；
+    最后清空缓存从磁盘重新构建，检查增量更新后的矩阵与计数是否与重新构建的一致
+    """
+    import pandas as pd
+    from data_cache import DataCache
+    import ingestion
+    import task1_similar_users
+    import task2_recommend_videos
+
+    def warm():
+        DataCache.preload_all()
+        DataCache.load_daily_counts()
+        task1_similar_users.initialize_matrix()
+        task2_recommend_videos._user_operation_index()
+
+    def reset():
+        DataCache.clear_cache()
+
+    with _generated_data(name):
+        reset()
+        warm()
+        rng = np.random.default_rng(42)
+        video_ids = DataCache.load_videos()['id'].to_numpy()
+        user_ids = DataCache.load_users()['id'].to_numpy()
+        # 约 1% 的操作来自新用户
+        user_pool = np.concatenate([user_ids, user_ids.max() + 1 + np.arange(max(len(user_ids) // 100, 1))])
+
+        results = {}
+        for batch_size in batch_sizes:
+            frame = pd.DataFrame({
+                'user_id': rng.choice(user_pool, events), 'video_id': rng.choice(video_ids, events),
+                'liked': (rng.random(events) < 0.3).astype(int), 'day': rng.integers(1, 8, events)})
+            latencies = [ingestion.ingest_operations(frame.iloc[start:start + batch_size])["seconds"]
+                         for start in range(0, events, batch_size)]
+            results[str(batch_size)] = {
+                "batch": _percentiles(latencies),
+                "events_per_second": round(events / sum(latencies), 1),
+            }
+            print(f"[{name}] 每批 {batch_size} 条: 单批 p50 {results[str(batch_size)]['batch']['p50_ms']:.2f}ms, "
+                  f"吞吐 {results[str(batch_size)]['events_per_second']:.0f} 条/秒", file=sys.stderr)
+
+        matrix, _, unique_users = task1_similar_users._matrix_state
+        patched = (matrix.toarray(), np.asarray(unique_users),
+                   DataCache.load_daily_counts()[0].copy())
+        reset()
+        warm()
+        matrix, _, unique_users = task1_similar_users._matrix_state
+        rebuilt = (matrix.toarray(), np.asarray(unique_users),
+                   DataCache.load_daily_counts()[0])
+        results["consistent"] = bool(patched[0].shape == rebuilt[0].shape and np.allclose(patched[0], rebuilt[0])
+                                     and np.array_equal(patched[1], rebuilt[1])
+                                     and np.array_equal(patched[2], rebuilt[2]))
+        print(f"[{name}] 增量更新与重新构建{'一致' if results['consistent'] else '不一致'}", file=sys.stderr)
+        reset()
+        return results
+
+
+def compare(current, baseline, threshold):
+    """按 (规模, 基准, 冷/热) 比较 p50，返回超过阈值的退化项"""
+    regressions = []
+    for size, size_result in current['sizes'].items():
+        base_size = baseline.get('sizes', {}).get(size)
+        if not base_size:
+            continue
+        for bench, phases in size_result['benchmarks'].items():
+            for phase in ('cold', 'warm'):
+                base = base_size['benchmarks'].get(bench, {}).get(phase)
+                if phase not in phases or not base or base['p50_ms'] <= 0:
+                    continue
+                ratio = phases[phase]['p50_ms'] / base['p50_ms']
+                if ratio > 1 + threshold:
+                    regressions.append({"size": size, "benchmark": bench, "phase": phase,
+                                        "baseline_ms": base['p50_ms'], "current_ms": phases[phase]['p50_ms'],
+                                        "ratio": round(ratio, 3)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description="性能基准测试")
+    parser.add_argument('--sizes', nargs='+', choices=SIZES, default=['tiny', 'small'])
+    parser.add_argument('--repeat', type=int, default=5, help="热运行重复次数")
+    parser.add_argument('--cold-repeat', type=int, default=3, help="冷启动重复次数")
+    parser.add_argument('--only', nargs='+', help="只运行指定的基准")
+    parser.add_argument('--output', help="结果文件（默认 results/benchmarks/benchmark_<时间>.json）")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="基线文件")
+    parser.add_argument('--threshold', type=float, default=0.2, help="p50 退化阈值（0.2 表示慢20%%）")
+    parser.add_argument('--save-baseline', action='store_true', help="将本次结果保存为基线")
+    parser.add_argument('--shards', nargs='+', type=int, help="只运行分片相似用户搜索基准，指定分片数（0 表示不分片）")
+    parser.add_argument('--shard-queries', type=int, default=200, help="分片基准的查询次数")
+    parser.add_argument('--shard-batch', type=int, default=32, help="分片基准的批量大小")
+    parser.add_argument('--ingest', nargs='+', type=int, help="只运行增量写入基准，指定每批条数")
+    parser.add_argument('--ingest-events', type=int, default=20000, help="增量写入基准每种批大小写入的操作数")
+    args = parser.parse_args(argv)
+
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    baseline_path = os.path.abspath(args.baseline)
+    output = os.path.abspath(args.output or os.path.join(
+        BENCHMARK_DIR, f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json"))
+
+    current = {
+        "created": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "cold_repeat": args.cold_repeat,
+        "sizes": {} if args.shards or args.ingest else {
+            name: run_size(name, args.repeat, args.cold_repeat, args.only) for name in args.sizes},
+        "max_rss_mb": _max_rss_mb(),
+    }
+    if args.shards:
+        current["sharded"] = {name: run_sharded(name, args.shards, args.shard_queries, args.shard_batch)
+                              for name in args.sizes}
+    if args.ingest:
+        current["ingestion"] = {name: run_ingestion(name, args.ingest, args.ingest_events) for name in args.sizes}
+
+    regressions = []
+    if os.path.exists(baseline_path) and not args.save_baseline:
+        with open(baseline_path, encoding='utf-8') as f:
+            regressions = compare(current, json.load(f), args.threshold)
+        current["baseline"] = baseline_path
+        current["regressions"] = regressions
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(current, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}", file=sys.stderr)
+    if args.save_baseline:
+        shutil.copyfile(output, baseline_path)
+        print(f"基线已更新: {baseline_path}", file=sys.stderr)
+
+    for item in regressions:
+        print(f"性能退化: [{item['size']}] {item['benchmark']} ({item['phase']}) "
+              f"{item['baseline_ms']:.1f}ms -> {item['current_ms']:.1f}ms (x{item['ratio']})", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
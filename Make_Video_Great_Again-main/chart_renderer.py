@@ -0,0 +1,266 @@
+# chart_renderer.py —— 图表渲染服务（计算与绘图分离）
+# -*- coding: utf-8 -*-
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import matplotlib
+from matplotlib import colormaps
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import Normalize
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from data_cache import DataCache
+
+matplotlib.rcParams['font.sans-serif'] = ['SimHei']  # 使用黑体或其他支持中文字体
+matplotlib.rcParams['axes.unicode_minus'] = False  # 解决负号显示问题
+
+CHART_DIR = 'results/charts'
+DEFAULT_DPI = 100
+MAX_CACHED_CHARTS = 32
+
+# 大规模散点图渲染配置
+LARGE_POINT_THRESHOLD = 20000     # 超过该点数时不再逐点绘制全部数据
+RENDER_TIME_BUDGET = 1.0          # 散点绘制的目标耗时（秒）
+SECONDS_PER_POINT = 2e-5          # 无描边散点的单点绘制耗时估计（秒）
+RASTER_FACTOR = 10                # 点数超过 阈值×该倍数 时改用栅格聚合
+GRID_SIZE = 200                   # 密度采样和栅格聚合的网格边长
+SCATTER_MODES = ('auto', 'scatter', 'sample', 'hexbin', 'raster')
+
+# 内存中的 PNG 缓存：key -> bytes（LRU）
+_chart_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def make_chart(task, params, data):
+    """
+    构造图表描述（任务只返回数据，由渲染服务按需绘图）
+    Args:
+        task: 图表类型，如 'heat'、'user_clusters'、'video_clusters'
+        params: 决定图表内容的任务参数（用于缓存键）
+        data: 绘图所需的数据
+    """
+    return {"task": task, "params": params, "data": data}
+
+
+def chart_key(chart, dpi=DEFAULT_DPI, mode='auto'):
+    """按 (任务, 参数, 数据版本, dpi, 散点模式) 计算图表缓存键"""
+    payload = json.dumps(
+        [chart['task'], chart['params'], DataCache.get_data_version(), dpi, mode],
+        sort_keys=True, default=str
+    )
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _draw_heat(fig, data, params, mode):
+    """绘制视频热度预测图"""
+    ax = fig.add_subplot(111)
+    days = np.asarray(data['days'])
+    forecast_days = np.asarray(data['forecast_days'])
+    ax.plot(days, data['daily'], 'bo-', label='历史热度(日新增)')
+    ax.plot(days, data['cumulative'], 'g-', label='历史热度(累计)')
+    ax.plot(forecast_days, data['forecast'], 'rx-', label='预测热度(累计)')
+    ax.plot(np.concatenate([days, forecast_days]), data['smoothed'], 'b--', label='平滑曲线')
+    ax.set_title(f"视频 {params['video_id']} 热度预测（ARIMA模型改进版）")
+    ax.set_xlabel('天数 (1-7为历史，8-14为预测)')
+    ax.set_ylabel('观看次数')
+    ax.set_xticks(list(days) + list(forecast_days))
+    ax.legend()
+    ax.grid(True)
+
+
+def _grid_cells(points, grid_size):
+    """将二维点映射到 grid_size×grid_size 网格，返回 (网格编号, x范围, y范围)"""
+    lo = points.min(axis=0)
+    hi = points.max(axis=0)
+    span = np.where(hi > lo, hi - lo, 1.0)
+    cells = np.minimum(((points - lo) / span * grid_size).astype(np.int64), grid_size - 1)
+    return cells[:, 0] * grid_size + cells[:, 1], (lo[0], hi[0]), (lo[1], hi[1])
+
+
+def density_sample(points, labels, target, grid_size=GRID_SIZE, seed=42):
+    """
+    密度感知下采样：每个 (网格, 聚类) 最多保留 per_cell 个点
+    稀疏区域和离群点全部保留，只稀释高密度区域，返回保留点的下标
+    """
+    n = len(points)
+    if n <= target:
+        return np.arange(n)
+    cells, _, _ = _grid_cells(points, grid_size)
+    groups = cells * (labels.max() + 1) + labels
+
+    # 打乱后稳定排序，计算每个点在所属组内的名次
+    order = np.random.default_rng(seed).permutation(n)
+    order = order[np.argsort(groups[order], kind='stable')]
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    group_sizes = np.diff(np.r_[starts, n])
+    ranks = np.arange(n) - np.repeat(starts, group_sizes)
+
+    # 二分查找满足目标点数的最大 per_cell
+    low, high = 1, int(group_sizes.max())
+    while low < high:
+        mid = (low + high + 1) // 2
+        if np.minimum(group_sizes, mid).sum() <= target:
+            low = mid
+        else:
+            high = mid - 1
+    return np.sort(order[ranks < low])
+
+
+def cluster_centers(points, labels, n_clusters):
+    """用 bincount 向量化计算各聚类中心（空聚类为 NaN）"""
+    counts = np.bincount(labels, minlength=n_clusters).astype(np.float64)
+    counts[counts == 0] = np.nan
+    return np.column_stack([
+        np.bincount(labels, weights=points[:, dim], minlength=n_clusters) / counts
+        for dim in range(points.shape[1])
+    ])
+
+
+def choose_scatter_mode(n_points, mode='auto'):
+    """根据点数和耗时预算选择散点渲染方式"""
+    if mode != 'auto':
+        if mode not in SCATTER_MODES:
+            raise ValueError(f"未知的散点渲染模式: {mode}")
+        return mode
+    if n_points <= LARGE_POINT_THRESHOLD:
+        return 'scatter'
+    if n_points <= LARGE_POINT_THRESHOLD * RASTER_FACTOR:
+        return 'sample'
+    return 'raster'
+
+
+def _raster_clusters(ax, points, labels, n_clusters, cmap):
+    """栅格聚合：每个网格按多数聚类着色，透明度随点密度（对数）变化"""
+    cells, x_range, y_range = _grid_cells(points, GRID_SIZE)
+    votes = np.bincount(cells * n_clusters + labels,
+                        minlength=GRID_SIZE * GRID_SIZE * n_clusters).reshape(-1, n_clusters)
+    density = votes.sum(axis=1)
+    majority = votes.argmax(axis=1)
+
+    image = cmap(majority / max(n_clusters - 1, 1))
+    image[:, 3] = np.where(density > 0, 0.25 + 0.75 * np.log1p(density) / np.log1p(density.max()), 0)
+    image = image.reshape(GRID_SIZE, GRID_SIZE, 4).transpose(1, 0, 2)
+    ax.imshow(image, origin='lower', aspect='auto', interpolation='nearest',
+              extent=(x_range[0], x_range[1], y_range[0], y_range[1]))
+
+
+def _draw_clusters(fig, data, params, mode, title, xlabel, ylabel, show_centers):
+    """
+    绘制聚类散点图
+    点数较多时按 mode 选择密度采样、六边形分箱或栅格聚合，均保留聚类配色和中心
+    """
+    ax = fig.add_subplot(111)
+    reduced_data = np.asarray(data['reduced'])[:, :2]
+    labels = np.asarray(data['labels']).astype(np.int64)
+    n_clusters = params['n_clusters']
+    cmap = colormaps['viridis']
+    norm = Normalize(vmin=0, vmax=max(n_clusters - 1, 1))
+
+    mode = choose_scatter_mode(len(labels), mode)
+    if mode == 'scatter':
+        ax.scatter(reduced_data[:, 0], reduced_data[:, 1],
+                   c=labels, cmap=cmap, norm=norm,
+                   alpha=0.7, s=20, edgecolor='k', linewidth=0.3)
+    elif mode == 'sample':
+        target = int(min(LARGE_POINT_THRESHOLD, RENDER_TIME_BUDGET / SECONDS_PER_POINT))
+        keep = density_sample(reduced_data, labels, target)
+        ax.scatter(reduced_data[keep, 0], reduced_data[keep, 1],
+                   c=labels[keep], cmap=cmap, norm=norm,
+                   alpha=0.6, s=6, linewidths=0, rasterized=True)
+    elif mode == 'hexbin':
+        ax.hexbin(reduced_data[:, 0], reduced_data[:, 1], gridsize=80,
+                  bins='log', cmap='Greys', mincnt=1)
+    else:
+        _raster_clusters(ax, reduced_data, labels, n_clusters, cmap)
+
+    # 标记聚类中心（大规模模式下总是标记；六边形分箱模式下中心按聚类着色，以区分各聚类）
+    if show_centers or mode != 'scatter':
+        centers = cluster_centers(reduced_data, labels, n_clusters)
+        center_colors = cmap(norm(np.arange(n_clusters))) if mode == 'hexbin' else 'red'
+        ax.scatter(centers[:, 0], centers[:, 1],
+                   c=center_colors, s=200, alpha=0.9, marker='X', edgecolor='k')
+
+    if mode == 'scatter':
+        ax.set_title(title.format(k=n_clusters))
+    else:
+        ax.set_title(f"{title.format(k=n_clusters)} [{mode}, {len(labels)} 点]")
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    fig.colorbar(ScalarMappable(norm=norm, cmap=cmap), ax=ax, label='聚类')
+    ax.grid(True, alpha=0.2)
+
+
+def _draw_user_clusters(fig, data, params, mode):
+    _draw_clusters(fig, data, params, mode, '用户聚类结果 (k={k})',
+                   'PCA 主成分 1', 'PCA 主成分 2', show_centers=False)
+
+
+def _draw_video_clusters(fig, data, params, mode):
+    _draw_clusters(fig, data, params, mode, '视频聚类结果 (k={k})',
+                   'SVD 主成分 1', 'SVD 主成分 2', show_centers=True)
+
+
+# 图表类型 -> (绘图函数, 画布尺寸)
+_DRAWERS = {
+    'heat': (_draw_heat, (10, 6)),
+    'user_clusters': (_draw_user_clusters, (10, 8)),
+    'video_clusters': (_draw_video_clusters, (10, 8)),
+}
+
+
+def render_chart(chart, dpi=DEFAULT_DPI, mode='auto'):
+    """
+    将图表渲染为 PNG 字节（带缓存）
+    使用独立的 Figure 对象而非 pyplot 全局状态，可在多线程中并发调用
+    mode 仅对聚类散点图生效，见 choose_scatter_mode
+    """
+    key = chart_key(chart, dpi, mode)
+    with _cache_lock:
+        png = _chart_cache.get(key)
+        if png is not None:
+            _chart_cache.move_to_end(key)
+            return png
+
+    if chart['task'] not in _DRAWERS:
+        raise ValueError(f"未知的图表类型: {chart['task']}")
+    draw, figsize = _DRAWERS[chart['task']]
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    draw(fig, chart['data'], chart['params'], mode)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight')
+    png = buffer.getvalue()
+    logging.info(f"图表 {chart['task']} 渲染完成 ({len(png)} 字节)")
+
+    with _cache_lock:
+        _chart_cache[key] = png
+        _chart_cache.move_to_end(key)
+        while len(_chart_cache) > MAX_CACHED_CHARTS:
+            _chart_cache.popitem(last=False)
+    return png
+
+
+def save_chart(chart, dpi=DEFAULT_DPI, mode='auto'):
+    """将图表写入以缓存键命名的文件，文件已存在时直接复用，返回文件路径"""
+    path = os.path.join(CHART_DIR, f"{chart['task']}_{chart_key(chart, dpi, mode)}.png")
+    if not os.path.exists(path):
+        os.makedirs(CHART_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(render_chart(chart, dpi, mode))
+        os.replace(tmp_path, path)  # 原子替换，并发写入互不覆盖
+    return path
+
+
+def clear_chart_cache():
+    """清除内存中的图表缓存"""
+    with _cache_lock:
+        _chart_cache.clear()
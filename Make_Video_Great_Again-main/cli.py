@@ -0,0 +1,189 @@
+# cli.py —— 无界面命令行入口：批量运行任务1-5
+# -*- coding: utf-8 -*-
+"""
+用法示例：
+    python -m cli task1 --ids 1 2 3
+    python -m cli task2 --ids-file users.txt --format jsonl --output rec.jsonl
+    cat videos.txt | python -m cli task3 --format csv
+    python -m cli task5 --n-clusters 8 --full --chart
+所有ID共用同一个已预热的 DataCache；每个任务的吞吐量输出到 stderr
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# 各任务：(说明, 是否需要ID列表)
+TASKS = {
+    'task1': ("寻找相似用户", True),
+    'task2': ("推荐视频", True),
+    'task3': ("预测视频热度", True),
+    'task4': ("用户聚类", False),
+    'task5': ("视频聚类", False),
+}
+OUTPUT_FORMATS = ('json', 'jsonl', 'csv')
+
+
+def _read_ids(args):
+    """从 --ids、--ids-file（'-' 表示标准输入）或管道输入读取ID列表（空白或逗号分隔）"""
+    if args.ids:
+        tokens = args.ids
+    elif args.ids_file:
+        stream = sys.stdin if args.ids_file == '-' else open(args.ids_file, encoding='utf-8')
+        with stream:
+            tokens = stream.read().replace(',', ' ').split()
+    elif not sys.stdin.isatty():
+        tokens = sys.stdin.read().replace(',', ' ').split()
+    else:
+        raise ValueError("请通过 --ids、--ids-file 或标准输入提供ID")
+
+    try:
+        return [int(token) for token in tokens]
+    except ValueError as e:
+        raise ValueError(f"ID必须为数字: {str(e)}")
+
+
+def _to_builtin(value):
+    """将 numpy 标量/数组转换为可 JSON 序列化的类型"""
+    if isinstance(value, dict):
+        return {str(key): _to_builtin(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_builtin(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _run_per_id(task, ids):
+    """对每个ID运行任务，单个ID失败不影响其它ID；返回 (记录列表, 失败数)"""
+    import task1_similar_users
+    import task2_recommend_videos
+    import task3_predict_heat
+
+    if task == 'task1':
+        run = task1_similar_users.find_similar_users
+    elif task == 'task2':
+        run = task2_recommend_videos.recommend_videos
+    else:
+        def run(video_id):
+            result = task3_predict_heat.predict_video_heat(video_id)
+            return {"history": result['history'], "forecast": result['forecast']}
+
+    records, failed = [], 0
+    for item_id in ids:
+        try:
+            records.append({"id": item_id, "result": _to_builtin(run(item_id))})
+        except Exception as e:
+            failed += 1
+            records.append({"id": item_id, "error": str(e)})
+    return records, failed
+
+
+def _run_clustering(task, args):
+    """运行聚类任务，返回 (每条数据一条记录, 0)；可选输出图表路径"""
+    if task == 'task4':
+        import task4_user_clustering
+        result = task4_user_clustering.cluster_users(args.n_clusters or 10, streaming=args.streaming)
+    else:
+        import task5_video_clustering
+        result = task5_video_clustering.cluster_videos(args.n_clusters or 5, full=args.full)
+
+    if args.chart:
+        print(f"图表已保存: {result['plot_path']}", file=sys.stderr)
+    return [_to_builtin(row) for row in result['data']], 0
+
+
+def _csv_rows(task, records):
+    """展开为列式（一行一个结果项）"""
+    for record in records:
+        if task in ('task4', 'task5'):
+            yield record
+        elif 'error' in record:
+            yield {"id": record['id'], "error": record['error']}
+        elif task == 'task3':
+            history = record['result']['history']
+            for day, daily in history['daily'].items():
+                yield {"id": record['id'], "day": int(day), "daily": daily,
+                       "cumulative": history['cumulative'][day]}
+            first_day = len(history['daily']) + 1
+            for offset, value in enumerate(record['result']['forecast']):
+                yield {"id": record['id'], "day": first_day + offset, "forecast": value}
+        else:
+            for rank, item in enumerate(record['result'], start=1):
+                yield dict({"id": record['id'], "rank": rank}, **item)
+
+
+def _write_output(task, records, fmt, stream):
+    if fmt == 'json':
+        json.dump(records, stream, ensure_ascii=False, indent=2)
+        stream.write('\n')
+    elif fmt == 'jsonl':
+        for record in records:
+            stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+    else:
+        rows = list(_csv_rows(task, records))
+        fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+        writer = csv.DictWriter(stream, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m cli', description="无界面批量运行视频分析任务")
+    parser.add_argument('task', choices=TASKS, help="任务编号")
+    parser.add_argument('--ids', nargs='+', help="用户ID（task1/2）或视频ID（task3）")
+    parser.add_argument('--ids-file', help="ID文件，'-' 表示标准输入")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='json', help="输出格式")
+    parser.add_argument('--output', help="输出文件（默认标准输出）")
+    parser.add_argument('--n-clusters', type=int, help="聚类数量（task4/5）")
+    parser.add_argument('--streaming', action='store_true', help="task4 使用流式模式")
+    parser.add_argument('--full', action='store_true', help="task5 对全部视频聚类")
+    parser.add_argument('--chart', action='store_true', help="task4/5 保存聚类图表")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    os.makedirs("data", exist_ok=True)
+    os.makedirs("results", exist_ok=True)
+
+    try:
+        from data_manager import DataManager
+
+        start = time.perf_counter()
+        DataManager()  # 初始化并预热缓存（数据缺失时生成）
+        print(f"数据加载: {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+        description, needs_ids = TASKS[args.task]
+        start = time.perf_counter()
+        if needs_ids:
+            ids = _read_ids(args)
+            records, failed = _run_per_id(args.task, ids)
+            count = len(ids)
+        else:
+            records, failed = _run_clustering(args.task, args)
+            count = len(records)
+        elapsed = time.perf_counter() - start
+    except Exception as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        return 1
+
+    print(f"{args.task}（{description}）: {count} 项, 失败 {failed}, "
+          f"用时 {elapsed:.2f}s, 吞吐量 {count / max(elapsed, 1e-9):.1f} 项/秒", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            _write_output(args.task, records, args.format, f)
+    else:
+        _write_output(args.task, records, args.format, sys.stdout)
+    return 1 if failed == count and count else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
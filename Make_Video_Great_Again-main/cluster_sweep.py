@@ -0,0 +1,74 @@
+# cluster_sweep.py —— 聚类数量 k 的并行扫描与质量评估
+# -*- coding: utf-8 -*-
+import logging
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import silhouette_score, davies_bouldin_score
+
+
+def _fit_and_score(features, k, kmeans_params, sample_idx):
+    """在工作进程中拟合一个 k 并计算质量指标"""
+    start = time.time()
+    kmeans = MiniBatchKMeans(n_clusters=k, **kmeans_params)
+    labels = kmeans.fit_predict(features)
+
+    sample, sample_labels = features[sample_idx], labels[sample_idx]
+    if len(np.unique(sample_labels)) > 1:
+        silhouette = float(silhouette_score(sample, sample_labels))
+        davies_bouldin = float(davies_bouldin_score(sample, sample_labels))
+    else:
+        silhouette = davies_bouldin = float('nan')
+
+    scores = {
+        "k": k,
+        "inertia": float(kmeans.inertia_),
+        "silhouette": round(silhouette, 4),
+        "davies_bouldin": round(davies_bouldin, 4),
+        "fit_seconds": round(time.time() - start, 3)
+    }
+    return kmeans, labels, scores
+
+
+def sweep_k(features, k_values, kmeans_params, n_jobs=-1, sample_size=5000, random_state=42):
+    """
+    对同一份特征矩阵并行拟合多个 k
+    特征矩阵只准备一次，joblib 会将大数组以内存映射方式共享给各工作进程
+    Args:
+        features: 聚类特征矩阵（稠密）
+        k_values: 待评估的聚类数量
+        kmeans_params: MiniBatchKMeans 的其余参数（与正式聚类保持一致）
+        n_jobs: 并行进程数，-1 表示使用全部CPU
+        sample_size: 计算轮廓系数和 DB 指数时的采样数
+    Returns:
+        (scores, models)：每个 k 的指标列表，以及 {k: (kmeans, labels)}
+    """
+    k_values = [int(k) for k in k_values]
+    if not k_values or min(k_values) < 2:
+        raise ValueError("聚类数量必须不小于2")
+
+    n_samples = features.shape[0]
+    if n_samples > sample_size:
+        sample_idx = np.random.default_rng(random_state).choice(n_samples, sample_size, replace=False)
+    else:
+        sample_idx = np.arange(n_samples)
+
+    start = time.time()
+    outputs = Parallel(n_jobs=n_jobs, backend='loky', max_nbytes='1M')(
+        delayed(_fit_and_score)(features, k, kmeans_params, sample_idx) for k in k_values
+    )
+    logging.info(f"k 值扫描完成: {k_values[0]}-{k_values[-1]}，耗时 {time.time() - start:.2f} 秒")
+
+    scores = [item[2] for item in outputs]
+    models = {item[2]['k']: (item[0], item[1]) for item in outputs}
+    return scores, models
+
+
+def best_k(scores):
+    """按轮廓系数选择最优 k（无有效分数时返回惯性最小者）"""
+    valid = [s for s in scores if not np.isnan(s['silhouette'])]
+    if valid:
+        return max(valid, key=lambda s: s['silhouette'])['k']
+    return min(scores, key=lambda s: s['inertia'])['k']
@@ -1,8 +1,109 @@
 # data_cache.py —— 全局缓存与哈希索引
 
 import pandas as pd
+import numpy as np
 import logging
 import os
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from profiling import profiled
+
+# 数据文件
+DATA_FILES = ['videos.csv', 'operations.csv', 'users.csv']
+
+# 操作数据覆盖的天数（day 取值 1-7）
+NUM_DAYS = 7
+
+# 单次加载（single-flight）：每种资源一把锁，同一时间只有一个线程加载，其余线程等待并复用其结果
+# 已加载后读取不加锁；clear_cache 按此顺序获取全部锁（与 load_daily_counts 内部的嵌套顺序一致，避免死锁）
+LOAD_ORDER = ('daily_counts', 'videos', 'operations', 'users')
+_load_locks = {name: threading.Lock() for name in LOAD_ORDER}
+
+# 派生缓存的清除函数（通过 DataCache.on_clear 登记），clear_cache 释放加载锁后依次调用
+_clear_hooks = []
+
+# 检查模式：设置该环境变量（或调用 DataCache.set_check_mode(True)）后，修改缓存数据会直接报错
+CHECK_MODE_ENV = 'VIDEO_CACHE_CHECK'
+
+# pandas 2.x 需显式开启写时复制（pandas >= 3.0 始终开启）
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+
+def _read_only_error(operation):
+    raise ValueError(f"缓存数据为只读，不能{operation}；请用 .assign() 派生新表或先 .copy()")
+
+
+def _freeze_frame(df):
+    """将数值列替换为不可写的 numpy 缓冲区（不复制数据）"""
+    columns = {}
+    for col in df.columns:
+        if isinstance(df[col].dtype, np.dtype):
+            values = df[col].to_numpy()
+            values.flags.writeable = False
+            columns[col] = values
+        else:
+            columns[col] = df[col].array
+    return pd.DataFrame(columns, index=df.index, copy=False)
+
+
+class _ReadOnlyIndexer:
+    """只读的 loc/iloc/at/iat：允许取值，禁止赋值"""
+
+    def __init__(self, indexer):
+        self._indexer = indexer
+
+    def __getitem__(self, key):
+        return self._indexer[key]
+
+    def __setitem__(self, key, value):
+        _read_only_error("按索引赋值")
+
+
+class FrozenDataFrame(pd.DataFrame):
+    """检查模式下返回的只读 DataFrame，任何原地修改都会抛出 ValueError；派生结果为普通 DataFrame"""
+
+    @property
+    def _constructor(self):
+        return pd.DataFrame
+
+    def __setitem__(self, key, value):
+        _read_only_error(f"设置列 {key!r}")
+
+    def __delitem__(self, key):
+        _read_only_error(f"删除列 {key!r}")
+
+    def insert(self, *args, **kwargs):
+        _read_only_error("插入列")
+
+    def pop(self, item):
+        _read_only_error(f"弹出列 {item!r}")
+
+    def update(self, *args, **kwargs):
+        _read_only_error("执行 update")
+
+    def _update_inplace(self, *args, **kwargs):
+        _read_only_error("执行 inplace 操作")
+
+    @property
+    def loc(self):
+        return _ReadOnlyIndexer(super().loc)
+
+    @property
+    def iloc(self):
+        return _ReadOnlyIndexer(super().iloc)
+
+    @property
+    def at(self):
+        return _ReadOnlyIndexer(super().at)
+
+    @property
+    def iat(self):
+        return _ReadOnlyIndexer(super().iat)
+
 
 class DataCache:
     """数据缓存管理类"""
@@ -13,6 +114,15 @@ class DataCache:
     _operations_df = None
     _users_df = None
     _user_ids = None
+
+    # 视频×天 计数矩阵：(视频ID索引, 观看数, 点赞数)，三者作为一个元组整体发布，行号与视频ID索引对齐
+    _daily_counts = None
+
+    # 数据版本号：缓存清除或数据变更时递增
+    _data_version = 0
+
+    # 检查模式（见 CHECK_MODE_ENV）
+    _check_mode = os.environ.get(CHECK_MODE_ENV, '') not in ('', '0')
     
     def __new__(cls):
         if not cls._instance:
@@ -20,49 +130,95 @@ class DataCache:
         return cls._instance
     
     @classmethod
+    def set_check_mode(cls, enabled=True):
+        """开启/关闭检查模式"""
+        cls._check_mode = bool(enabled)
+
+    @classmethod
+    def _view(cls, df):
+        """
+        返回缓存表的浅拷贝视图：底层 numpy 缓冲区不可写，并开启写时复制，
+        调用方增删列或赋值只影响自己的视图，不会破坏共享缓存，也不会复制整张表
+        """
+        if cls._check_mode:
+            return FrozenDataFrame(df, copy=False)
+        return df.copy(deep=False)
+
+    @classmethod
+    @profiled('datacache_load_videos')
     def load_videos(cls):
         """加载视频数据到缓存"""
-        if cls._videos_df is None:
-            try:
-                cls._videos_df = pd.read_csv('data/videos.csv')
-                logging.info("视频数据已加载到缓存")
-            except Exception as e:
-                logging.error(f"加载视频数据失败: {str(e)}")
-                raise
-        return cls._videos_df
+        videos_df = cls._videos_df
+        if videos_df is None:
+            with _load_locks['videos']:
+                if cls._videos_df is None:
+                    try:
+                        cls._videos_df = _freeze_frame(pd.read_csv('data/videos.csv'))
+                        logging.info("视频数据已加载到缓存")
+                    except Exception as e:
+                        logging.error(f"加载视频数据失败: {str(e)}")
+                        raise
+                videos_df = cls._videos_df
+        return cls._view(videos_df)
     
     @classmethod
+    @profiled('datacache_load_operations')
     def load_operations(cls):
         """加载操作数据到缓存"""
-        if cls._operations_df is None:
-            try:
-                cls._operations_df = pd.read_csv('data/operations.csv')
-                cls._user_ids = set(cls._operations_df['user_id'].astype(str))
-                logging.info("操作数据已加载到缓存")
-            except Exception as e:
-                logging.error(f"加载操作数据失败: {str(e)}")
-                raise
-        return cls._operations_df
+        operations_df = cls._operations_df
+        if operations_df is None:
+            with _load_locks['operations']:
+                if cls._operations_df is None:
+                    try:
+                        operations_df = _freeze_frame(pd.read_csv('data/operations.csv'))
+                        # 先发布用户ID集合，最后发布操作表：读到操作表时用户ID集合必然已就绪
+                        cls._user_ids = set(operations_df['user_id'].astype(str))
+                        cls._operations_df = operations_df
+                        logging.info("操作数据已加载到缓存")
+                    except Exception as e:
+                        logging.error(f"加载操作数据失败: {str(e)}")
+                        raise
+                operations_df = cls._operations_df
+        return cls._view(operations_df)
     
     @classmethod
+    @profiled('datacache_load_users')
     def load_users(cls):
         """加载用户数据到缓存"""
-        if cls._users_df is None:
-            try:
-                cls._users_df = pd.read_csv('data/users.csv')
-                logging.info("用户数据已加载到缓存")
-            except Exception as e:
-                logging.error(f"加载用户数据失败: {str(e)}")
-                raise
-        return cls._users_df
+        users_df = cls._users_df
+        if users_df is None:
+            with _load_locks['users']:
+                if cls._users_df is None:
+                    try:
+                        cls._users_df = _freeze_frame(pd.read_csv('data/users.csv'))
+                        logging.info("用户数据已加载到缓存")
+                    except Exception as e:
+                        logging.error(f"加载用户数据失败: {str(e)}")
+                        raise
+                users_df = cls._users_df
+        return cls._view(users_df)
     
     @classmethod
-    def preload_all(cls):
-        """预加载所有数据"""
+    def preload_all(cls, progress=None):
+        """
+        并行预加载三张数据表（CSV 解析大部分时间不占用 GIL）
+        Args:
+            progress: 可选回调 progress(表名, 耗时秒数)，每张表加载完成时在加载线程中调用
+        """
+        loaders = {'videos': cls.load_videos, 'operations': cls.load_operations, 'users': cls.load_users}
+
+        def timed_load(loader):
+            start = time.perf_counter()
+            loader()
+            return time.perf_counter() - start
+
         try:
-            cls.load_videos()
-            cls.load_operations()
-            cls.load_users()
+            with ThreadPoolExecutor(max_workers=len(loaders), thread_name_prefix='preload') as executor:
+                futures = {executor.submit(timed_load, loader): name for name, loader in loaders.items()}
+                for future in as_completed(futures):
+                    seconds = future.result()
+                    if progress is not None:
+                        progress(futures[future], seconds)
             logging.info("所有数据预加载完成")
         except Exception as e:
             logging.error(f"数据预加载失败: {str(e)}")
@@ -70,30 +226,148 @@ class DataCache:
     
     @classmethod
     def clear_cache(cls):
-        """清除所有缓存"""
-        cls._videos_df = None
+        """清除所有缓存（等待正在进行的加载完成后再清除，避免旧数据在清除后才发布）"""
+        with ExitStack() as stack:
+            for name in LOAD_ORDER:
+                stack.enter_context(_load_locks[name])
+            cls._reset()
+        # 派生缓存自行加锁，放在加载锁之外调用（避免与先持有派生缓存锁再加载数据的线程互相等待）
+        for hook in list(_clear_hooks):
+            hook()
+        logging.info("缓存已清除")
+
+    @classmethod
+    def on_clear(cls, hook):
+        """登记 clear_cache 时一并调用的无参函数，用于清除依赖缓存数据的派生缓存"""
+        _clear_hooks.append(hook)
+        return hook
+
+    @classmethod
+    def _reset(cls):
+        """清除所有缓存并更新版本号（调用方需已按 LOAD_ORDER 持有全部加载锁）"""
         cls._operations_df = None
+        cls._videos_df = None
         cls._users_df = None
         cls._user_ids = None
-        logging.info("缓存已清除")
+        cls._daily_counts = None
+        cls._data_version += 1
     
     @classmethod
     def get_user_ids(cls):
         """获取用户ID集合"""
-        if cls._user_ids is None:
+        user_ids = cls._user_ids
+        if user_ids is None:
             cls.load_operations()
-        return cls._user_ids
+            user_ids = cls._user_ids
+        return user_ids
     
+    @classmethod
+    @profiled('datacache_load_daily_counts')
+    def load_daily_counts(cls):
+        """
+        构建视频×天的观看/点赞计数矩阵，形状均为 (n_videos, 7)，int32
+        行号与视频数据的行顺序一致，只遍历一次操作数据
+        """
+        _, daily_views, daily_likes = cls._load_daily()
+        return daily_views, daily_likes
+
+    @classmethod
+    def _load_daily(cls):
+        """返回 (视频ID索引, 观看数矩阵, 点赞数矩阵)，首次调用时构建"""
+        daily_counts = cls._daily_counts
+        if daily_counts is None:
+            with _load_locks['daily_counts']:
+                if cls._daily_counts is None:
+                    try:
+                        videos_df = cls.load_videos()
+                        operations_df = cls.load_operations()
+                        video_index = pd.Index(videos_df['id'])
+                        n_videos = len(video_index)
+
+                        rows = video_index.get_indexer(operations_df['video_id'])
+                        days = operations_df['day'].to_numpy() - 1
+                        valid = (rows >= 0) & (days >= 0) & (days < NUM_DAYS)
+
+                        # 展平为 (视频行, 天) 的一维下标，bincount 一次完成计数
+                        flat = rows[valid] * NUM_DAYS + days[valid]
+                        liked = operations_df['liked'].to_numpy()[valid] == 1
+                        size = n_videos * NUM_DAYS
+                        daily_views = np.bincount(flat, minlength=size).astype(np.int32).reshape(n_videos, NUM_DAYS)
+                        daily_likes = np.bincount(flat[liked], minlength=size).astype(np.int32).reshape(n_videos, NUM_DAYS)
+                        daily_views.flags.writeable = False
+                        daily_likes.flags.writeable = False
+
+                        cls._daily_counts = (video_index, daily_views, daily_likes)
+                        logging.info("视频每日计数矩阵已构建")
+                    except Exception as e:
+                        logging.error(f"构建视频每日计数矩阵失败: {str(e)}")
+                        raise
+                daily_counts = cls._daily_counts
+        return daily_counts
+
+    @classmethod
+    def get_video_row(cls, video_id):
+        """获取视频在每日计数矩阵中的行号，不存在时返回 -1"""
+        video_index, _, _ = cls._load_daily()
+        return int(video_index.get_indexer([video_id])[0])
+
+    @classmethod
+    def get_video_daily_history(cls, video_id):
+        """获取单个视频第1-7天的每日观看数和点赞数（矩阵行切片）"""
+        video_index, daily_views, daily_likes = cls._load_daily()
+        row = int(video_index.get_indexer([video_id])[0])
+        if row < 0:
+            raise ValueError(f"视频ID {video_id} 不存在")
+        return daily_views[row], daily_likes[row]
+
+    @classmethod
+    def top_videos_by_day(cls, day, n=10, metric='views'):
+        """获取某一天观看数（或点赞数）最高的前n个视频"""
+        if not 1 <= day <= NUM_DAYS:
+            raise ValueError(f"天数必须在1-{NUM_DAYS}之间")
+        if metric not in ('views', 'likes'):
+            raise ValueError("metric 只能是 'views' 或 'likes'")
+
+        video_index, daily_views, daily_likes = cls._load_daily()
+        counts = (daily_views if metric == 'views' else daily_likes)[:, day - 1]
+        n = min(n, len(counts))
+        if n <= 0:
+            return pd.DataFrame({'video_id': [], metric: []})
+
+        # argpartition 取前n，再对这n个排序
+        top = np.argpartition(counts, -n)[-n:]
+        top = top[np.argsort(counts[top], kind='stable')[::-1]]
+        return pd.DataFrame({
+            'video_id': video_index[top].to_numpy(),
+            metric: counts[top]
+        })
+
+    @classmethod
+    def data_fingerprint(cls):
+        """根据数据文件的大小和修改时间计算指纹"""
+        digest = hashlib.sha1()
+        for file in DATA_FILES:
+            file_path = os.path.join('data', file)
+            if os.path.exists(file_path):
+                stat = os.stat(file_path)
+                digest.update(f"{file}:{stat.st_size}:{stat.st_mtime_ns};".encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    @classmethod
+    def get_data_version(cls):
+        """获取数据版本（文件指纹 + 进程内版本号），用于派生结果的缓存键"""
+        return f"{cls.data_fingerprint()}-{cls._data_version}"
+
     @classmethod
     def check_data_files(cls):
-        """检查数据文件是否存在且有效"""
-        required_files = ['videos.csv', 'operations.csv', 'users.csv']
-        for file in required_files:
+        """检查数据文件是否存在且有效（只读取表头，不解析整个文件）"""
+        for file in DATA_FILES:
             file_path = os.path.join('data', file)
             if not os.path.exists(file_path):
                 return False
             try:
-                pd.read_csv(file_path)
+                if len(pd.read_csv(file_path, nrows=0).columns) == 0:
+                    raise ValueError("缺少表头")
             except Exception as e:
                 logging.warning(f"文件 {file} 无效: {str(e)}")
                 return False
@@ -1,11 +1,12 @@
 import os
-import sys
+import threading
+import time
 import pandas as pd
-from PyQt6.QtWidgets import QMessageBox
 import generate_videos
 import generate_users_operations
 import logging
 from data_cache import DataCache
+import snapshot
 
 # 配置日志
 logging.basicConfig(
@@ -15,16 +16,27 @@ logging.basicConfig(
 )
 
 class DataManager:
-    """ 数据管理单例类（使用缓存机制） """
+    """ 数据管理单例类（使用缓存机制，不依赖 GUI，可在命令行和服务端使用） """
     _instance = None
+    _init_lock = threading.Lock()
 
-    def __new__(cls):
-        if not cls._instance:
-            cls._instance = super().__new__(cls)
-            cls._instance._init_data()
-        return cls._instance
+    def __new__(cls, progress=None):
+        """
+        Args:
+            progress: 可选回调 progress(阶段名, 耗时秒数)，用于加载界面显示进度
+        """
+        instance = cls._instance
+        if instance is None:
+            with cls._init_lock:
+                # 初始化完成后才发布单例，并发调用方不会拿到半初始化的实例
+                if cls._instance is None:
+                    instance = super().__new__(cls)
+                    instance._init_data(progress)
+                    cls._instance = instance
+                instance = cls._instance
+        return instance
 
-    def _init_data(self):
+    def _init_data(self, progress=None):
         """ 初始化数据（使用缓存机制） """
         try:
             # 创建数据目录
@@ -32,20 +44,28 @@ class DataManager:
             os.makedirs("results", exist_ok=True)
 
             # 检查数据文件是否存在且有效
+            start = time.perf_counter()
             if not DataCache.check_data_files():
                 logging.info("数据文件不存在或无效，开始生成新数据")
                 self._generate_initial_data()
+                if progress is not None:
+                    progress('generate', time.perf_counter() - start)
             else:
                 logging.info("使用现有数据文件")
 
-            # 预加载数据到缓存
-            DataCache.preload_all()
+            # 快照与数据文件一致时直接映射快照（含派生数据），否则并行预加载数据到缓存
+            start = time.perf_counter()
+            if snapshot.restore():
+                if progress is not None:
+                    progress('snapshot', time.perf_counter() - start)
+            else:
+                DataCache.preload_all(progress)
 
         except Exception as e:
+            # 初始化失败时不发布单例，由调用方（GUI 或命令行）决定如何提示
             error_msg = f"数据初始化失败: {str(e)}"
             logging.error(error_msg)
-            QMessageBox.critical(None, "数据错误", error_msg)
-            sys.exit(1)
+            raise RuntimeError(error_msg) from e
 
     def _generate_initial_data(self):
         """ 生成初始数据（仅在必要时） """
@@ -0,0 +1,214 @@
+# decayed_profiles.py —— 按时间指数衰减的用户-标签兴趣与视频热度，支持按天增量更新
+# -*- coding: utf-8 -*-
+"""
+第 d 天的一次操作在第 t 天（t >= d）的权重为 (1 + like_weight × liked) × decay^(t - d)
+
+实现上所有计数共用一个全局缩放系数 scale：真实值 = 存储值 × scale
+    - 切换到新的一天（roll over）只需 scale *= decay^天数，O(1)，不改动任何数组
+    - 写入一条第 d 天的操作时存储值加上 权重 / scale，只涉及这批新操作
+scale 过小时（存储值随之变大）把它乘回数组并重置为 1，摊还后可以忽略
+余弦相似度与行缩放无关，用户-标签矩阵可直接用存储值构建
+
+用法：
+    profiles = get_decayed_profiles(decay=0.8)
+    profiles.roll_over()                  # 进入新的一天
+    profiles.ingest(new_operations_df)    # 写入当天的新操作
+    profiles.top_videos(10)
+"""
+import copy
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_cache import DataCache
+import memory_budget
+from user_features import _accumulate
+
+DEFAULT_DECAY = 0.8
+LIKE_WEIGHT = 2.0  # 与用户-标签兴趣分数（观看 + 2×点赞）一致
+RENORMALIZE_BELOW = 1e-150
+# 分块写入时每条操作的估计内存（下标与权重数组）
+BYTES_PER_OP = 64
+CHUNK_SIZE = 1_000_000
+
+# 按 (数据版本, 衰减系数) 缓存的画像
+_profiles = None
+_profiles_lock = threading.Lock()
+
+
+class DecayedProfiles:
+    """时间衰减的用户-标签兴趣（用户数 × 标签数）与视频热度（按视频ID下标）"""
+
+    def __init__(self, videos_df, decay=DEFAULT_DECAY, like_weight=LIKE_WEIGHT):
+        """
+        Args:
+            videos_df: 含 id, tag 列的视频数据
+            decay: 每早一天权重乘以的衰减系数，1.0 表示不衰减
+            like_weight: 点赞相对观看的额外权重
+        """
+        if not 0 < decay <= 1:
+            raise ValueError("decay 必须在 (0, 1] 之间")
+        self.decay = decay
+        self.like_weight = like_weight
+        self.current_day = None
+        self.scale = 1.0
+        self.user_ids = np.empty(0, dtype=np.int64)
+        self.tags = np.empty(0, dtype=object)
+        self.user_tag = np.zeros((0, 0))          # 存储值，真实值 = 存储值 × scale
+        self.video_scores = np.zeros(0)          # 存储值，按视频ID下标
+        self._tag_lookup = np.empty(0, dtype=np.intp)  # 视频ID -> 标签列（-1 表示没有该视频）
+        self.n_operations = 0
+        self.skipped = 0
+        self.version = None
+        self.set_videos(videos_df)
+
+    def set_videos(self, videos_df):
+        """更新 视频ID -> 标签列 的查找数组；出现新标签时按字母顺序插入新的标签列"""
+        tags = np.unique(np.concatenate([self.tags, videos_df['tag'].astype(str).unique()])).astype(object)
+        if len(tags) != len(self.tags):
+            user_tag = np.zeros((self.user_tag.shape[0], len(tags)))
+            user_tag[:, np.searchsorted(tags, self.tags)] = self.user_tag
+            self.user_tag, self.tags = user_tag, tags
+
+        video_ids = videos_df['id'].to_numpy()
+        size = max(int(video_ids.max()) + 1 if len(video_ids) else 0, len(self._tag_lookup))
+        tag_lookup = np.full(size, -1, dtype=np.intp)
+        tag_lookup[:len(self._tag_lookup)] = self._tag_lookup
+        tag_lookup[video_ids] = np.searchsorted(self.tags, videos_df['tag'].astype(str).to_numpy())
+        self._tag_lookup = tag_lookup
+        if size > len(self.video_scores):
+            self.video_scores = np.concatenate([self.video_scores, np.zeros(size - len(self.video_scores))])
+
+    def roll_over(self, days=1):
+        """进入新的一天（O(1)）"""
+        self.advance_to((self.current_day or 0) + days)
+
+    def advance_to(self, day):
+        """切换到第 day 天：只更新全局缩放系数"""
+        if self.current_day is not None and day < self.current_day:
+            raise ValueError(f"只能前进到更晚的一天: 当前第{self.current_day}天，收到第{day}天")
+        if self.current_day is not None:
+            self.scale *= self.decay ** (day - self.current_day)
+            if self.scale < RENORMALIZE_BELOW:
+                self._renormalize()
+        self.current_day = day
+
+    def _renormalize(self):
+        self.user_tag *= self.scale
+        self.video_scores *= self.scale
+        self.scale = 1.0
+
+    def _add_users(self, user_ids):
+        new_users = np.setdiff1d(user_ids, self.user_ids, assume_unique=True)
+        if len(new_users):
+            positions = np.searchsorted(self.user_ids, new_users)
+            self.user_ids = np.insert(self.user_ids, positions, new_users)
+            self.user_tag = np.insert(self.user_tag, positions, 0.0, axis=0)
+
+    def ingest(self, operations_df):
+        """
+        写入一批操作，代价与这批操作数成正比
+        操作中晚于当前天的部分会先把当前天推进到其中最晚的一天；早于当前天的操作按其天数衰减后写入
+        Args:
+            operations_df: 含 user_id, video_id, liked, day 列的操作数据
+        """
+        if len(operations_df) == 0:
+            return
+        days = operations_df['day'].to_numpy().astype(np.int64)
+        latest = int(days.max())
+        if self.current_day is None or latest > self.current_day:
+            self.advance_to(latest)
+
+        liked = operations_df['liked'].to_numpy()
+        weights = (1.0 + self.like_weight * liked) * self.decay ** (self.current_day - days) / self.scale
+
+        vids = operations_df['video_id'].to_numpy()
+        cols = np.full(len(vids), -1, dtype=np.intp)
+        in_range = (vids >= 0) & (vids < len(self._tag_lookup))
+        cols[in_range] = self._tag_lookup[vids[in_range]]
+        tagged = cols >= 0
+        self.skipped += int((~tagged).sum())
+
+        user_ids = operations_df['user_id'].to_numpy().astype(np.int64)[tagged]
+        self._add_users(np.unique(user_ids))
+        rows = np.searchsorted(self.user_ids, user_ids)
+        _accumulate(self.user_tag, rows * len(self.tags) + cols[tagged], weights[tagged])
+        _accumulate(self.video_scores, vids[tagged], weights[tagged])
+        self.n_operations += len(days)
+
+    def copy(self):
+        """复制全部数组：在副本上 ingest 后再发布"""
+        clone = copy.copy(self)
+        for name in ('user_ids', 'user_tag', 'video_scores', '_tag_lookup'):
+            setattr(clone, name, getattr(self, name).copy())
+        return clone
+
+    def user_tag_scores(self):
+        """衰减后的用户-标签兴趣分数（真实值）"""
+        return self.user_tag * self.scale
+
+    def user_interests(self, user_id):
+        """单个用户的各标签兴趣分数，返回 {标签: 分数}，不存在的用户返回 None"""
+        position = np.searchsorted(self.user_ids, user_id)
+        if position >= len(self.user_ids) or self.user_ids[position] != user_id:
+            return None
+        return dict(zip(self.tags.tolist(), (self.user_tag[position] * self.scale).tolist()))
+
+    def active_rows(self):
+        """至少有一条有标签操作的用户下标"""
+        return np.flatnonzero(self.user_tag.sum(axis=1) > 0)
+
+    def top_videos(self, n=10, tag=None):
+        """衰减热度最高的 n 个视频，可按标签过滤"""
+        scores = self.video_scores[:len(self._tag_lookup)]
+        candidates = np.flatnonzero(scores > 0)
+        if tag is not None:
+            column = np.searchsorted(self.tags, tag)
+            if column >= len(self.tags) or self.tags[column] != tag:
+                return []
+            candidates = candidates[self._tag_lookup[candidates] == column]
+        n = min(n, len(candidates))
+        if n == 0:
+            return []
+        top = candidates[np.argpartition(scores[candidates], -n)[-n:]]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [{"video_id": int(video_id), "tag": self.tags[self._tag_lookup[video_id]],
+                 "score": round(float(scores[video_id] * self.scale), 2)} for video_id in top]
+
+    def stats(self):
+        return {"current_day": self.current_day, "decay": self.decay, "scale": self.scale,
+                "users": len(self.user_ids), "tags": len(self.tags), "operations": self.n_operations,
+                "skipped": self.skipped}
+
+
+def build_decayed_profiles(decay=DEFAULT_DECAY, chunk_size=CHUNK_SIZE):
+    """由缓存的操作数据构建衰减画像，当前天为数据中最晚的一天"""
+    profiles = DecayedProfiles(DataCache.load_videos(), decay=decay)
+    operations_df = DataCache.load_operations()
+    if len(operations_df):
+        profiles.advance_to(int(operations_df['day'].max()))
+    chunk_size = memory_budget.chunk_rows(BYTES_PER_OP, chunk_size)
+    for start in range(0, len(operations_df), chunk_size):
+        profiles.ingest(operations_df.iloc[start:start + chunk_size])
+    if profiles.skipped:
+        logging.warning(f"衰减画像忽略了 {profiles.skipped} 条找不到视频标签的操作")
+    logging.info(f"衰减画像已构建: {profiles.stats()}")
+    return profiles
+
+
+def get_decayed_profiles(decay=DEFAULT_DECAY):
+    """当前数据版本的衰减画像（首次调用时构建，并发调用时只构建一次）"""
+    global _profiles
+    key = (DataCache.get_data_version(), decay)
+    profiles = _profiles
+    if profiles is None or profiles.version != key:
+        with _profiles_lock:
+            if _profiles is None or _profiles.version != key:
+                profiles = build_decayed_profiles(decay)
+                profiles.version = key
+                _profiles = profiles
+            profiles = _profiles
+    return profiles
+
@@ -6,6 +6,13 @@ import logging
 import os
 from typing import List, Dict, Any
 from generate_videos import generate_videos
+import memory_budget
+
+# 逐条字典实现中每条操作的估计内存（字典、观看/点赞元组及列表槽位），以及分块实现每条操作的估计内存
+DICT_BYTES_PER_OP = 450
+CHUNK_BYTES_PER_OP = 64
+CHUNK_USERS = 5000
+VIDEO_CHUNK = 50000
 
 def validate_user_data(df: pd.DataFrame) -> bool:
     """验证用户数据的有效性"""
@@ -79,11 +86,98 @@ def generate_days(num_ops: int) -> List[int]:
     days = np.random.choice(np.arange(1, 8), num_ops, p=weights)
     return np.sort(days).tolist()
 
-def generate_users_operations(force: bool = False) -> None:
+def _format_pairs(users: np.ndarray, days: np.ndarray) -> str:
+    """格式化为与列表 repr 相同的 "[(用户, 天), ...]" 字符串"""
+    return '[' + ', '.join(f'({u}, {d})' for u, d in zip(users.tolist(), days.tolist())) + ']'
+
+
+def _merge_pairs(existing: str, new: str) -> str:
+    """在已有的观看/点赞记录字符串后追加新记录"""
+    if new == '[]':
+        return existing
+    if existing in ('[]', '') or not isinstance(existing, str):
+        return new
+    return existing[:-1] + ', ' + new[1:]
+
+
+def _generate_operations_chunked(users_df: pd.DataFrame, videos_df: pd.DataFrame,
+                                 min_ops: int, max_ops: int) -> None:
+    """
+    分块生成操作数据：按用户分块向量化生成并追加写入 CSV，不保存逐条字典；
+    观看/点赞记录以紧凑数组累积，最后按视频分块格式化写回 videos.csv
+    """
+    num_videos = len(videos_df)
+    views = np.zeros(num_videos, dtype=int)
+    likes = np.zeros(num_videos, dtype=int)
+    pair_videos, pair_users, pair_days, pair_liked = [], [], [], []
+
+    user_ids = users_df['id'].to_numpy()
+    chunk_users = memory_budget.chunk_rows((min_ops + max_ops) // 2 * CHUNK_BYTES_PER_OP, CHUNK_USERS)
+    for start in range(0, len(user_ids), chunk_users):
+        chunk_ids = user_ids[start:start + chunk_users]
+        num_ops = np.random.randint(min_ops, max_ops + 1, size=len(chunk_ids))
+        user_pos = np.repeat(np.arange(len(chunk_ids)), num_ops)
+
+        # 每个用户各自的每日权重，按累计概率抽取天数，并在用户内按天排序
+        weights = np.random.uniform(0.1, 0.4, (len(chunk_ids), 7))
+        cumulative = np.cumsum(weights / weights.sum(axis=1, keepdims=True), axis=1)
+        draws = np.random.random(len(user_pos))
+        days = np.minimum((draws[:, None] >= cumulative[user_pos]).sum(axis=1) + 1, 7)
+        order = np.lexsort((days, user_pos))
+        user_pos, days = user_pos[order], days[order]
+
+        video_ids = np.random.randint(1, num_videos + 1, size=len(user_pos))
+        liked = (np.random.random(len(user_pos)) < 0.3).astype(int)  # 30%概率点赞
+
+        operations_df = pd.DataFrame({
+            'user_id': chunk_ids[user_pos].astype(np.int64),
+            'video_id': video_ids.astype(np.int64),
+            'liked': liked,
+            'day': days.astype(np.int64)
+        })
+        if not validate_operations_data(operations_df):
+            raise ValueError("生成的操作数据验证失败")
+        operations_df.to_csv('data/operations.csv', index=False, header=(start == 0),
+                             mode='w' if start == 0 else 'a')
+
+        views += np.bincount(video_ids - 1, minlength=num_videos)
+        likes += np.bincount(video_ids - 1, weights=liked, minlength=num_videos).astype(int)
+        pair_videos.append((video_ids - 1).astype(np.int32))
+        pair_users.append(chunk_ids[user_pos].astype(np.int32))
+        pair_days.append(days.astype(np.int8))
+        pair_liked.append(liked.astype(bool))
+
+    # 按视频稳定排序（保持生成顺序），逐块格式化观看/点赞记录
+    pair_videos = np.concatenate(pair_videos)
+    order = np.argsort(pair_videos, kind='stable')
+    pair_videos = pair_videos[order]
+    pair_users = np.concatenate(pair_users)[order]
+    pair_days = np.concatenate(pair_days)[order]
+    pair_liked = np.concatenate(pair_liked)[order]
+    bounds = np.searchsorted(pair_videos, np.arange(num_videos + 1))
+
+    for start in range(0, num_videos, VIDEO_CHUNK):
+        chunk = videos_df.iloc[start:start + VIDEO_CHUNK]
+        viewed_by, liked_by = [], []
+        for offset, (old_viewed, old_liked) in enumerate(zip(chunk['viewed_by'], chunk['liked_by'])):
+            lo, hi = bounds[start + offset], bounds[start + offset + 1]
+            mask = pair_liked[lo:hi]
+            viewed_by.append(_merge_pairs(old_viewed, _format_pairs(pair_users[lo:hi], pair_days[lo:hi])))
+            liked_by.append(_merge_pairs(old_liked, _format_pairs(pair_users[lo:hi][mask], pair_days[lo:hi][mask])))
+        chunk = chunk.assign(views=views[start:start + len(chunk)], likes=likes[start:start + len(chunk)],
+                             viewed_by=viewed_by, liked_by=liked_by)
+        chunk.to_csv('data/videos.tmp.csv', index=False, header=(start == 0), mode='w' if start == 0 else 'a')
+    os.replace('data/videos.tmp.csv', 'data/videos.csv')
+
+
+def generate_users_operations(force: bool = False, num_users: int = 30000,
+                              min_ops: int = 100, max_ops: int = 200) -> None:
     """
     生成用户操作数据
     Args:
         force: 是否强制重新生成数据
+        num_users: 用户数量
+        min_ops, max_ops: 每个用户的操作次数范围
     """
     try:
         # 检查是否需要生成数据
@@ -96,11 +190,6 @@ def generate_users_operations(force: bool = False) -> None:
 
         logging.info("开始生成新的用户和操作数据")
         
-        # 设置参数
-        num_users = 30000
-        num_videos = 300000
-        min_ops, max_ops = 100, 200
-        
         # 生成用户年龄（使用NumPy优化性能）
         ages = np.random.normal(loc=35, scale=10, size=num_users)
         ages = np.clip(ages, 18, 60).astype(int)
@@ -111,12 +200,24 @@ def generate_users_operations(force: bool = False) -> None:
             'age': ages
         })
 
+        # 读取视频数据（视频数量以现有视频数据为准）
+        videos_df = pd.read_csv('data/videos.csv')
+        num_videos = len(videos_df)
+
+        # 逐条字典实现预计超出内存预算时，改用分块向量化生成
+        expected_ops = num_users * (min_ops + max_ops) // 2
+        if not memory_budget.fits(expected_ops * DICT_BYTES_PER_OP, "生成用户操作数据（逐条字典）"):
+            if not validate_user_data(users_df):
+                raise ValueError("生成的用户数据验证失败")
+            os.makedirs('data', exist_ok=True)
+            users_df.to_csv('data/users.csv', index=False, mode='w')
+            _generate_operations_chunked(users_df, videos_df, min_ops, max_ops)
+            logging.info("用户和操作数据生成完成（分块模式）")
+            return
+
         # 初始化视频统计信息
         views = np.zeros(num_videos, dtype=int)
         likes = np.zeros(num_videos, dtype=int)
-        
-        # 读取视频数据
-        videos_df = pd.read_csv('data/videos.csv')
         viewed_by = videos_df['viewed_by'].apply(eval).tolist()
         liked_by = videos_df['liked_by'].apply(eval).tolist()
         
@@ -35,11 +35,12 @@ def validate_video_data(df: pd.DataFrame) -> bool:
         logging.error(f"数据验证失败: {str(e)}")
         return False
 
-def generate_videos(force: bool = False) -> None:
+def generate_videos(force: bool = False, num_videos: int = 300000) -> None:
     """
     生成视频数据
     Args:
         force: 是否强制重新生成数据
+        num_videos: 视频数量
     """
     try:
         # 检查是否需要生成数据
@@ -53,7 +54,6 @@ def generate_videos(force: bool = False) -> None:
         
         # 视频标签列表
         tags = ['movie', 'music', 'game', 'life', 'tech', 'fashion', 'sports', 'food', 'education', 'travel']
-        num_videos = 300000
         
         # 使用列表推导式优化性能
         video_tags = [random.choice(tags) for _ in range(num_videos)]
@@ -0,0 +1,506 @@
+# ingestion.py —— 增量写入新操作：追加到操作日志，原地更新缓存的数据表和派生数据，不重新加载
+# -*- coding: utf-8 -*-
+"""
+ingest_operations(batch) 的步骤（全程按固定顺序持有各缓存的锁，与加载/构建互斥）：
+    1. 校验：列齐全、视频ID存在、day 在 1-NUM_DAYS、liked 为 0/1
+    2. 追加到 data/operations.csv（操作日志，flush + fsync 后才更新内存）
+    3. DataCache：操作表追加行、用户ID集合、视频表 views/likes 列、视频×天计数矩阵
+    4. 派生数据按新的数据版本发布：
+        用户特征库 / 衰减画像    在副本上累加这批操作
+        用户操作索引（任务2）    新行号写到各用户分段末尾，不重新排序
+        用户-标签矩阵（任务1）   只重新计算并标准化涉及的用户行
+已发布的对象不再改动，不加锁的读取方总是看到某一批写入前或写入后的完整状态。
+日志写入后任何一步更新失败时丢弃全部缓存，下次读取时按磁盘上的数据重建，内存与日志不会不一致。
+每批的代价与这批操作数、用户数和视频数成正比，与操作总数无关：
+    操作表各列和用户操作索引使用容量倍增的缓冲区，新行写在已发布对象引用的范围之外；
+    计数数组和特征库（按视频/用户计的大小）复制后更新
+    其余按数据版本缓存的结果（聚类特征与模型、图表、热门榜）随版本变化失效，下次使用时重建
+新出现的用户ID都大于已有用户时，矩阵行号不变；否则行号整体后移，与重新构建矩阵时一样。
+矩阵与其下标作为一个元组发布，查询只读取一次，总是使用一致的一组
+
+磁盘上 videos.csv 的 views/likes 不随每批改写，由 flush_video_counts() 统一写回：
+只按视频ID替换文件中的这两列，其余列（如 viewed_by / liked_by）保持文件原样。
+每 FLUSH_EVERY_BATCHES 批、保存快照前（snapshot.save）和进程退出时自动写回；
+写回只改变文件指纹，已缓存的派生数据改记为新版本，不重新构建
+
+用法：
+    python -m ingestion new_operations.csv --batch-size 1000
+"""
+import argparse
+import atexit
+import logging
+import os
+import sys
+import threading
+import time
+import weakref
+from contextlib import ExitStack
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+import data_cache
+from data_cache import DataCache, NUM_DAYS, LOAD_ORDER, _freeze_frame
+import decayed_profiles
+import task1_similar_users
+import task2_recommend_videos
+import trending
+import user_features
+
+OPERATIONS_LOG = 'data/operations.csv'
+OPERATION_COLUMNS = ['user_id', 'video_id', 'liked', 'day']
+
+# 新建缓冲区的最小行数；缓冲区容量不足时按需要的两倍重新分配
+MIN_BUFFER_ROWS = 1024
+
+# 每写入这么多批后自动写回 views/likes（0 表示只在显式调用、保存快照和进程退出时写回）
+FLUSH_EVERY_BATCHES = 100
+
+_ingest_lock = threading.Lock()
+# 内存中的视频表 views/likes 已更新、尚未写回时为其所在的数据目录（绝对路径），否则为 None
+_dirty_data_dir = None
+_batches_since_flush = 0
+
+# 本模块创建的追加缓冲区，以弱引用记录对应的已发布对象；
+# 缓存被清除、重新加载或从快照/共享内存恢复后对不上，下次写入时重新分配
+_operation_buffers = None   # (操作表, 列名 -> 列缓冲区)
+_index_capacity = None      # (用户操作索引的 starts, 各分段容量上界, 缓冲区已用长度)
+
+
+def _to_frame(batch):
+    """DataFrame、字典列表或 (user_id, video_id, liked, day) 元组列表 -> 校验后的 DataFrame"""
+    if isinstance(batch, pd.DataFrame):
+        frame = batch
+    else:
+        rows = list(batch)
+        frame = pd.DataFrame(rows) if rows and isinstance(rows[0], dict) else pd.DataFrame(rows, columns=OPERATION_COLUMNS)
+    missing = [col for col in OPERATION_COLUMNS if col not in frame.columns]
+    if missing:
+        raise ValueError(f"操作数据缺少列: {missing}")
+    try:
+        frame = frame[OPERATION_COLUMNS].astype(np.int64).reset_index(drop=True)
+    except (TypeError, ValueError):
+        raise ValueError("操作数据的各列必须为整数")
+
+    if not frame['day'].between(1, NUM_DAYS).all():
+        raise ValueError(f"天数必须在1-{NUM_DAYS}之间")
+    if not frame['liked'].isin((0, 1)).all():
+        raise ValueError("liked 只能是 0 或 1")
+    if (frame['user_id'] <= 0).any():
+        raise ValueError("用户ID必须为正整数")
+    # 视频×天计数矩阵的视频ID索引已缓存哈希表，按批查找只与批大小有关
+    video_index, _, _ = DataCache._load_daily()
+    unknown = video_index.get_indexer(frame['video_id']) < 0
+    if unknown.any():
+        raise ValueError(f"视频ID不存在: {frame.loc[unknown, 'video_id'].unique()[:10].tolist()}")
+    return frame
+
+
+def _locks():
+    """按与各模块内部嵌套相同的顺序获取全部相关的锁（先派生数据，后 DataCache）"""
+    stack = ExitStack()
+    for lock in (_ingest_lock, trending._engine_lock, task1_similar_users._matrix_lock,
+                 decayed_profiles._profiles_lock, user_features._store_lock,
+                 task2_recommend_videos._user_rows_lock):
+        stack.enter_context(lock)
+    for name in LOAD_ORDER:
+        stack.enter_context(data_cache._load_locks[name])
+    return stack
+
+
+def _append_log(frame):
+    with open(OPERATIONS_LOG, 'a', encoding='utf-8', newline='') as f:
+        frame.to_csv(f, header=False, index=False)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# ==================== 可写缓冲区 ====================
+
+def _owned(ref, obj):
+    """obj 是否为本模块创建、仍在发布中的对象（其余数组可能是内存映射或共享内存，不能写入）"""
+    return ref is not None and ref() is obj
+
+
+# ==================== DataCache ====================
+
+def _patch_tables(frame):
+    """追加操作表行、更新用户ID集合和视频表 views/likes；返回追加前的操作条数（操作表未缓存时为 None）"""
+    global _dirty_data_dir, _operation_buffers
+    n_before = None
+    operations_df = DataCache._operations_df
+    if operations_df is not None:
+        n_before = len(operations_df)
+        n_after = n_before + len(frame)
+        # 按容量倍增的列缓冲区：新行写在已发布的表引用范围之外，读取方看不到写入过程
+        buffers = _operation_buffers
+        if (buffers is None or not _owned(buffers[0], operations_df)
+                or n_after > len(next(iter(buffers[1].values()))())):
+            capacity = max(2 * n_after, MIN_BUFFER_ROWS)
+            columns = {}
+            for col in operations_df.columns:
+                values = operations_df[col].to_numpy()
+                columns[col] = np.empty(capacity, dtype=values.dtype)
+                columns[col][:n_before] = values
+            buffers = (None, {col: weakref.ref(buffer) for col, buffer in columns.items()})
+        else:
+            columns = {col: ref() for col, ref in buffers[1].items()}
+
+        views = {}
+        for col, buffer in columns.items():
+            buffer[n_before:n_after] = frame[col].to_numpy()
+            views[col] = buffer[:n_after]
+            views[col].flags.writeable = False
+        operations_df = pd.DataFrame(views, copy=False)
+        # 已发布的表只引用缓冲区的前 n_before 行；新表引用缓冲区，缓冲区随新表一起释放
+        _operation_buffers = (weakref.ref(operations_df), buffers[1])
+
+        # 与 load_operations 相同的发布顺序：先用户ID集合，后操作表（只在有新用户时复制集合）
+        new_ids = set(frame['user_id'].astype(str)) - DataCache._user_ids
+        if new_ids:
+            DataCache._user_ids = DataCache._user_ids | new_ids
+        DataCache._operations_df = operations_df
+
+    videos_df = DataCache._videos_df
+    if videos_df is not None and {'views', 'likes'} <= set(videos_df.columns):
+        daily_counts = DataCache._daily_counts
+        # 计数矩阵的视频ID索引与视频表行顺序一致，可直接复用
+        video_index = daily_counts[0] if daily_counts is not None else pd.Index(videos_df['id'])
+        rows = video_index.get_indexer(frame['video_id'])
+        # 只复制 views/likes 两列，在副本上累加后与其余列（不复制）组成新表发布
+        views, likes = np.array(videos_df['views']), np.array(videos_df['likes'])
+        np.add.at(views, rows, 1)
+        np.add.at(likes, rows, frame['liked'].to_numpy())
+        columns = {col: videos_df[col].array for col in videos_df.columns}
+        columns.update(views=views, likes=likes)
+        DataCache._videos_df = _freeze_frame(pd.DataFrame(columns, copy=False))
+        _dirty_data_dir = os.path.abspath('data')
+    return n_before
+
+
+def _patch_daily_counts(frame):
+    """视频×天计数矩阵：在副本上累加这批操作涉及的格子后发布（大小为 视频数×天数，与操作总数无关）"""
+    daily_counts = DataCache._daily_counts
+    if daily_counts is None:
+        return
+    video_index, daily_views, daily_likes = daily_counts
+    daily_views, daily_likes = daily_views.copy(), daily_likes.copy()
+    rows = video_index.get_indexer(frame['video_id'])
+    days = frame['day'].to_numpy() - 1
+    liked = frame['liked'].to_numpy() == 1
+    np.add.at(daily_views, (rows, days), 1)
+    np.add.at(daily_likes, (rows[liked], days[liked]), 1)
+    daily_views.flags.writeable = False
+    daily_likes.flags.writeable = False
+    DataCache._daily_counts = (video_index, daily_views, daily_likes)
+
+
+# ==================== 派生数据 ====================
+
+def _patch_feature_store(frame, old_version, new_version):
+    """在副本上累加这批操作后发布，不加锁的读取方持有的旧对象保持不变"""
+    store = user_features._store
+    if store is None or store.version != old_version:
+        return None
+    store = store.copy()
+    store.update(frame)
+    store.version = new_version
+    user_features._store = store
+    return store
+
+
+def _patch_decayed_profiles(frame, old_version, new_version):
+    profiles = decayed_profiles._profiles
+    if profiles is None or profiles.version != (old_version, profiles.decay):
+        return None
+    profiles = profiles.copy()
+    profiles.ingest(frame)
+    profiles.version = (new_version, profiles.decay)
+    decayed_profiles._profiles = profiles
+    return profiles
+
+
+def _patch_user_operation_index(frame, n_before, old_version, new_version):
+    """
+    新操作的行号（n_before 起）写到各用户分段末尾，等价于对全部行重新稳定排序
+    分段末尾留有空余容量；容量不足的分段整体搬到缓冲区尾部并把容量加倍，缓冲区本身也按容量倍增，
+    写入位置都在已发布索引的分段之外，每批只复制 用户数 大小的起止数组
+    """
+    global _index_capacity
+    index = task2_recommend_videos._user_rows_cache.get(old_version)
+    task2_recommend_videos._user_rows_cache.clear()
+    if index is None or n_before is None:
+        return
+    unique_users, order, starts, ends = index
+    if _index_capacity is not None and _owned(_index_capacity[0], starts):
+        _, limits, used = _index_capacity
+    else:
+        # 重新构建的索引分段首尾相接，没有空余容量
+        limits, used = ends, len(order)
+
+    user_ids = frame['user_id'].to_numpy()
+    by_user = np.argsort(user_ids, kind='stable')
+    batch_users, first, counts = np.unique(user_ids[by_user], return_index=True, return_counts=True)
+
+    # 新用户：插入空分段（容量为 0，下面会搬到尾部）
+    loc = np.searchsorted(unique_users, batch_users)
+    exists = (loc < len(unique_users)) & (unique_users[np.minimum(loc, len(unique_users) - 1)] == batch_users)
+    if exists.all():
+        starts, ends, limits = starts.copy(), ends.copy(), limits.copy()
+    else:
+        at = loc[~exists]
+        unique_users = np.insert(unique_users, at, batch_users[~exists])
+        starts, ends, limits = (np.insert(array, at, 0) for array in (starts, ends, limits))
+    segments = np.searchsorted(unique_users, batch_users)
+
+    # 放不下的分段搬到尾部，容量为搬移后长度的两倍
+    full = ends[segments] + counts > limits[segments]
+    moving = segments[full]
+    sizes = ends[moving] - starts[moving]
+    capacities = 2 * (sizes + counts[full])
+    required = used + int(capacities.sum())
+    if required > len(order):
+        grown = np.empty(max(2 * len(order), required, MIN_BUFFER_ROWS), dtype=order.dtype)
+        grown[:used] = order[:used]
+        order = grown
+    for segment, size, capacity in zip(moving.tolist(), sizes.tolist(), capacities.tolist()):
+        order[used:used + size] = order[starts[segment]:ends[segment]]
+        starts[segment], ends[segment], limits[segment] = used, used + size, used + capacity
+        used += capacity
+
+    positions = np.repeat(ends[segments] - first, counts) + np.arange(len(user_ids))
+    order[positions] = (n_before + by_user).astype(order.dtype)
+    ends[segments] += counts
+
+    _index_capacity = (weakref.ref(starts), limits, used)
+    task2_recommend_videos._user_rows_cache[new_version] = (unique_users, order, starts, ends)
+
+
+def _patch_user_tag_matrix(frame, store, profiles):
+    """
+    只重新计算并 L2 标准化涉及的用户行，其余行按连续区间整块复制（不重新构建 CSR）；新用户按用户ID顺序插入
+    """
+    state = task1_similar_users._matrix_state
+    if state is None:
+        return
+    matrix, user_to_idx, old_users = state
+    source = store if task1_similar_users.RECENCY_DECAY is None else profiles
+    if source is None or (task1_similar_users.RECENCY_DECAY is not None
+                          and source.decay != task1_similar_users.RECENCY_DECAY) \
+            or len(source.tags) != matrix.shape[1]:
+        # 没有可增量更新的来源：下次使用时重新构建
+        task1_similar_users._matrix_state = None
+        return
+
+    touched = np.unique(frame['user_id'].to_numpy())
+    rows = source.rows_for(touched) if store is source else np.searchsorted(source.user_ids, touched)
+    scores = (source.tag_scores(rows) if store is source else source.user_tag[rows]).astype(np.float64)
+    norms = np.sqrt((scores ** 2).sum(axis=1))
+    norms[norms == 0] = 1
+    scores /= norms[:, np.newaxis]
+
+    old_users = np.asarray(old_users)
+    loc = np.searchsorted(old_users, touched)
+    exists = (loc < len(old_users)) & (old_users[np.minimum(loc, len(old_users) - 1)] == touched)
+    new_users = old_users if exists.all() else np.insert(old_users, loc[~exists], touched[~exists])
+    touched_rows = np.searchsorted(new_users, touched)
+
+    # 新行号下各行的非零项数：未涉及的行沿用原值，涉及的行取重新计算的值
+    old_to_new = np.arange(len(old_users)) if new_users is old_users else np.searchsorted(new_users, old_users)
+    lengths = np.zeros(len(new_users), dtype=matrix.indptr.dtype)
+    lengths[old_to_new] = np.diff(matrix.indptr)
+    lengths[touched_rows] = np.count_nonzero(scores, axis=1)
+    indptr = np.zeros(len(new_users) + 1, dtype=matrix.indptr.dtype)
+    np.cumsum(lengths, out=indptr[1:])
+    data = np.empty(indptr[-1], dtype=matrix.data.dtype)
+    indices = np.empty(indptr[-1], dtype=matrix.indices.dtype)
+
+    # 未涉及的旧行被涉及的行和插入的新用户分隔成若干区间，区间内的行在新矩阵中仍然相邻，整块复制
+    updated = set(loc[exists].tolist())
+    breaks = np.unique(np.concatenate([[0, len(old_users)], loc[exists], loc[exists] + 1, loc[~exists]]))
+    for low, high in zip(breaks[:-1].tolist(), breaks[1:].tolist()):
+        if low in updated:
+            continue
+        begin, end = matrix.indptr[low], matrix.indptr[high]
+        dst = indptr[old_to_new[low]]
+        data[dst:dst + end - begin] = matrix.data[begin:end]
+        indices[dst:dst + end - begin] = matrix.indices[begin:end]
+    # 涉及的行：np.nonzero 按行优先返回，依次写入各行的位置
+    nonzero_rows, nonzero_cols = np.nonzero(scores)
+    row_nnz = lengths[touched_rows]
+    positions = np.repeat(indptr[touched_rows] - (np.cumsum(row_nnz) - row_nnz), row_nnz) + np.arange(len(nonzero_rows))
+    data[positions] = scores[nonzero_rows, nonzero_cols]
+    indices[positions] = nonzero_cols
+    matrix = csr_matrix((data, indices, indptr), shape=(len(new_users), matrix.shape[1]), copy=False)
+
+    # 矩阵、下标字典、用户ID数组作为一个元组整体发布
+    if new_users is old_users:
+        pass  # 行号不变，沿用原下标字典
+    elif np.array_equal(new_users[:len(old_users)], old_users):
+        # 新用户ID都大于已有用户：只追加下标
+        user_to_idx = dict(user_to_idx)
+        user_to_idx.update((uid, idx) for idx, uid in enumerate(new_users[len(old_users):].tolist(), len(old_users)))
+    else:
+        user_to_idx = {uid: idx for idx, uid in enumerate(new_users.tolist())}
+    task1_similar_users._matrix_state = (matrix, user_to_idx, new_users)
+
+
+def _write_video_counts(videos_df):
+    """按视频ID替换 videos.csv 的 views/likes 两列（先写临时文件再替换），调用方持有 _ingest_lock"""
+    global _dirty_data_dir, _batches_since_flush
+    path = os.path.join(_dirty_data_dir, 'videos.csv')
+    tmp_path = os.path.join(_dirty_data_dir, 'videos.tmp.csv')
+    on_disk = pd.read_csv(path)
+    rows = pd.Index(videos_df['id']).get_indexer(on_disk['id'])
+    found = rows >= 0
+    for col in ('views', 'likes'):
+        values = on_disk[col].to_numpy().copy()
+        values[found] = videos_df[col].to_numpy()[rows[found]]
+        on_disk[col] = values
+    on_disk.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    _dirty_data_dir = None
+    _batches_since_flush = 0
+
+
+def _relabel_derived(old_version, new_version):
+    """数据文件指纹变化而缓存内容不变（写回 views/likes）时，把派生数据改记为新版本，避免重新构建"""
+    store = user_features._store
+    if store is not None and store.version == old_version:
+        store.version = new_version
+    profiles = decayed_profiles._profiles
+    if profiles is not None and profiles.version == (old_version, profiles.decay):
+        profiles.version = (new_version, profiles.decay)
+    index = task2_recommend_videos._user_rows_cache.pop(old_version, None)
+    if index is not None:
+        task2_recommend_videos._user_rows_cache[new_version] = index
+
+
+def _discard_caches():
+    """丢弃 DataCache 与全部派生数据（调用方已持有全部锁）；未写回的 views/likes 先尽量写回"""
+    global _operation_buffers, _index_capacity
+    if _dirty_data_dir is not None and DataCache._videos_df is not None:
+        try:
+            _write_video_counts(DataCache._videos_df)
+        except Exception as e:
+            logging.warning(f"丢弃缓存前写回视频观看/点赞数失败: {str(e)}")
+    DataCache._reset()
+    task1_similar_users._matrix_state = None
+    task2_recommend_videos._user_rows_cache.clear()
+    user_features._store = None
+    decayed_profiles._profiles = None
+    trending._engine = None
+    _operation_buffers = _index_capacity = None
+    logging.warning("增量更新失败，已丢弃缓存，下次读取时重新加载")
+
+
+# ==================== 对外接口 ====================
+
+def ingest_operations(batch):
+    """
+    写入一批新操作并原地更新缓存
+    Args:
+        batch: DataFrame（含 user_id, video_id, liked, day 列）、字典列表或 (user_id, video_id, liked, day) 元组列表
+    Returns:
+        {"operations": 写入条数, "new_users": 新用户数, "seconds": 耗时}
+    """
+    global _batches_since_flush
+    start = time.perf_counter()
+    frame = _to_frame(batch)
+    if frame.empty:
+        return {"operations": 0, "new_users": 0, "seconds": 0.0}
+
+    try:
+        with _locks():
+            old_version = DataCache.get_data_version()
+            known_users = DataCache._user_ids
+            _append_log(frame)
+            DataCache._data_version += 1
+            new_version = DataCache.get_data_version()
+            _batches_since_flush += 1
+
+            try:
+                n_before = _patch_tables(frame)
+                _patch_daily_counts(frame)
+                store = _patch_feature_store(frame, old_version, new_version)
+                profiles = _patch_decayed_profiles(frame, old_version, new_version)
+                _patch_user_operation_index(frame, n_before, old_version, new_version)
+                _patch_user_tag_matrix(frame, store, profiles)
+            except Exception:
+                # 日志已写入而内存只更新了一部分：丢弃缓存，下次读取时按磁盘上的数据重建
+                _discard_caches()
+                raise
+            # 热门榜引擎要求按天递增消费，交给下次查询时用新数据重建
+            trending._engine = None
+    except Exception as e:
+        logging.error(f"写入新操作失败: {str(e)}")
+        raise RuntimeError(f"写入新操作失败: {str(e)}")
+
+    if FLUSH_EVERY_BATCHES and _batches_since_flush >= FLUSH_EVERY_BATCHES:
+        try:
+            flush_video_counts()
+        except RuntimeError:
+            pass  # 已记录错误，计数仍在内存中，下一批再试
+
+    new_users = 0 if known_users is None else len(set(frame['user_id'].astype(str)) - known_users)
+    seconds = time.perf_counter() - start
+    logging.info(f"已写入 {len(frame)} 条新操作（新用户 {new_users} 个），耗时 {seconds * 1000:.1f}ms")
+    return {"operations": len(frame), "new_users": new_users, "seconds": round(seconds, 6)}
+
+
+def flush_video_counts():
+    """
+    把内存中更新过的视频 views/likes 写回 videos.csv（数据文件指纹随之变化）；返回是否写入
+    读取磁盘上的文件，按视频ID只替换 views/likes 两列，缓存的视频表缺少的列（如从快照恢复时）不受影响
+    """
+    with _locks():
+        videos_df = DataCache._videos_df
+        if _dirty_data_dir is None or videos_df is None:
+            return False
+        try:
+            old_version = DataCache.get_data_version()
+            _write_video_counts(videos_df)
+            _relabel_derived(old_version, DataCache.get_data_version())
+            logging.info("视频观看/点赞数已写回 videos.csv")
+            return True
+        except Exception as e:
+            logging.error(f"写回视频观看/点赞数失败: {str(e)}")
+            raise RuntimeError(f"写回视频观看/点赞数失败: {str(e)}")
+
+
+def _flush_at_exit():
+    """进程退出时写回尚未写回的 views/likes（数据目录已不存在时跳过）"""
+    if _dirty_data_dir is None or not os.path.isdir(_dirty_data_dir):
+        return
+    try:
+        flush_video_counts()
+    except RuntimeError:
+        pass
+
+
+atexit.register(_flush_at_exit)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ingestion', description="增量写入新操作")
+    parser.add_argument('path', help="新操作 CSV 文件（含 user_id, video_id, liked, day 列）")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    total, start = 0, time.perf_counter()
+    try:
+        for chunk in pd.read_csv(args.path, chunksize=args.batch_size):
+            total += ingest_operations(chunk)["operations"]
+        flush_video_counts()
+    except (RuntimeError, ValueError) as e:
+        print(f"写入失败: {str(e)}", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    print(f"已写入 {total} 条操作，耗时 {elapsed:.2f} 秒（{total / max(elapsed, 1e-9):.0f} 条/秒）")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
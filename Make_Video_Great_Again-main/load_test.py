@@ -0,0 +1,94 @@
+# load_test.py —— server.py 的压测客户端：报告 QPS 与延迟分位数
+# -*- coding: utf-8 -*-
+"""
+用法：
+    python -m load_test --endpoint /similar_users --concurrency 64 --duration 10
+用户ID从 data/users.csv 中随机抽取（也可用 --max-user-id 指定范围）
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+
+async def _request(reader, writer, host, path):
+    """在 keep-alive 连接上发送一个 GET 请求，返回 (状态码, 响应体)"""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('latin-1'))
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    length = 0
+    for line in lines[1:]:
+        if line.lower().startswith('content-length:'):
+            length = int(line.split(':', 1)[1])
+    body = await reader.readexactly(length)
+    return status, body
+
+
+async def _worker(host, port, endpoint, user_ids, deadline, latencies, statuses, seed):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            path = f"{endpoint}?user_id={rng.choice(user_ids)}"
+            start = time.perf_counter()
+            status, _ = await _request(reader, writer, host, path)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run_load_test(host, port, endpoint, user_ids, concurrency, duration):
+    """以固定并发数持续发送请求，返回统计结果"""
+    latencies, statuses = [], {}
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*[
+        _worker(host, port, endpoint, user_ids, deadline, latencies, statuses, seed)
+        for seed in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99]) if len(latencies_ms) else (0.0, 0.0, 0.0)
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "seconds": round(elapsed, 2),
+        "qps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "status": {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m load_test', description="推荐服务压测")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--endpoint', default='/similar_users', choices=['/similar_users', '/recommend'])
+    parser.add_argument('--concurrency', type=int, default=32, help="并发连接数")
+    parser.add_argument('--duration', type=float, default=10.0, help="压测时长（秒）")
+    parser.add_argument('--max-user-id', type=int, help="从 1..N 中随机选择用户ID（默认读取 data/users.csv）")
+    args = parser.parse_args(argv)
+
+    if args.max_user_id:
+        user_ids = list(range(1, args.max_user_id + 1))
+    else:
+        import pandas as pd
+        user_ids = pd.read_csv('data/users.csv', usecols=['id'])['id'].tolist()
+
+    stats = asyncio.run(run_load_test(args.host, args.port, args.endpoint, user_ids,
+                                      args.concurrency, args.duration))
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
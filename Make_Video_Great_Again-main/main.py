@@ -1,7 +1,9 @@
 import sys
 import os
-from PyQt6.QtWidgets import QApplication
-from data_manager import DataManager
+from PyQt6.QtCore import QTimer
+from PyQt6.QtWidgets import QApplication, QMessageBox
+from preload import Preloader
+import snapshot
 from ui import LoadingSplash, MainWindow
 
 if __name__ == "__main__":
@@ -11,13 +13,44 @@ if __name__ == "__main__":
     os.makedirs("data", exist_ok=True)
     os.makedirs("results", exist_ok=True)
 
-    # 显示加载界面
+    # 显示加载界面，后台并行加载数据
     splash = LoadingSplash()
-    DataManager()  # 初始化数据
+    preloader = Preloader().start()
+
+    # 必需数据就绪前持续刷新闪屏进度
+    while not preloader.wait_required(timeout=0.05):
+        for event in preloader.drain_events():
+            splash.show_progress(event)
+        app.processEvents()
+    for event in preloader.drain_events():
+        splash.show_progress(event)
+
+    if preloader.error is not None:
+        splash.close()
+        QMessageBox.critical(None, "数据错误", str(preloader.error))
+        sys.exit(1)
     splash.close()
 
-    # 显示主界面
+    # 显示主界面（派生数据在后台继续预热，进度显示在状态栏）
     window = MainWindow()
     window.show()
 
-    sys.exit(app.exec())
\ No newline at end of file
+    def show_background_progress():
+        for event in preloader.drain_events():
+            window.statusBar().showMessage(event.message, 5000)
+        if preloader.wait_finished(timeout=0):
+            progress_timer.stop()
+
+    progress_timer = QTimer()
+    progress_timer.timeout.connect(show_background_progress)
+    progress_timer.start(200)
+
+    exit_code = app.exec()
+
+    # 退出时更新快照（包含本次运行中构建的聚类特征等），下次启动直接恢复
+    if snapshot.is_enabled() and preloader.error is None:
+        try:
+            snapshot.save()
+        except RuntimeError:
+            pass  # 已记录日志，不影响退出
+    sys.exit(exit_code)
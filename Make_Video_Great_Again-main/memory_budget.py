@@ -0,0 +1,221 @@
+# memory_budget.py —— 内存预算：按预计占用选择常规/分块实现，并记录各任务的峰值 RSS
+# -*- coding: utf-8 -*-
+"""
+预算指整个进程的常驻内存上限，通过环境变量 VIDEO_MEMORY_BUDGET_MB 设置（或调用 set_budget），默认取物理内存的一半
+各步骤以 预算 - 当前常驻内存 作为可用空间来选择实现
+psutil 为可选依赖：未安装时从 /proc/self/statm 读取 RSS
+任务峰值内存记录默认关闭（每次查询只多一次布尔判断），通过 VIDEO_MEMORY_TRACK=1 或 set_tracking(True) 开启；
+开启后所有被记录的任务共用一个后台采样线程，无法读取 RSS 时只记录耗时
+"""
+import functools
+import logging
+import os
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+MEMORY_BUDGET_ENV = 'VIDEO_MEMORY_BUDGET_MB'
+MEMORY_TRACK_ENV = 'VIDEO_MEMORY_TRACK'
+RSS_SAMPLE_INTERVAL = 0.01  # 峰值 RSS 采样间隔（秒）
+MB = 1024 * 1024
+
+_budget_override = None
+_tracking = os.environ.get(MEMORY_TRACK_ENV, '').strip().lower() not in ('', '0', 'off', 'false')
+_active = threading.local()  # 嵌套任务只在最外层记录
+
+# 共用的 RSS 采样线程，按进行中的任务数引用计数启停
+_monitor = None
+_monitor_lock = threading.Lock()
+
+# 任务名称 -> 最近一次运行的内存统计
+last_peaks = {}
+
+
+def _total_memory():
+    if psutil is not None:
+        return psutil.virtual_memory().total
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def set_budget(megabytes):
+    """设置内存预算（MB），None 表示恢复为环境变量/默认值"""
+    global _budget_override
+    _budget_override = None if megabytes is None else int(megabytes * MB)
+
+
+def set_tracking(enabled=True):
+    """在运行时开启/关闭任务峰值内存记录（等价于设置环境变量）"""
+    global _tracking
+    _tracking = bool(enabled)
+
+
+def is_tracking():
+    return _tracking
+
+
+def get_budget():
+    """当前内存预算（字节），无法确定时返回 None（不限制）"""
+    if _budget_override is not None:
+        return _budget_override
+    value = os.environ.get(MEMORY_BUDGET_ENV)
+    if value:
+        return int(float(value) * MB)
+    total = _total_memory()
+    return total // 2 if total else None
+
+
+def _headroom(budget):
+    """预算减去当前常驻内存后的剩余空间（字节）"""
+    return max(budget - (current_rss() or 0), 0)
+
+
+def fits(estimated_bytes, step):
+    """判断某个步骤的预计占用加上当前常驻内存是否在预算内，并记录选择结果"""
+    budget = get_budget()
+    if budget is None:
+        ok = True
+        detail = "预算 不限"
+    else:
+        headroom = _headroom(budget)
+        ok = estimated_bytes <= headroom
+        detail = f"预算 {budget / MB:.0f}MB, 剩余 {headroom / MB:.0f}MB"
+    logging.info(f"{step}: 预计占用 {estimated_bytes / MB:.1f}MB, {detail}, "
+                 f"使用{'常规' if ok else '分块/流式'}实现")
+    return ok
+
+
+def chunk_rows(bytes_per_row, default, fraction=0.25):
+    """按剩余预算的一部分计算每块行数（至少 1 行，至多 default 行）"""
+    budget = get_budget()
+    if budget is None:
+        return default
+    return int(max(1, min(default, _headroom(budget) * fraction // max(bytes_per_row, 1))))
+
+
+def estimate_csv_rows(path, sample_bytes=1 << 16):
+    """根据文件大小和开头若干行的平均长度估计 CSV 行数（无需读取整个文件）"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        sample = f.read(sample_bytes)
+    lines = sample.count(b'\n')
+    if lines <= 1:
+        return lines
+    return int(size / (len(sample) / lines))
+
+
+def current_rss():
+    """当前进程常驻内存（字节），无法获取时返回 None"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _Window:
+    """一个进行中任务的峰值 RSS（按对象身份登记和注销，峰值相同的任务互不影响）"""
+    __slots__ = ('peak',)
+
+    def __init__(self, peak):
+        self.peak = peak
+
+
+class _RssMonitor(threading.Thread):
+    """后台线程按固定间隔读取 RSS，更新每个进行中任务的峰值"""
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        super().__init__(daemon=True, name='rss-monitor')
+        self.interval = interval
+        self.windows = []  # 进行中任务的 _Window 列表
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            rss = current_rss() or 0
+            with _monitor_lock:
+                for window in self.windows:
+                    window.peak = max(window.peak, rss)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def _open_window(start_rss):
+    """登记一个进行中的任务，必要时启动采样线程"""
+    global _monitor
+    window = _Window(start_rss)
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = _RssMonitor()
+            _monitor.start()
+        _monitor.windows.append(window)
+    return window
+
+
+def _close_window(window):
+    """注销任务并返回其峰值 RSS；最后一个任务结束时停止采样线程"""
+    global _monitor
+    rss = current_rss() or 0
+    with _monitor_lock:
+        peak = max(window.peak, rss)
+        _monitor.windows.remove(window)
+        if not _monitor.windows:
+            _monitor.stop()
+            _monitor = None
+    return peak
+
+
+def _run_tracked(name, func, args, kwargs):
+    budget = get_budget()
+    start_rss = current_rss()
+    window = _open_window(start_rss) if start_rss is not None else None
+
+    _active.depth = 1
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _active.depth = 0
+        seconds = round(time.perf_counter() - start, 3)
+        if window is None:
+            last_peaks[name] = {"peak_mb": None, "delta_mb": None,
+                                "budget_mb": None if budget is None else round(budget / MB, 1),
+                                "seconds": seconds, "source": None}
+            logging.info(f"任务 {name} 无法读取常驻内存，只记录耗时 {seconds}s")
+        else:
+            peak = _close_window(window)
+            last_peaks[name] = {
+                "peak_mb": round(peak / MB, 1),
+                "delta_mb": round((peak - start_rss) / MB, 1),
+                "budget_mb": None if budget is None else round(budget / MB, 1),
+                "seconds": seconds,
+                "source": 'RSS',
+            }
+            message = (f"任务 {name} 峰值内存(RSS) {peak / MB:.1f}MB "
+                       f"(增量 {(peak - start_rss) / MB:.1f}MB), "
+                       f"预算 {'不限' if budget is None else f'{budget / MB:.0f}MB'}")
+            if budget is not None and peak > budget:
+                logging.warning(f"{message}，已超出预算")
+            else:
+                logging.info(message)
+
+
+def track_memory(name):
+    """记录任务峰值内存并与预算比较的装饰器（未开启记录或嵌套调用时直接调用原函数）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _tracking or getattr(_active, 'depth', 0):
+                return func(*args, **kwargs)
+            return _run_tracked(name, func, args, kwargs)
+        return wrapper
+    return decorator
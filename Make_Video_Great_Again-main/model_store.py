@@ -0,0 +1,114 @@
+# model_store.py —— 聚类模型的版本化持久化
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import joblib
+
+MODEL_DIR = 'results/models'
+KEEP_VERSIONS = 5   # 每个模型保留的最新版本数，保存新版本时删除更早的文件
+MAX_LOADED = 8      # 内存中最多缓存的模型数（按最近使用淘汰）
+
+# 已加载模型的内存缓存（LRU）：(名称, 版本) -> 模型
+_loaded = OrderedDict()
+_lock = threading.Lock()
+
+
+def _artifact_path(name, version):
+    return os.path.join(MODEL_DIR, f"{name}_v{version}.joblib")
+
+
+def _meta_path(name):
+    return os.path.join(MODEL_DIR, f"{name}_latest.json")
+
+
+def _remember(name, version, artifact):
+    """放入 LRU 缓存，超出 MAX_LOADED 时淘汰最久未使用的模型（调用方持有 _lock）"""
+    _loaded[(name, version)] = artifact
+    _loaded.move_to_end((name, version))
+    while len(_loaded) > MAX_LOADED:
+        _loaded.popitem(last=False)
+
+
+def _prune(name, keep):
+    """删除最新 keep 个版本之前的模型文件（调用方持有 _lock）"""
+    for version in list_versions(name)[:-keep]:
+        _loaded.pop((name, version), None)
+        try:
+            os.remove(_artifact_path(name, version))
+        except OSError as e:
+            logging.warning(f"删除模型 {name} 的旧版本 {version} 失败: {str(e)}")
+
+
+def list_versions(name):
+    """列出某个模型已保存的全部版本号（升序）"""
+    if not os.path.isdir(MODEL_DIR):
+        return []
+    pattern = re.compile(rf"^{re.escape(name)}_v(\d+)\.joblib$")
+    return sorted(int(m.group(1)) for m in map(pattern.match, os.listdir(MODEL_DIR)) if m)
+
+
+def latest_meta(name):
+    """读取最新版本的元信息，不存在时返回 None"""
+    path = _meta_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_model(name, artifact, meta):
+    """
+    保存一个新版本的模型
+    Args:
+        name: 模型名称，如 'user_clusters'
+        artifact: 需要持久化的对象（字典，包含 scaler/pca/kmeans 等）
+        meta: 可 JSON 序列化的元信息（数据版本、参数等）
+    只保留最新的 KEEP_VERSIONS 个版本
+    Returns:
+        新版本号
+    """
+    with _lock:
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        versions = list_versions(name)
+        version = versions[-1] + 1 if versions else 1
+        path = _artifact_path(name, version)
+
+        tmp_path = f"{path}.tmp"
+        joblib.dump(artifact, tmp_path)
+        os.replace(tmp_path, path)
+
+        meta = dict(meta, name=name, version=version, path=path, created=time.strftime('%Y-%m-%d %H:%M:%S'))
+        tmp_meta = f"{_meta_path(name)}.tmp"
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_meta, _meta_path(name))
+
+        _remember(name, version, artifact)
+        _prune(name, KEEP_VERSIONS)
+    logging.info(f"模型 {name} 已保存为版本 {version}")
+    return version
+
+
+def load_model(name, version=None):
+    """加载指定版本（默认最新版本）的模型"""
+    if version is None:
+        meta = latest_meta(name)
+        if meta is None:
+            raise ValueError(f"模型 {name} 尚未保存，请先运行一次聚类")
+        version = meta['version']
+
+    with _lock:
+        artifact = _loaded.get((name, version))
+        if artifact is None:
+            path = _artifact_path(name, version)
+            if not os.path.exists(path):
+                raise ValueError(f"模型 {name} 的版本 {version} 不存在")
+            artifact = joblib.load(path)
+        _remember(name, version, artifact)
+        return artifact
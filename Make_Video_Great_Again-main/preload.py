@@ -0,0 +1,161 @@
+# preload.py —— 后台预加载：并行加载数据表，再按依赖顺序预热派生数据，并向加载界面推送进度
+# -*- coding: utf-8 -*-
+"""
+阶段：
+    1. 检查/生成数据文件，并行加载 videos / operations / users（必需，完成后即可打开主界面）
+    2. 按依赖顺序预热派生数据：视频每日计数、用户-标签矩阵、用户操作索引（失败不影响使用，首次用到时再构建）
+    3. 未能从快照恢复时，把预热结果写入快照，下次启动直接映射（见 snapshot.py）
+进度事件同时写入 events 队列（供 GUI 主线程轮询）并调用可选回调（在后台线程中调用）
+
+用法：
+    preloader = Preloader().start()
+    while not preloader.wait_required(timeout=0.05):
+        for event in preloader.drain_events():
+            ...
+"""
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from data_cache import DataCache
+import snapshot
+
+# 进度事件：stage 阶段名, label 显示名称, status 'done'/'error'/'ready'/'finished',
+# completed/total 已完成/总阶段数, seconds 该阶段耗时, message 说明文字
+PreloadEvent = namedtuple('PreloadEvent', 'stage label status completed total seconds message')
+
+# 必需阶段（主界面打开前完成）
+REQUIRED_STAGES = {
+    'videos': "视频数据",
+    'operations': "操作数据",
+    'users': "用户数据",
+}
+
+
+def _warm_daily_counts():
+    DataCache.load_daily_counts()
+
+
+def _warm_user_tag_matrix():
+    import task1_similar_users
+    task1_similar_users.initialize_matrix()
+
+
+def _warm_user_operation_index():
+    import task2_recommend_videos
+    task2_recommend_videos._user_operation_index()
+
+
+# 派生阶段：(阶段名, 显示名称, 依赖的阶段, 预热函数)，按依赖顺序排列
+DERIVED_STAGES = [
+    ('daily_counts', "视频每日计数", ('videos', 'operations'), _warm_daily_counts),
+    ('user_tag_matrix', "用户-标签矩阵", ('videos', 'operations'), _warm_user_tag_matrix),
+    ('user_operation_index', "用户操作索引", ('operations',), _warm_user_operation_index),
+]
+
+
+class Preloader:
+    """后台预加载器"""
+
+    def __init__(self, callback=None, warm_derived=True):
+        self.callback = callback
+        self.warm_derived = warm_derived
+        self.events = queue.Queue()
+        self.error = None
+        self._required = threading.Event()
+        self._finished = threading.Event()
+        self._completed = 0
+        self._total = len(REQUIRED_STAGES) + (len(DERIVED_STAGES) if warm_derived else 0)
+        self._thread = None
+
+    def start(self):
+        """启动后台线程（daemon，不阻止程序退出）"""
+        self._thread = threading.Thread(target=self._run, name='preloader', daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def progress(self):
+        """已完成阶段的比例（0-1）"""
+        return self._completed / self._total if self._total else 1.0
+
+    def wait_required(self, timeout=None):
+        """等待必需数据就绪（或加载失败），超时返回 False"""
+        return self._required.wait(timeout)
+
+    def wait_finished(self, timeout=None):
+        """等待全部阶段完成"""
+        return self._finished.wait(timeout)
+
+    def drain_events(self):
+        """取出目前为止的全部进度事件（不阻塞）"""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def _emit(self, stage, label, status, seconds=0.0, message=''):
+        if status == 'done':
+            self._completed += 1
+        event = PreloadEvent(stage, label, status, self._completed, self._total, round(seconds, 3), message)
+        self.events.put(event)
+        if self.callback is not None:
+            try:
+                self.callback(event)
+            except Exception as e:
+                logging.warning(f"预加载进度回调失败: {str(e)}")
+
+    def _on_table_loaded(self, stage, seconds):
+        """DataManager / DataCache.preload_all 的进度回调"""
+        if stage == 'snapshot':
+            for name, label in REQUIRED_STAGES.items():
+                self._emit(name, label, 'done', seconds, f"{label}已从快照恢复")
+        elif stage in REQUIRED_STAGES:
+            self._emit(stage, REQUIRED_STAGES[stage], 'done', seconds, f"{REQUIRED_STAGES[stage]}已加载")
+        else:
+            self._emit(stage, "数据生成", 'generated', seconds, "数据文件已生成")
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            from data_manager import DataManager
+            DataManager(progress=self._on_table_loaded)
+        except Exception as e:
+            self.error = e
+            self._emit('required', "数据加载", 'error', time.perf_counter() - start, str(e))
+            self._required.set()
+            self._finished.set()
+            return
+
+        self._emit('required', "数据加载", 'ready', time.perf_counter() - start, "必需数据已就绪")
+        self._required.set()
+
+        if self.warm_derived:
+            done = set(REQUIRED_STAGES)
+            for stage, label, depends, warm in DERIVED_STAGES:
+                stage_start = time.perf_counter()
+                missing = [dep for dep in depends if dep not in done]
+                try:
+                    if missing:
+                        raise RuntimeError(f"依赖未就绪: {missing}")
+                    warm()
+                    done.add(stage)
+                    self._emit(stage, label, 'done', time.perf_counter() - stage_start, f"{label}已预热")
+                except Exception as e:
+                    # 派生数据预热失败不影响使用（首次用到时再构建）
+                    logging.warning(f"预热 {label} 失败: {str(e)}")
+                    self._emit(stage, label, 'error', time.perf_counter() - stage_start, str(e))
+
+        if not snapshot.last_restored and snapshot.is_enabled():
+            try:
+                snapshot.save()
+            except RuntimeError as e:
+                logging.warning(f"预加载后写入快照失败: {str(e)}")
+
+        self._emit('all', "预加载", 'finished', time.perf_counter() - start, "预加载完成")
+        logging.info(f"后台预加载完成，耗时 {time.perf_counter() - start:.2f} 秒")
+        self._finished.set()
@@ -0,0 +1,201 @@
+# profiling.py —— 可通过环境变量开启的任务性能剖析（cProfile + tracemalloc + 可选采样）
+# -*- coding: utf-8 -*-
+"""
+开启方式（无需修改代码）：
+    VIDEO_PROFILE=1 python main.py               # cProfile + tracemalloc
+    VIDEO_PROFILE=sample python -m cli task2 ... # 另外按固定间隔采样调用栈
+可选：
+    VIDEO_PROFILE_INTERVAL  采样间隔（秒，默认 0.005）
+    VIDEO_PROFILE_MIN_MS    耗时低于该值的调用不写出结果（默认 10，用于过滤命中缓存的调用）
+每次被剖析的调用在 results/profiles/ 下生成：
+    <名称>_<时间>_<序号>.prof         pstats 格式，可用 snakeviz 等工具查看
+    <名称>_<时间>_<序号>.txt          累计耗时前列的函数 + 内存分配前列的代码行
+    <名称>_<时间>_<序号>.folded       采样模式下的折叠调用栈（可直接生成火焰图）
+关闭时装饰器只多一次布尔判断
+"""
+import cProfile
+import functools
+import io
+import itertools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+PROFILE_ENV = 'VIDEO_PROFILE'
+PROFILE_DIR = 'results/profiles'
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 20
+
+_mode = os.environ.get(PROFILE_ENV, '').strip().lower()
+_enabled = _mode not in ('', '0', 'off', 'false')
+_sampling = _mode == 'sample'
+_sample_interval = float(os.environ.get('VIDEO_PROFILE_INTERVAL', '0.005'))
+_min_seconds = float(os.environ.get('VIDEO_PROFILE_MIN_MS', '10')) / 1000
+
+_counter = itertools.count(1)
+_active = threading.local()  # 嵌套调用时只剖析最外层
+
+# tracemalloc 是进程级的：多个线程同时剖析时按引用计数启停，最后一个结束的调用才停止跟踪
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_owned = False  # 跟踪是否由本模块启动（外部已开启时不停止）
+_tracing_starts = 0     # 累计登记次数，用于判断一次调用期间是否有其它剖析调用开始
+
+
+def set_profiling(enabled=True, sampling=False, interval=None, min_ms=None):
+    """在运行时开启/关闭剖析（等价于设置环境变量）"""
+    global _enabled, _sampling, _sample_interval, _min_seconds
+    _enabled = bool(enabled)
+    _sampling = bool(sampling)
+    if interval is not None:
+        _sample_interval = interval
+    if min_ms is not None:
+        _min_seconds = min_ms / 1000
+
+
+def is_enabled():
+    return _enabled
+
+
+class _StackSampler(threading.Thread):
+    """后台线程按固定间隔记录目标线程的调用栈（折叠格式计数）"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _write_report(name, profiler, snapshot, peak, elapsed, sampler):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    prefix = os.path.join(PROFILE_DIR, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}_{next(_counter)}")
+    profiler.dump_stats(f"{prefix}.prof")
+
+    report = io.StringIO()
+    if peak is None:
+        report.write(f"{name}: 耗时 {elapsed:.3f}s, 与其它线程的剖析调用重叠，不统计内存\n\n")
+    else:
+        report.write(f"{name}: 耗时 {elapsed:.3f}s, tracemalloc 峰值 {peak / 1024 / 1024:.2f}MB\n\n")
+    report.write(f"== 累计耗时前 {TOP_FUNCTIONS} 的函数 ==\n")
+    pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    if snapshot is not None:
+        report.write(f"== 分配内存最多的 {TOP_ALLOCATIONS} 行（调用结束时仍存活）==\n")
+        for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+            report.write(f"{stat}\n")
+    with open(f"{prefix}.txt", 'w', encoding='utf-8') as f:
+        f.write(report.getvalue())
+
+    if sampler is not None:
+        with open(f"{prefix}.folded", 'w', encoding='utf-8') as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    logging.info(f"性能剖析结果已写入 {prefix}.*（耗时 {elapsed:.3f}s）")
+    return prefix
+
+
+def _acquire_tracing():
+    """
+    登记一个剖析中的调用，开始时没有其它剖析中的调用才重置峰值
+    返回本次登记的序号，_release_tracing 据此判断期间是否有其它调用重叠
+    """
+    global _tracing_users, _tracing_owned, _tracing_starts
+    with _tracing_lock:
+        if _tracing_users == 0:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _tracing_owned = True
+            tracemalloc.reset_peak()
+        _tracing_users += 1
+        _tracing_starts += 1
+        return _tracing_starts if _tracing_users == 1 else None
+
+
+def _release_tracing(token, collect):
+    """
+    注销一个剖析中的调用；collect 为 True 且期间没有其它剖析调用时在仍持有跟踪时取 (峰值, 快照)
+    有重叠时峰值和快照混入了其它线程的分配，返回 (None, None)
+    """
+    global _tracing_users, _tracing_owned
+    with _tracing_lock:
+        try:
+            if collect and token is not None and token == _tracing_starts and tracemalloc.is_tracing():
+                return tracemalloc.get_traced_memory()[1], tracemalloc.take_snapshot()
+            return None, None
+        finally:
+            _tracing_users -= 1
+            if _tracing_users == 0 and _tracing_owned:
+                tracemalloc.stop()
+                _tracing_owned = False
+
+
+def _run_profiled(name, func, args, kwargs):
+    token = _acquire_tracing()
+
+    sampler = None
+    if _sampling:
+        sampler = _StackSampler(threading.get_ident(), _sample_interval)
+        sampler.start()
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12 起同一时刻只能有一个 cProfile 处于开启状态，其余线程的调用不做函数级剖析
+        profiler = None
+    _active.depth = 1
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+        _active.depth = 0
+        # 剖析结果的收集和写出失败不能覆盖被剖析函数的返回值或异常
+        peak = snapshot = None
+        try:
+            peak, snapshot = _release_tracing(token, collect=elapsed >= _min_seconds)
+        except Exception as e:
+            logging.warning(f"收集内存剖析结果失败: {str(e)}")
+        try:
+            if sampler is not None:
+                sampler.stop()
+            if profiler is not None and elapsed >= _min_seconds:
+                _write_report(name, profiler, snapshot, peak, elapsed, sampler)
+        except Exception as e:
+            logging.warning(f"写入性能剖析结果失败: {str(e)}")
+
+
+def profiled(name):
+    """剖析装饰器：开关关闭或已处于剖析中时直接调用原函数"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled or getattr(_active, 'depth', 0):
+                return func(*args, **kwargs)
+            return _run_profiled(name, func, args, kwargs)
+        return wrapper
+    return decorator
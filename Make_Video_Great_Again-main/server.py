@@ -0,0 +1,274 @@
+# server.py —— 本地 asyncio HTTP 服务：相似用户与视频推荐（微批处理）
+# -*- coding: utf-8 -*-
+"""
+用法：
+    python -m server --port 8080
+接口：
+    GET /health
+    GET /similar_users?user_id=1
+    GET /recommend?user_id=1
+并发请求在 BATCH_WAIT 内聚合成一批，相似度只做一次矩阵乘法（推荐的候选统计也整批只做一次），再把结果分发回各请求
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+MAX_BATCH_SIZE = 64         # 每批最多合并的请求数
+BATCH_WAIT = 0.005          # 第一个请求到达后最多等待的时间（秒）
+MAX_PENDING = 1024          # 排队+处理中的请求上限，超过时直接返回 503
+MAX_HEADER_BYTES = 16384    # 请求头大小上限
+REQUEST_TIMEOUT = 30.0      # 单个连接读取请求的超时（秒）
+
+_STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class Overloaded(Exception):
+    """排队请求数达到上限"""
+
+
+class MicroBatcher:
+    """
+    微批处理器：收集短时间内的并发请求，在单个工作线程中调用一次 batch_fn(items)，
+    batch_fn 返回与 items 等长的结果列表
+    """
+
+    def __init__(self, batch_fn, executor, max_batch=MAX_BATCH_SIZE, max_wait=BATCH_WAIT,
+                 max_pending=MAX_PENDING):
+        self.batch_fn = batch_fn
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+
+        self.pending = 0
+        self.batches = 0
+        self.items = 0
+        self._queue = []
+        self._timer = None
+
+    async def submit(self, item):
+        if self.pending >= self.max_pending:
+            raise Overloaded()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending += 1
+        self._queue.append((item, future))
+
+        if len(self._queue) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        try:
+            return await future
+        finally:
+            self.pending -= 1
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queue:
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        items = [item for item, _ in batch]
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, self.batch_fn, items)
+        except Exception as e:
+            logging.error(f"批处理失败: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.items += len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {"pending": self.pending, "batches": self.batches, "items": self.items,
+                "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0}
+
+
+class RecommendServer:
+    """保持数据和矩阵常驻内存的 HTTP 服务"""
+
+    def __init__(self, max_batch=MAX_BATCH_SIZE, max_wait=BATCH_WAIT, max_pending=MAX_PENDING,
+                 rerank_budget_ms=None, diversity=None):
+        import task1_similar_users
+        import task2_recommend_videos
+
+        if rerank_budget_ms is None:
+            rerank_budget_ms = task2_recommend_videos.RERANK_BUDGET_MS
+        # 多样性重排需显式开启（diversity > 0）；在线服务限制重排的耗时，超出预算时返回未重排结果
+        recommend_batch = functools.partial(task2_recommend_videos.recommend_videos_batch,
+                                            diversity=diversity, rerank_budget_ms=rerank_budget_ms)
+
+        # 单个工作线程：批处理串行执行，避免多个矩阵乘法争抢 CPU
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='batch')
+        self.batchers = {
+            '/similar_users': MicroBatcher(task1_similar_users.find_similar_users_batch, self.executor,
+                                           max_batch, max_wait, max_pending),
+            '/recommend': MicroBatcher(recommend_batch, self.executor,
+                                       max_batch, max_wait, max_pending),
+        }
+        self.started = time.time()
+        self.requests = 0
+        self.rejected = 0
+
+    def warm_up(self):
+        """加载数据并预计算用户-标签矩阵"""
+        from data_manager import DataManager
+        import task1_similar_users
+
+        start = time.perf_counter()
+        DataManager()
+        task1_similar_users.initialize_matrix()
+        logging.info(f"服务预热完成，用时 {time.perf_counter() - start:.2f}s")
+
+    async def handle_request(self, method, target):
+        """返回 (状态码, 响应对象)"""
+        url = urlsplit(target)
+        if url.path != '/health' and url.path not in self.batchers:
+            return 404, {"error": f"未知接口: {url.path}"}
+        if method != 'GET':
+            return 405, {"error": "只支持 GET"}
+
+        if url.path == '/health':
+            return 200, {"status": "ok", "uptime": round(time.time() - self.started, 1),
+                         "requests": self.requests, "rejected": self.rejected,
+                         "batchers": {path: b.stats() for path, b in self.batchers.items()}}
+        batcher = self.batchers[url.path]
+
+        try:
+            user_id = int(parse_qs(url.query)['user_id'][0])
+        except (KeyError, ValueError):
+            return 400, {"error": "缺少或无效的 user_id 参数"}
+
+        try:
+            result = await batcher.submit(user_id)
+        except Overloaded:
+            self.rejected += 1
+            return 503, {"error": "服务繁忙，请稍后重试"}
+        except Exception as e:
+            return 500, {"error": str(e)}
+
+        if result is None:
+            return 404, {"error": f"用户ID {user_id} 不存在"}
+        return 200, {"user_id": user_id, "result": result}
+
+    async def handle_connection(self, reader, writer):
+        """HTTP/1.1 连接处理（支持 keep-alive）"""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), REQUEST_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 413, {"error": "请求头过大"}, keep_alive=False)
+                    break
+
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ', 2)
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "无效的请求行"}, keep_alive=False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                # 丢弃请求体（接口只使用查询参数）
+                try:
+                    length = int(headers.get('content-length') or 0)
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "无效的 Content-Length"}, keep_alive=False)
+                    break
+                if length > MAX_HEADER_BYTES:
+                    await self._respond(writer, 413, {"error": "请求体过大"}, keep_alive=False)
+                    break
+                if length:
+                    try:
+                        await asyncio.wait_for(reader.readexactly(length), REQUEST_TIMEOUT)
+                    except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                        await self._respond(writer, 400, {"error": "请求体不完整"}, keep_alive=False)
+                        break
+                    except ConnectionError:
+                        break
+
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and version == 'HTTP/1.1')
+                self.requests += 1
+                status, payload = await self.handle_request(method, target)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = [f"HTTP/1.1 {status} {_STATUS_TEXT.get(status, '')}",
+                "Content-Type: application/json; charset=utf-8",
+                f"Content-Length: {len(body)}",
+                f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if status == 503:
+            head.append("Retry-After: 1")
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def serve(self, host, port):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.warm_up)
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        logging.info(f"服务已启动: http://{host}:{port}")
+        print(f"服务已启动: http://{host}:{port}", flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m server', description="相似用户/视频推荐 HTTP 服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH_SIZE, help="每批最多合并的请求数")
+    parser.add_argument('--batch-wait', type=float, default=BATCH_WAIT * 1000, help="批处理等待时间（毫秒）")
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING, help="排队请求上限（超过返回503）")
+    parser.add_argument('--diversity', type=float, help="推荐多样性重排的权重 λ（0-1，默认 0 即不重排）")
+    parser.add_argument('--rerank-budget', type=float, help="推荐多样性重排的时间预算（毫秒，默认 20）")
+    args = parser.parse_args(argv)
+
+    os.makedirs("data", exist_ok=True)
+    os.makedirs("results", exist_ok=True)
+    logging.basicConfig(filename='results/server.log', level=logging.INFO)
+
+    server = RecommendServer(args.max_batch, args.batch_wait / 1000, args.max_pending, args.rerank_budget,
+                             args.diversity)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+# sharded_similarity.py —— 按用户ID区间分片的相似用户搜索：分发查询、各分片求局部前k、协调方合并
+# -*- coding: utf-8 -*-
+"""
+用户-标签矩阵的行按用户ID升序排列，按用户ID区间切成 N 段，每段由一个独立进程（相当于一个节点）负责：
+    1. 协调方取出查询用户的标准化向量，发送给所有分片
+    2. 各分片计算与本分片用户的余弦相似度，返回局部前k（排除查询用户自己）
+    3. 协调方合并 N 份局部结果，得到与单进程计算相同的全局前k
+分片进程通过 shared_data 挂载同一份共享内存，各自只使用矩阵中属于自己的行（零拷贝切片）
+
+用法：
+    with ShardedSimilarity(n_shards=4) as index:
+        index.find_similar_users(1)
+        index.find_similar_users_batch([1, 2, 3])
+"""
+import logging
+import multiprocessing
+import threading
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+import shared_data
+import task1_similar_users
+
+
+def _shard_rows(matrix, start, end):
+    """取矩阵第 start..end 行（data/indices 为原数组切片，不复制）"""
+    indptr = matrix.indptr[start:end + 1]
+    return csr_matrix(
+        (matrix.data[indptr[0]:indptr[-1]], matrix.indices[indptr[0]:indptr[-1]], indptr - indptr[0]),
+        shape=(end - start, matrix.shape[1]), copy=False)
+
+
+def _local_top_k(shard_matrix, shard_users, queries, exclude_ids, k):
+    """一批查询在本分片内的前k：返回 (用户ID, 分数)，形状均为 (查询数, k)，不足k个时以 -1 / -inf 补齐"""
+    n_queries = queries.shape[0]
+    top_ids = np.full((n_queries, k), -1, dtype=np.int64)
+    top_scores = np.full((n_queries, k), -np.inf)
+    if shard_matrix.shape[0] == 0:
+        return top_ids, top_scores
+
+    similarities = (queries @ shard_matrix.T).toarray()
+    # 查询用户在本分片内时排除自己
+    own = np.searchsorted(shard_users, exclude_ids)
+    hit = (own < len(shard_users)) & (shard_users[np.minimum(own, len(shard_users) - 1)] == exclude_ids)
+    similarities[np.flatnonzero(hit), own[hit]] = -np.inf
+
+    local_k = min(k, similarities.shape[1])
+    top = np.argpartition(similarities, -local_k, axis=1)[:, -local_k:]
+    top_ids[:, :local_k] = shard_users[top]
+    top_scores[:, :local_k] = np.take_along_axis(similarities, top, axis=1)
+    return top_ids, top_scores
+
+
+def _shard_main(conn, manifest, start, end):
+    """分片进程：挂载共享数据，循环处理协调方发来的查询，收到 None 时退出"""
+    try:
+        data = shared_data.attach(manifest, install=False)
+        shard_matrix = _shard_rows(data.user_tag_matrix, start, end)
+        shard_users = np.asarray(data.matrix_users[start:end], dtype=np.int64)
+        conn.send(('ready', end - start))
+    except Exception as e:
+        conn.send(('error', str(e)))
+        return
+
+    try:
+        while True:
+            request = conn.recv()
+            if request is None:
+                break
+            query_data, query_indices, query_indptr, n_cols, exclude_ids, k = request
+            queries = csr_matrix((query_data, query_indices, query_indptr),
+                                 shape=(len(query_indptr) - 1, n_cols))
+            try:
+                conn.send(('ok', _local_top_k(shard_matrix, shard_users, queries, exclude_ids, k)))
+            except Exception as e:
+                conn.send(('error', str(e)))
+    finally:
+        del shard_matrix, shard_users
+        shared_data.detach()
+        conn.close()
+
+
+def merge_top_k(partials, k):
+    """
+    合并各分片的局部前k（scatter-gather 的 gather 步骤）
+    Args:
+        partials: [(用户ID, 分数), ...]，每项形状均为 (查询数, k)
+    Returns:
+        (用户ID, 分数)，按分数降序、分数相同时按用户ID升序
+    """
+    ids = np.concatenate([p[0] for p in partials], axis=1)
+    scores = np.concatenate([p[1] for p in partials], axis=1)
+    k = min(k, ids.shape[1])
+    order = np.lexsort((ids, -scores))[:, :k]
+    return np.take_along_axis(ids, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+class ShardedSimilarity:
+    """分片相似用户搜索的协调方"""
+
+    def __init__(self, n_shards=4, mp_context=None):
+        if n_shards < 1:
+            raise ValueError("分片数必须大于0")
+        self.n_shards = n_shards
+        self._context = mp_context or multiprocessing.get_context()
+        self._plane = None
+        self._shards = []
+        self._lock = threading.Lock()  # 同一时间只有一批查询在各分片上执行
+        self.boundaries = []
+
+    def start(self):
+        """发布共享数据并启动分片进程"""
+        try:
+            self._plane = shared_data.SharedDataPlane.publish()
+            unique_users = np.asarray(task1_similar_users.initialize_matrix()[2])
+
+            # 按用户ID区间划分：各分片用户数尽量相等
+            cuts = np.linspace(0, len(unique_users), self.n_shards + 1).astype(int)
+            for start, end in zip(cuts[:-1], cuts[1:]):
+                parent_conn, child_conn = self._context.Pipe()
+                process = self._context.Process(
+                    target=_shard_main, args=(child_conn, self._plane.manifest, int(start), int(end)),
+                    daemon=True)
+                process.start()
+                child_conn.close()
+                self._shards.append((process, parent_conn))
+                low = int(unique_users[start]) if end > start else None
+                high = int(unique_users[end - 1]) if end > start else None
+                self.boundaries.append((low, high))
+
+            for process, conn in self._shards:
+                status, detail = conn.recv()
+                if status != 'ready':
+                    raise RuntimeError(detail)
+            logging.info(f"已启动 {self.n_shards} 个相似用户分片，用户ID区间: {self.boundaries}")
+            return self
+        except Exception as e:
+            self.close()
+            logging.error(f"启动分片失败: {str(e)}")
+            raise RuntimeError(f"启动分片失败: {str(e)}")
+
+    def close(self):
+        """停止分片进程并释放共享数据"""
+        for process, conn in self._shards:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process, conn in self._shards:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+            conn.close()
+        self._shards = []
+        self.boundaries = []
+        if self._plane is not None:
+            self._plane.close()
+            self._plane = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _scatter_gather(self, state, target_indices, k):
+        """把查询向量发给所有分片，收集局部前k并合并"""
+        matrix, _, unique_users = state
+        queries = matrix[target_indices]
+        exclude_ids = np.asarray(unique_users)[target_indices].astype(np.int64)
+        request = (queries.data, queries.indices, queries.indptr, queries.shape[1], exclude_ids, k)
+        with self._lock:
+            for _, conn in self._shards:
+                conn.send(request)
+            partials = []
+            for _, conn in self._shards:
+                status, result = conn.recv()
+                if status != 'ok':
+                    raise RuntimeError(f"分片查询失败: {result}")
+                partials.append(result)
+        return merge_top_k(partials, k)
+
+    def find_similar_users_batch(self, target_user_ids, k=5):
+        """
+        批量查询相似用户，结果格式与 task1_similar_users.find_similar_users_batch 相同
+        不存在的用户对应 None
+        """
+        if not self._shards:
+            raise RuntimeError("分片尚未启动")
+        try:
+            state = task1_similar_users.initialize_matrix()
+            user_to_idx = state[1]
+            indices = np.array([user_to_idx.get(user_id, -1) for user_id in target_user_ids], dtype=np.int64)
+            positions = np.flatnonzero(indices >= 0)
+            results = [None] * len(indices)
+            if len(positions):
+                top_ids, top_scores = self._scatter_gather(state, indices[positions], k)
+                for position, ids, scores in zip(positions, top_ids, top_scores):
+                    results[position] = [
+                        {"user_ID": int(uid), "similarity": round(float(score), 4)}
+                        for uid, score in zip(ids, scores) if uid >= 0
+                    ]
+            return results
+        except Exception as e:
+            logging.error(f"分片查询相似用户失败: {str(e)}")
+            raise
+
+    def find_similar_users(self, target_user_id, k=5):
+        """查询单个用户的相似用户"""
+        result = self.find_similar_users_batch([target_user_id], k)[0]
+        if result is None:
+            raise ValueError(f"用户ID {target_user_id} 不存在")
+        return result
@@ -0,0 +1,288 @@
+# shared_data.py —— 多进程共享数据平面：数据只在主进程加载一次，工作进程零拷贝挂载
+# -*- coding: utf-8 -*-
+"""
+主进程把以下数组写入一块 multiprocessing.shared_memory：
+    操作数据各列、视频/用户表的数值列（字符串列转为编码 + 类别表）、
+    视频×天 计数矩阵、任务1 的用户-标签 CSR 矩阵（data/indices/indptr 及行对应的用户ID）
+工作进程按名称挂载，得到只读的 numpy / scipy 视图并装入 DataCache 与任务1 的全局缓存，
+任务代码无需修改，N 个工作进程只占一份数据内存（各进程只各自构建少量哈希索引）
+
+用法：
+    with SharedDataPlane.publish() as plane:
+        with plane.worker_pool(max_workers=4) as pool:
+            results = list(pool.map(task1_similar_users.find_similar_users, user_ids))
+
+生命周期：发布方负责 unlink（close()、with 语句结束或进程退出时），工作进程只 close 自己的映射
+"""
+import atexit
+import gc
+import logging
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from data_cache import DataCache
+import task1_similar_users
+
+ALIGNMENT = 64  # 每个数组的起始偏移按 64 字节对齐
+
+# viewed_by / liked_by 是由操作数据派生的长字符串列，任务代码不使用，不放入共享内存
+SKIP_COLUMNS = {'viewed_by', 'liked_by'}
+# 不同取值超过行数的这一比例的字符串列按文本存放（UTF-8 拼接），否则编码为类别
+TEXT_COLUMN_RATIO = 0.5
+_TEXT_SEPARATOR = '\x00'
+
+# 当前进程挂载的共享数据（保持映射存活，detach 时释放）
+_attached = None
+
+
+def _encode_text(key, values, arrays, meta):
+    """把字符串列以分隔符拼接为 UTF-8 字节数组，缺失值另存掩码；含分隔符时返回 False"""
+    na = values.isna().to_numpy()
+    strings = values.fillna('').astype(str).tolist()
+    joined = _TEXT_SEPARATOR.join(strings)
+    if joined.count(_TEXT_SEPARATOR) != max(len(strings) - 1, 0):
+        return False
+    arrays[key] = np.frombuffer(joined.encode('utf-8'), dtype=np.uint8)
+    if na.any():
+        arrays[f"{key}/na"] = na
+    meta.setdefault('text', {})[key] = {"rows": len(strings), "na": bool(na.any())}
+    return True
+
+
+def _decode_text(key, views, info):
+    if info['rows'] == 0:
+        return np.empty(0, dtype=object)
+    values = np.array(views[key].tobytes().decode('utf-8').split(_TEXT_SEPARATOR), dtype=object)
+    if info['na']:
+        values[views[f"{key}/na"]] = np.nan
+    return values
+
+
+def _encode_frame(prefix, df, arrays, meta, skip=SKIP_COLUMNS):
+    """
+    把表的各列放入 arrays：数值列直接放入，其余列转为编码 + 类别表（类别表放入 meta），
+    取值几乎各不相同的字符串列按文本存放；skip 中的列不写入，meta['dtypes'] 记录非数值列的原始类型
+    """
+    columns = []
+    for col in df.columns:
+        if col in skip:
+            continue
+        key = f"{prefix}/{col}"
+        if isinstance(df[col].dtype, np.dtype) and df[col].dtype.kind in 'biuf':
+            arrays[key] = df[col].to_numpy()
+        else:
+            meta.setdefault('dtypes', {})[key] = str(df[col].dtype)
+            codes, categories = pd.factorize(df[col], sort=True)
+            if len(categories) <= TEXT_COLUMN_RATIO * len(df) or not _encode_text(key, df[col], arrays, meta):
+                arrays[key] = codes.astype(np.int32)
+                meta['categories'][key] = categories.tolist()
+        columns.append(col)
+    meta['columns'][prefix] = columns
+
+
+def _decode_frame(prefix, views, meta, restore_dtypes=False):
+    """
+    由共享数组重建只读 DataFrame（数值列零拷贝，编码列转为 Categorical，编码部分同样零拷贝）
+    restore_dtypes=True 时编码列和文本列还原为原始类型（需要复制，用于与 CSV 加载结果一致的场合）
+    """
+    columns = {}
+    for col in meta['columns'][prefix]:
+        key = f"{prefix}/{col}"
+        categories = meta['categories'].get(key)
+        text = meta.get('text', {}).get(key)
+        if text is not None:
+            values = _decode_text(key, views, text)
+        elif categories is None:
+            columns[col] = views[key]
+            continue
+        else:
+            values = pd.Categorical.from_codes(views[key], categories=categories)
+        dtype = meta.get('dtypes', {}).get(key)
+        if restore_dtypes and dtype is not None:
+            values = pd.Series(values, copy=False).astype(dtype).array
+        columns[col] = values
+    return pd.DataFrame(columns, copy=False)
+
+
+def _attach_segment(name):
+    """按名称打开共享内存；工作进程不登记到资源跟踪器，避免进程退出时误删共享内存"""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    # 发布方的子进程与发布方共用资源跟踪器（重复登记无影响）；独立进程有自己的跟踪器，需注销
+    if multiprocessing.parent_process() is None:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class SharedDataPlane:
+    """发布方持有的共享数据：manifest 可 pickle，传给工作进程用于挂载"""
+
+    def __init__(self, shm, manifest):
+        self._shm = shm
+        self.manifest = manifest
+        atexit.register(self.close)
+
+    @classmethod
+    def publish(cls):
+        """加载数据与用户-标签矩阵，复制到一块新的共享内存"""
+        try:
+            operations_df = DataCache.load_operations()
+            videos_df = DataCache.load_videos()
+            users_df = DataCache.load_users()
+            video_index, daily_views, daily_likes = DataCache._load_daily()
+            matrix, _, matrix_users = task1_similar_users.initialize_matrix()
+
+            arrays = {}
+            meta = {'columns': {}, 'categories': {}}
+            _encode_frame('operations', operations_df, arrays, meta)
+            _encode_frame('videos', videos_df, arrays, meta)
+            _encode_frame('users', users_df, arrays, meta)
+            arrays['daily/views'] = daily_views
+            arrays['daily/likes'] = daily_likes
+            arrays['daily/video_index'] = video_index.to_numpy()
+            arrays['matrix/data'] = matrix.data
+            arrays['matrix/indices'] = matrix.indices
+            arrays['matrix/indptr'] = matrix.indptr
+            arrays['matrix/users'] = np.asarray(matrix_users)
+
+            # 计算每个数组在共享内存中的偏移
+            layout, offset = {}, 0
+            for key, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                arrays[key] = array
+                layout[key] = (offset, array.dtype.str, array.shape)
+                offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+            shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+            for key, array in arrays.items():
+                start = layout[key][0]
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf, offset=start)[...] = array
+
+            manifest = {
+                'name': shm.name,
+                'size': shm.size,
+                'layout': layout,
+                'matrix_shape': matrix.shape,
+                'data_version': DataCache.get_data_version(),
+                **meta,
+            }
+            logging.info(f"共享数据已发布: {shm.name}, {shm.size / 1024 / 1024:.1f}MB, {len(layout)} 个数组")
+            return cls(shm, manifest)
+        except Exception as e:
+            logging.error(f"发布共享数据失败: {str(e)}")
+            raise RuntimeError(f"发布共享数据失败: {str(e)}")
+
+    def worker_pool(self, max_workers=None, mp_context=None):
+        """创建已挂载共享数据的进程池（mp_context 可传入 multiprocessing.get_context('spawn') 等）"""
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context,
+                                   initializer=init_worker, initargs=(self.manifest,))
+
+    def close(self):
+        """释放并删除共享内存（可重复调用）"""
+        if self._shm is None:
+            return
+        shm, self._shm = self._shm, None
+        atexit.unregister(self.close)
+        try:
+            shm.close()
+        except BufferError:
+            logging.warning(f"共享内存 {shm.name} 仍有视图在使用，仅删除名称")
+        try:
+            shm.unlink()
+            logging.info(f"共享数据已释放: {shm.name}")
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class AttachedData:
+    """工作进程挂载得到的只读视图"""
+
+    def __init__(self, shm, manifest):
+        self._shm = shm
+        self.manifest = manifest
+        views = {}
+        for key, (offset, dtype, shape) in manifest['layout'].items():
+            view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+            view.flags.writeable = False
+            views[key] = view
+
+        self.operations = _decode_frame('operations', views, manifest)
+        self.videos = _decode_frame('videos', views, manifest)
+        self.users = _decode_frame('users', views, manifest)
+        self.daily_views = views['daily/views']
+        self.daily_likes = views['daily/likes']
+        self.video_index = pd.Index(views['daily/video_index'], copy=False)
+        self.matrix_users = views['matrix/users']
+        self.user_tag_matrix = csr_matrix(
+            (views['matrix/data'], views['matrix/indices'], views['matrix/indptr']),
+            shape=tuple(manifest['matrix_shape']), copy=False)
+
+    def install(self):
+        """装入 DataCache 与任务1 的全局缓存，使任务函数直接使用共享数据"""
+        if DataCache.data_fingerprint() != self.manifest['data_version'].split('-')[0]:
+            logging.warning("工作进程的数据文件与共享数据的版本不一致，以共享数据为准")
+        DataCache.clear_cache()
+        DataCache._user_ids = set(np.unique(self.operations['user_id'].to_numpy()).astype(str))
+        DataCache._operations_df = self.operations
+        DataCache._videos_df = self.videos
+        DataCache._users_df = self.users
+        DataCache._daily_counts = (self.video_index, self.daily_views, self.daily_likes)
+
+        task1_similar_users._matrix_state = (
+            self.user_tag_matrix, {uid: idx for idx, uid in enumerate(self.matrix_users.tolist())},
+            self.matrix_users)
+
+    def close(self):
+        """关闭映射（不删除共享内存），调用前需释放所有视图"""
+        for attr in ('operations', 'videos', 'users', 'daily_views', 'daily_likes',
+                     'video_index', 'matrix_users', 'user_tag_matrix'):
+            setattr(self, attr, None)
+        gc.collect()
+        try:
+            self._shm.close()
+        except BufferError:
+            logging.warning(f"共享内存 {self._shm.name} 仍有视图在使用，映射将在进程退出时释放")
+
+
+def attach(manifest, install=True):
+    """按 manifest 挂载共享数据；install=True 时装入当前进程的缓存"""
+    global _attached
+    try:
+        data = AttachedData(_attach_segment(manifest['name']), manifest)
+        if install:
+            data.install()
+        _attached = data
+        logging.info(f"已挂载共享数据: {manifest['name']}")
+        return data
+    except Exception as e:
+        logging.error(f"挂载共享数据失败: {str(e)}")
+        raise RuntimeError(f"挂载共享数据失败: {str(e)}")
+
+
+def detach():
+    """卸载当前进程挂载的共享数据，并清除引用了共享内存的缓存"""
+    global _attached
+    if _attached is None:
+        return
+    data, _attached = _attached, None
+    DataCache.clear_cache()  # 同时清除任务1的矩阵（见 task1_similar_users.clear_cache）
+    data.close()
+
+
+def init_worker(manifest):
+    """进程池 initializer：挂载共享数据，进程退出时卸载"""
+    attach(manifest)
+    atexit.register(detach)
@@ -0,0 +1,242 @@
+# sketches.py —— 固定内存的概率统计结构（Count-Min / HyperLogLog）
+# -*- coding: utf-8 -*-
+"""
+误差说明：
+- CountMinSketch(width=w, depth=d)：估计值从不偏低；
+  以至少 1 - e^(-d) 的概率，估计值 <= 真实值 + (e / w) * N，N 为写入的总计数。
+  默认 w=2^18、d=4 时，偏高不超过总量的 0.001%（概率 >= 98%）。
+- HyperLogLogArray(p)：每个集合 m = 2^p 个寄存器，相对标准误差约 1.04 / sqrt(m)。
+  p=6 约 13%，p=10 约 3.3%，p=12 约 1.6%；基数较小时使用线性计数修正。
+两种结构的内存只由参数决定，与写入多少条操作无关；参数和种子相同的结构可以合并（分片汇总）。
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+from data_cache import DataCache
+
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+_GOLDEN = 0x9E3779B97F4A7C15
+
+
+def _hash64(keys, seed):
+    """splitmix64 哈希（向量化），keys 为整数数组"""
+    x = np.asarray(keys).astype(np.uint64)
+    x += np.uint64((_GOLDEN * (seed + 1)) & 0xFFFFFFFFFFFFFFFF)
+    x ^= x >> np.uint64(30)
+    x *= _MIX1
+    x ^= x >> np.uint64(27)
+    x *= _MIX2
+    x ^= x >> np.uint64(31)
+    return x
+
+
+def _bit_length(values):
+    """uint64 数组中每个元素的有效位数（二分法，结果精确）"""
+    values = values.copy()
+    lengths = np.zeros(len(values), dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = values >= (np.uint64(1) << np.uint64(shift))
+        lengths[mask] += shift
+        values[mask] >>= np.uint64(shift)
+    lengths += (values > 0).astype(np.uint8)
+    return lengths
+
+
+class CountMinSketch:
+    """Count-Min 频次估计（numpy 实现）"""
+
+    def __init__(self, width=2 ** 18, depth=4, seed=0):
+        if width & (width - 1):
+            raise ValueError("width 必须是2的幂")
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def _columns(self, keys, row):
+        return (_hash64(keys, self.seed + row) & np.uint64(self.width - 1)).astype(np.intp)
+
+    def add(self, keys, counts=None):
+        """写入一批键（counts 为 None 时每个键计 1）"""
+        keys = np.asarray(keys)
+        if keys.size == 0:
+            return
+        weights = None if counts is None else np.asarray(counts, dtype=np.float64)
+        for row in range(self.depth):
+            binned = np.bincount(self._columns(keys, row), weights=weights, minlength=self.width)
+            self.table[row] += binned.astype(np.int64)
+        self.total += keys.size if counts is None else int(weights.sum())
+
+    def query(self, keys):
+        """估计一批键的计数"""
+        keys = np.asarray(keys)
+        estimates = np.full(keys.shape, np.iinfo(np.int64).max, dtype=np.int64)
+        for row in range(self.depth):
+            np.minimum(estimates, self.table[row, self._columns(keys, row)], out=estimates)
+        return estimates
+
+    def error_bound(self):
+        """以至少 1 - e^(-depth) 的概率成立的绝对误差上界"""
+        return np.e / self.width * self.total
+
+    def merge(self, other):
+        """合并另一个分片的结果（参数必须一致）"""
+        if (self.width, self.depth, self.seed) != (other.width, other.depth, other.seed):
+            raise ValueError("只能合并参数相同的 CountMinSketch")
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+
+class HyperLogLogArray:
+    """一组 HyperLogLog 计数器，第 i 行估计第 i 个集合的基数"""
+
+    def __init__(self, n_sets, p=10, seed=0):
+        if not 4 <= p <= 16:
+            raise ValueError("p 必须在4-16之间")
+        self.n_sets = n_sets
+        self.p = p
+        self.m = 1 << p
+        self.seed = seed
+        self.registers = np.zeros((n_sets, self.m), dtype=np.uint8)
+
+    def add(self, set_indices, items):
+        """将 items[j] 加入第 set_indices[j] 个集合"""
+        set_indices = np.asarray(set_indices, dtype=np.intp)
+        if set_indices.size == 0:
+            return
+        hashed = _hash64(items, self.seed)
+        buckets = (hashed >> np.uint64(64 - self.p)).astype(np.intp)
+        remainder = hashed & np.uint64((1 << (64 - self.p)) - 1)
+        ranks = (64 - self.p + 1) - _bit_length(remainder)
+        np.maximum.at(self.registers.reshape(-1), set_indices * self.m + buckets, ranks)
+
+    def estimate(self, set_indices=None):
+        """估计各集合的基数"""
+        registers = self.registers if set_indices is None else self.registers[np.asarray(set_indices)]
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        harmonic = np.power(2.0, -registers.astype(np.float64)).sum(axis=1)
+        estimates = alpha * m * m / harmonic
+
+        # 小基数修正：线性计数
+        zeros = (registers == 0).sum(axis=1)
+        small = (estimates <= 2.5 * m) & (zeros > 0)
+        estimates[small] = m * np.log(m / zeros[small])
+        return estimates
+
+    def relative_error(self):
+        """相对标准误差"""
+        return 1.04 / np.sqrt(self.m)
+
+    def merge(self, other):
+        """合并另一个分片的结果（参数必须一致）"""
+        if (self.n_sets, self.p, self.seed) != (other.n_sets, other.p, other.seed):
+            raise ValueError("只能合并参数相同的 HyperLogLogArray")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    @property
+    def nbytes(self):
+        return self.registers.nbytes
+
+
+class VideoStatsSketch:
+    """
+    视频观看/点赞计数（Count-Min）与独立观看用户数（HyperLogLog）的汇总结构
+    可由操作表分块写入，也可逐批消费事件流，多个分片可合并
+    """
+
+    def __init__(self, video_ids, video_tags, cm_width=2 ** 18, cm_depth=4,
+                 video_p=6, tag_p=12, seed=0):
+        """
+        Args:
+            video_ids: 全部视频ID
+            video_tags: 与 video_ids 对应的标签
+            cm_width, cm_depth: Count-Min 参数
+            video_p: 每个视频独立观看用户 HLL 的精度
+            tag_p: 每个标签独立观看用户 HLL 的精度
+        """
+        self.video_index = pd.Index(video_ids)
+        tag_codes, self.tags = pd.factorize(pd.Series(video_tags), sort=True)
+        self.video_tag_codes = tag_codes.astype(np.intp)
+
+        self.views = CountMinSketch(cm_width, cm_depth, seed)
+        self.likes = CountMinSketch(cm_width, cm_depth, seed)
+        self.video_viewers = HyperLogLogArray(len(self.video_index), video_p, seed)
+        self.tag_viewers = HyperLogLogArray(len(self.tags), tag_p, seed)
+
+    @classmethod
+    def from_data_cache(cls, chunk_size=1_000_000, **kwargs):
+        """用缓存中的视频和操作数据构建统计结构"""
+        videos_df = DataCache.load_videos()
+        sketch = cls(videos_df['id'].to_numpy(), videos_df['tag'].to_numpy(), **kwargs)
+        sketch.update_from_operations(DataCache.load_operations(), chunk_size=chunk_size)
+        return sketch
+
+    def update(self, user_ids, video_ids, liked):
+        """消费一批操作事件"""
+        user_ids = np.asarray(user_ids)
+        video_ids = np.asarray(video_ids)
+        liked = np.asarray(liked) == 1
+
+        self.views.add(video_ids)
+        self.likes.add(video_ids[liked])
+
+        rows = self.video_index.get_indexer(video_ids)
+        known = rows >= 0
+        if not known.all():
+            logging.warning(f"忽略 {int((~known).sum())} 条未知视频的操作")
+        rows, users = rows[known], user_ids[known]
+        self.video_viewers.add(rows, users)
+        self.tag_viewers.add(self.video_tag_codes[rows], users)
+
+    def update_from_operations(self, operations_df, chunk_size=1_000_000):
+        """按块消费操作表，避免一次性生成过大的中间数组"""
+        for start in range(0, len(operations_df), chunk_size):
+            chunk = operations_df.iloc[start:start + chunk_size]
+            self.update(chunk['user_id'].to_numpy(), chunk['video_id'].to_numpy(),
+                        chunk['liked'].to_numpy())
+
+    def view_counts(self, video_ids):
+        """估计视频观看次数"""
+        return self.views.query(video_ids)
+
+    def like_counts(self, video_ids):
+        """估计视频点赞次数"""
+        return self.likes.query(video_ids)
+
+    def unique_viewers(self, video_ids):
+        """估计视频的独立观看用户数（未知视频返回 0）"""
+        rows = self.video_index.get_indexer(np.atleast_1d(video_ids))
+        estimates = np.zeros(len(rows), dtype=np.float64)
+        known = rows >= 0
+        estimates[known] = self.video_viewers.estimate(rows[known])
+        return estimates
+
+    def unique_viewers_by_tag(self):
+        """估计每个标签的独立观看用户数"""
+        return dict(zip(self.tags.tolist(), self.tag_viewers.estimate().tolist()))
+
+    def merge(self, other):
+        """合并另一个分片的统计结果"""
+        if not self.video_index.equals(other.video_index) or not self.tags.equals(other.tags):
+            raise ValueError("只能合并视频集合相同的统计结构")
+        self.views.merge(other.views)
+        self.likes.merge(other.likes)
+        self.video_viewers.merge(other.video_viewers)
+        self.tag_viewers.merge(other.tag_viewers)
+        return self
+
+    @property
+    def nbytes(self):
+        """统计结构占用的内存（字节）"""
+        return (self.views.nbytes + self.likes.nbytes +
+                self.video_viewers.nbytes + self.tag_viewers.nbytes)
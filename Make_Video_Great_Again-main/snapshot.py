@@ -0,0 +1,394 @@
+# snapshot.py —— 热启动快照：把缓存的数据表和已构建的派生数据写入单个可内存映射的文件
+# -*- coding: utf-8 -*-
+"""
+文件格式（data/cache/warm_state.snap）：
+    8 字节魔数 | 8 字节表头长度（小端）| JSON 表头 | 按 64 字节对齐的各数组
+表头记录数据文件指纹、各数组的 (偏移, dtype, 形状)、各表的列与类别表、派生数据的元信息
+数据表保存全部列（含 viewed_by / liked_by），恢复后与从 CSV 加载的结果列和类型相同
+恢复时只读内存映射整个文件，数值数组均为零拷贝的只读视图，不再解析 CSV 或重新计算；
+数据文件指纹不一致时视为过期，退回正常加载
+
+派生数据通过 register_artifact 注册导出/恢复函数，内置：视频每日计数、用户特征库、用户-标签矩阵、
+用户操作索引、用户聚类特征、视频聚类特征
+快照只含数组和 JSON，不反序列化任何对象；聚类特征的 sklearn 变换器由 model_store 另存为 joblib 文件，
+快照只记录其版本号
+设置环境变量 VIDEO_SNAPSHOT=0 可关闭快照
+
+用法：
+    python -m snapshot save | restore | info
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_cache import DataCache, _freeze_frame
+from shared_data import _encode_frame, _decode_frame
+
+SNAPSHOT_ENV = 'VIDEO_SNAPSHOT'
+SNAPSHOT_PATH = 'data/cache/warm_state.snap'
+MAGIC = b'VRSNAP01'
+FORMAT_VERSION = 3  # 1：视频表缺少 viewed_by / liked_by，字符串列恢复为类别；2：变换器以 pickle 存放在快照内
+ALIGNMENT = 64
+
+# 派生数据：名称 -> (导出函数, 恢复函数)
+# 导出函数返回 (数组字典, 可 JSON 序列化的元信息)，尚未构建时返回 None；恢复函数接收 (数组字典, 元信息)
+_artifacts = {}
+
+# 本进程最近一次 restore 是否成功
+last_restored = False
+
+# 已通过 model_store 保存的变换器：名称 -> (对象, 版本号)
+_saved_pipelines = {}
+
+
+def is_enabled():
+    return os.environ.get(SNAPSHOT_ENV, '1') not in ('0', 'off', 'false')
+
+
+def register_artifact(name, export, restore):
+    """注册一种需要写入快照的派生数据"""
+    _artifacts[name] = (export, restore)
+
+
+def _save_pipeline(name, pipeline):
+    """不是数组的对象（如 sklearn 变换器）通过 model_store 保存，返回写入快照元信息的版本号（同一对象只保存一次）"""
+    import model_store
+    saved = _saved_pipelines.get(name)
+    if saved is not None and saved[0] is pipeline:
+        return saved[1]
+    version = model_store.save_model(name, pipeline, {"data_version": DataCache.get_data_version()})
+    _saved_pipelines[name] = (pipeline, version)
+    return version
+
+
+def _load_pipeline(name, version):
+    import model_store
+    pipeline = model_store.load_model(name, version)
+    _saved_pipelines[name] = (pipeline, version)
+    return pipeline
+
+
+# ==================== 内置派生数据 ====================
+
+def _export_daily_counts():
+    daily_counts = DataCache._daily_counts
+    if daily_counts is None:
+        return None
+    video_index, daily_views, daily_likes = daily_counts
+    return {"video_index": video_index.to_numpy(), "views": daily_views, "likes": daily_likes}, {}
+
+
+def _restore_daily_counts(arrays, meta):
+    DataCache._daily_counts = (pd.Index(arrays["video_index"], copy=False), arrays["views"], arrays["likes"])
+
+
+def _export_user_tag_matrix():
+    import task1_similar_users
+    state = task1_similar_users._matrix_state
+    if state is None:
+        return None
+    matrix, _, unique_users = state
+    arrays = {"data": matrix.data, "indices": matrix.indices, "indptr": matrix.indptr,
+              "users": np.asarray(unique_users)}
+    return arrays, {"shape": list(matrix.shape)}
+
+
+def _restore_user_tag_matrix(arrays, meta):
+    import task1_similar_users
+    from scipy.sparse import csr_matrix
+    matrix = csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                        shape=tuple(meta["shape"]), copy=False)
+    task1_similar_users._matrix_state = (
+        matrix, {uid: idx for idx, uid in enumerate(arrays["users"].tolist())}, arrays["users"])
+
+
+def _export_user_operation_index():
+    import task2_recommend_videos
+    index = task2_recommend_videos._user_rows_cache.get(DataCache.get_data_version())
+    if index is None:
+        return None
+    unique_users, order, starts, ends = task2_recommend_videos._compact_user_operation_index(index)
+    return {"users": unique_users, "order": order, "starts": starts, "ends": ends}, {}
+
+
+def _restore_user_operation_index(arrays, meta):
+    import task2_recommend_videos
+    task2_recommend_videos._user_rows_cache.clear()
+    task2_recommend_videos._user_rows_cache[DataCache.get_data_version()] = (
+        arrays["users"], arrays["order"], arrays["starts"], arrays["ends"])
+
+
+def _export_user_feature_store():
+    import user_features
+    store = user_features.get_cached_store()
+    return None if store is None else store.to_arrays()
+
+
+def _restore_user_feature_store(arrays, meta):
+    import user_features
+    user_features.set_store(user_features.UserFeatureStore.from_arrays(arrays, meta))
+
+
+def _export_user_features():
+    import task4_user_clustering
+    cached = task4_user_clustering._prepare_user_features_cached()
+    if cached is None:
+        return None
+    _, user_ids, user_features_reduced, pipeline = cached
+    return ({"user_ids": np.asarray(user_ids), "features": user_features_reduced},
+            {"pipeline": _save_pipeline('snapshot_user_features', pipeline)})
+
+
+def _restore_user_features(arrays, meta):
+    import task4_user_clustering
+    task4_user_clustering._feature_cache[DataCache.get_data_version()] = (
+        DataCache.load_users(), arrays["user_ids"], arrays["features"],
+        _load_pipeline('snapshot_user_features', meta["pipeline"]))
+
+
+def _export_video_features():
+    import task5_video_clustering
+    version = DataCache.get_data_version()
+    arrays, sample_sizes, pipelines = {}, [], {}
+    for (key_version, sample_size), cached in list(task5_video_clustering._feature_cache.items()):
+        if key_version != version:
+            continue
+        _, video_ids, reduced, pipeline = cached
+        prefix = str(sample_size)
+        arrays[f"{prefix}/video_ids"] = np.asarray(video_ids)
+        arrays[f"{prefix}/features"] = reduced
+        pipelines[prefix] = _save_pipeline(f'snapshot_video_features_{prefix}', pipeline)
+        sample_sizes.append(sample_size)
+    if not sample_sizes:
+        return None
+    return arrays, {"sample_sizes": sample_sizes, "pipelines": pipelines}
+
+
+def _restore_video_features(arrays, meta):
+    import task5_video_clustering
+    version = DataCache.get_data_version()
+    for sample_size in meta["sample_sizes"]:
+        prefix = str(sample_size)
+        task5_video_clustering._feature_cache[(version, sample_size)] = (
+            DataCache.load_videos(), arrays[f"{prefix}/video_ids"], arrays[f"{prefix}/features"],
+            _load_pipeline(f'snapshot_video_features_{prefix}', meta["pipelines"][prefix]))
+
+
+register_artifact('daily_counts', _export_daily_counts, _restore_daily_counts)
+register_artifact('user_feature_store', _export_user_feature_store, _restore_user_feature_store)
+register_artifact('user_tag_matrix', _export_user_tag_matrix, _restore_user_tag_matrix)
+register_artifact('user_operation_index', _export_user_operation_index, _restore_user_operation_index)
+register_artifact('user_features', _export_user_features, _restore_user_features)
+register_artifact('video_features', _export_video_features, _restore_video_features)
+
+
+# ==================== 读写 ====================
+
+def read_header(path=SNAPSHOT_PATH):
+    """读取快照表头，返回 (表头, 数据区起始偏移)；文件不存在或格式不符时返回 (None, 0)"""
+    if not os.path.exists(path):
+        return None, 0
+    with open(path, 'rb') as f:
+        prefix = f.read(len(MAGIC) + 8)
+        if len(prefix) < len(MAGIC) + 8 or prefix[:len(MAGIC)] != MAGIC:
+            return None, 0
+        header_len = struct.unpack('<Q', prefix[len(MAGIC):])[0]
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    data_start = -(-(len(MAGIC) + 8 + header_len) // ALIGNMENT) * ALIGNMENT
+    return header, data_start
+
+
+def _collect_artifacts():
+    """调用各导出函数，返回 名称 -> (数组字典, 元信息)，跳过尚未构建的派生数据"""
+    collected = {}
+    for name, (export, _) in _artifacts.items():
+        try:
+            exported = export()
+        except Exception as e:
+            logging.warning(f"导出派生数据 {name} 失败: {str(e)}")
+            continue
+        if exported is not None:
+            collected[name] = exported
+    return collected
+
+
+def save(path=SNAPSHOT_PATH, force=False):
+    """
+    把当前缓存写入快照（先写临时文件再替换，写入过程中不影响正在映射旧快照的进程）
+    已有快照的指纹相同且包含当前全部派生数据时跳过（force=True 时总是写入）
+    Returns:
+        是否写入了新快照
+    """
+    try:
+        # 先写回增量写入的 views/likes：快照与 videos.csv 一致，重启恢复后不会留下未写回的计数
+        import ingestion
+        ingestion.flush_video_counts()
+        operations_df = DataCache.load_operations()
+        videos_df = DataCache.load_videos()
+        users_df = DataCache.load_users()
+        fingerprint = DataCache.data_fingerprint()
+        artifacts = _collect_artifacts()
+
+        existing, _ = read_header(path)
+        if (not force and existing is not None and existing.get('format') == FORMAT_VERSION
+                and existing.get('fingerprint') == fingerprint
+                and set(artifacts) <= set(existing.get('artifacts', {}))):
+            logging.info("快照已是最新，跳过写入")
+            return False
+
+        arrays = {}
+        meta = {'columns': {}, 'categories': {}}
+        _encode_frame('operations', operations_df, arrays, meta, skip=())
+        _encode_frame('videos', videos_df, arrays, meta, skip=())
+        _encode_frame('users', users_df, arrays, meta, skip=())
+        artifact_meta = {}
+        for name, (artifact_arrays, info) in artifacts.items():
+            for key, array in artifact_arrays.items():
+                arrays[f"artifact/{name}/{key}"] = array
+            artifact_meta[name] = {"keys": list(artifact_arrays), "meta": info}
+
+        layout, offset = {}, 0
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            arrays[key] = array
+            layout[key] = [offset, array.dtype.str, list(array.shape)]
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+        header = {
+            'format': FORMAT_VERSION,
+            'fingerprint': fingerprint,
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'arrays': layout,
+            'artifacts': artifact_meta,
+            **meta,
+        }
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header_bytes)))
+            f.write(header_bytes)
+            for key, array in arrays.items():
+                f.seek(data_start + layout[key][0])
+                f.write(array.data)
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+        logging.info(f"快照已写入 {path}: {(data_start + offset) / 1024 / 1024:.1f}MB, "
+                     f"派生数据 {list(artifacts)}")
+        return True
+    except Exception as e:
+        logging.error(f"写入快照失败: {str(e)}")
+        raise RuntimeError(f"写入快照失败: {str(e)}")
+
+
+def restore(path=SNAPSHOT_PATH):
+    """
+    从快照恢复缓存与派生数据
+    Returns:
+        是否恢复成功（快照不存在、已关闭或数据文件指纹不一致时返回 False，调用方应正常加载）
+    """
+    global last_restored
+    last_restored = False
+    if not is_enabled():
+        return False
+    try:
+        start = time.perf_counter()
+        header, data_start = read_header(path)
+        if header is None:
+            return False
+        if header.get('format') != FORMAT_VERSION:
+            logging.info(f"快照格式版本 {header.get('format')} 已过期，忽略快照")
+            return False
+        if header.get('fingerprint') != DataCache.data_fingerprint():
+            logging.info("快照与当前数据文件不一致，忽略快照")
+            return False
+
+        mapped = np.memmap(path, dtype=np.uint8, mode='r')
+        views = {
+            key: np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=mapped, offset=data_start + offset)
+            for key, (offset, dtype, shape) in header['arrays'].items()
+        }
+
+        operations_df = _freeze_frame(_decode_frame('operations', views, header, restore_dtypes=True))
+        DataCache.clear_cache()
+        DataCache._user_ids = set(np.unique(operations_df['user_id'].to_numpy()).astype(str))
+        DataCache._operations_df = operations_df
+        DataCache._videos_df = _freeze_frame(_decode_frame('videos', views, header, restore_dtypes=True))
+        DataCache._users_df = _freeze_frame(_decode_frame('users', views, header, restore_dtypes=True))
+
+        restored = []
+        for name, info in header.get('artifacts', {}).items():
+            if name not in _artifacts:
+                continue
+            try:
+                arrays = {key: views[f"artifact/{name}/{key}"] for key in info['keys']}
+                _artifacts[name][1](arrays, info['meta'])
+                restored.append(name)
+            except Exception as e:
+                # 派生数据恢复失败不影响使用（首次用到时再构建）
+                logging.warning(f"恢复派生数据 {name} 失败: {str(e)}")
+
+        last_restored = True
+        logging.info(f"已从快照恢复（{time.perf_counter() - start:.3f} 秒），派生数据: {restored}")
+        return True
+    except Exception as e:
+        logging.warning(f"读取快照失败，改为正常加载: {str(e)}")
+        DataCache.clear_cache()
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m snapshot', description="热启动快照")
+    parser.add_argument('action', choices=['save', 'restore', 'info'])
+    parser.add_argument('--path', default=SNAPSHOT_PATH)
+    parser.add_argument('--warm', action='store_true', help="保存前先构建全部内置派生数据（含聚类特征）")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.action == 'info':
+        header, _ = read_header(args.path)
+        if header is None:
+            print(f"快照不存在或格式无效: {args.path}", file=sys.stderr)
+            return 1
+        print(json.dumps({
+            "fingerprint": header['fingerprint'],
+            "current_fingerprint": DataCache.data_fingerprint(),
+            "created": header['created'],
+            "size_mb": round(os.path.getsize(args.path) / 1024 / 1024, 1),
+            "arrays": len(header['arrays']),
+            "artifacts": list(header['artifacts']),
+        }, ensure_ascii=False, indent=2))
+        return 0
+
+    if args.action == 'restore':
+        start = time.perf_counter()
+        ok = restore(args.path)
+        print(f"恢复{'成功' if ok else '失败'}，耗时 {time.perf_counter() - start:.3f} 秒", file=sys.stderr)
+        return 0 if ok else 1
+
+    if args.warm:
+        import task1_similar_users
+        import task2_recommend_videos
+        import task4_user_clustering
+        import task5_video_clustering
+        DataCache.load_daily_counts()
+        task1_similar_users.initialize_matrix()
+        task2_recommend_videos._user_operation_index()
+        task4_user_clustering._prepare_user_features()
+        task5_video_clustering._prepare_video_features(5000)
+    save(args.path, force=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
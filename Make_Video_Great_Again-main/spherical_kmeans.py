@@ -0,0 +1,106 @@
+# spherical_kmeans.py —— 基于余弦相似度的 k-means（支持稀疏矩阵、多线程）
+# -*- coding: utf-8 -*-
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+from sklearn.preprocessing import normalize
+
+
+class SphericalKMeans:
+    """
+    球面 k-means：样本和中心均为单位向量，按内积（余弦相似度）分配
+    稀疏输入直接用稀疏矩阵乘法计算，按行分块在线程池中并行（scipy 稀疏乘法和 BLAS 均会释放 GIL）
+    """
+
+    def __init__(self, n_clusters, max_iter=30, tol=1e-4, n_jobs=None,
+                 chunk_size=50000, random_state=42):
+        self.n_clusters = n_clusters
+        self.max_iter = max_iter
+        self.tol = tol
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.random_state = random_state
+
+        self.cluster_centers_ = None
+        self.labels_ = None
+        self.inertia_ = None  # 1 - 余弦相似度 之和
+        self.n_iter_ = 0
+
+    def _similarities(self, X, centers, executor):
+        """分块计算 X 与各中心的相似度，返回 (最佳中心, 最大相似度, 全部相似度)"""
+        n = X.shape[0]
+        sims = np.empty((n, len(centers)), dtype=np.float64)
+
+        def work(start):
+            block = X[start:start + self.chunk_size] @ centers.T
+            sims[start:start + self.chunk_size] = block
+
+        list(executor.map(work, range(0, n, self.chunk_size)))
+        labels = sims.argmax(axis=1)
+        return labels, sims[np.arange(n), labels], sims
+
+    def _update_centers(self, X, labels, best_sims):
+        """中心 = 所属样本之和再归一化；空聚类用当前相似度最低的样本重新初始化"""
+        n = X.shape[0]
+        indicator = csr_matrix((np.ones(n), (labels, np.arange(n))), shape=(self.n_clusters, n))
+        centers = indicator @ X
+        centers = centers.toarray() if issparse(centers) else np.asarray(centers)
+
+        empty = np.flatnonzero(np.bincount(labels, minlength=self.n_clusters) == 0)
+        if len(empty):
+            farthest = np.argsort(best_sims)[:len(empty)]
+            replacement = X[farthest]
+            centers[empty] = replacement.toarray() if issparse(replacement) else replacement
+            logging.info(f"球面k-means: {len(empty)} 个空聚类已重新初始化")
+        return normalize(centers, norm='l2', axis=1)
+
+    def fit(self, X):
+        """X 的每一行应已做 L2 归一化"""
+        n = X.shape[0]
+        if n < self.n_clusters:
+            raise ValueError("样本数少于聚类数量")
+        # 随机划分初始化：初始中心为随机分组的样本之和，
+        # 比随机选单个样本更稠密，避免极稀疏样本与所有中心正交
+        rng = np.random.default_rng(self.random_state)
+        init_labels = rng.permutation(np.arange(n) % self.n_clusters)
+        centers = self._update_centers(X, init_labels, np.zeros(n))
+
+        objective = -np.inf
+        with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+            for iteration in range(1, self.max_iter + 1):
+                labels, best_sims, _ = self._similarities(X, centers, executor)
+                new_objective = float(best_sims.sum())
+                centers = self._update_centers(X, labels, best_sims)
+                self.n_iter_ = iteration
+                if new_objective - objective <= self.tol * abs(new_objective):
+                    break
+                objective = new_objective
+
+            labels, best_sims, _ = self._similarities(X, centers, executor)
+
+        self.cluster_centers_ = centers
+        self.labels_ = labels
+        self.inertia_ = float(n - best_sims.sum())
+        return self
+
+    def fit_predict(self, X):
+        return self.fit(X).labels_
+
+    def predict(self, X):
+        """按余弦相似度分配到最近的中心（无需预先归一化）"""
+        with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+            labels, _, _ = self._similarities(X, self.cluster_centers_, executor)
+        return labels
+
+    def transform(self, X):
+        """返回样本与各中心的相似度矩阵"""
+        with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+            _, _, sims = self._similarities(X, self.cluster_centers_, executor)
+        return sims
+
+    def __getstate__(self):
+        return dict(self.__dict__, labels_=None)  # 持久化时不保存训练样本的标签
+
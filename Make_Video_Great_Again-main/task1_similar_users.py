@@ -1,103 +1,152 @@
 # -*- coding: utf-8 -*-
-import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from data_cache import DataCache
+from profiling import profiled
+import memory_budget
+from user_features import get_user_feature_store
+from decayed_profiles import get_decayed_profiles
 import logging
+import threading
 from scipy.sparse import csr_matrix
-from functools import lru_cache
 
-# 全局变量用于存储预计算的矩阵
-_user_tag_matrix = None
-_user_to_idx = None
-_unique_users = None
+# 预计算的矩阵：(用户-标签矩阵, 用户ID -> 行号, 按行排列的用户ID数组)
+# 三者作为一个元组整体发布（与 DataCache._daily_counts 相同），每次查询只读取一次，不会读到新旧混合的组合
+_matrix_state = None
+_matrix_lock = threading.Lock()  # 保证并发调用时矩阵只构建一次
+
+# 兴趣分数的时间衰减系数（每早一天乘以该系数，见 decayed_profiles.py）；None 表示各天同权
+RECENCY_DECAY = None
+
 
 def initialize_matrix():
-    """初始化并预计算用户-标签矩阵"""
-    global _user_tag_matrix, _user_to_idx, _unique_users
-    
-    if _user_tag_matrix is None:
-        videos_df = DataCache.load_videos()
-        operations_df = DataCache.load_operations()
-        
-        # 预处理数据：计算用户对每个标签的兴趣分数
-        operations_with_tag = pd.merge(
-            operations_df[['user_id', 'video_id', 'liked']],
-            videos_df[['id', 'tag']],
-            left_on='video_id',
-            right_on='id',
-            how='left'
-        )
-        
-        # 计算用户-标签交互分数
-        user_tag_scores = operations_with_tag.groupby(['user_id', 'tag']).agg({
-            'video_id': 'count',  # 观看次数
-            'liked': 'sum'        # 点赞数
-        }).reset_index()
-        
-        # 计算综合分数：观看次数 + 点赞数的加权和
-        user_tag_scores['score'] = user_tag_scores['video_id'] + 2 * user_tag_scores['liked']
-
-        # 创建映射字典
-        _unique_users = user_tag_scores['user_id'].unique()
-        unique_tags = user_tag_scores['tag'].unique()
-        _user_to_idx = {uid: idx for idx, uid in enumerate(_unique_users)}
-        tag_to_idx = {tag: idx for idx, tag in enumerate(unique_tags)}
-
-        # 构建稀疏矩阵
-        rows = np.array([_user_to_idx[user] for user in user_tag_scores['user_id']])
-        cols = np.array([tag_to_idx[tag] for tag in user_tag_scores['tag']])
-        data = user_tag_scores['score'].values
-
-        # 创建并标准化矩阵
-        _user_tag_matrix = csr_matrix(
-            (data, (rows, cols)),
-            shape=(len(_unique_users), len(unique_tags))
-        ).tocsr()  # 确保是CSR格式
-        
+    """
+    由用户特征库的兴趣分数（观看 + 2×点赞）构建 L2 标准化的用户-标签矩阵
+    设置了 RECENCY_DECAY 时改用按时间衰减的兴趣分数
+    并发调用时只有一个线程构建，其余线程等待；构建完成后的调用不加锁
+    返回 (矩阵, 用户ID -> 行号, 用户ID数组)，调用方应只使用这一份返回值
+    """
+    global _matrix_state
+
+    state = _matrix_state
+    if state is not None:
+        return state
+    with _matrix_lock:
+        if _matrix_state is not None:
+            return _matrix_state
+        if RECENCY_DECAY is None:
+            profiles = get_user_feature_store()
+            scores = profiles.tag_scores()
+        else:
+            # 存储值与真实值只差一个全局系数，标准化后相同
+            profiles = get_decayed_profiles(RECENCY_DECAY)
+            scores = profiles.user_tag
+
+        # 只保留看过有标签视频的用户（行按用户ID升序）
+        active = profiles.active_rows()
+        unique_users = profiles.user_ids[active]
+        user_tag_matrix = csr_matrix(scores[active]).astype(np.float64)
+
         # L2标准化
-        row_norms = np.sqrt(np.array(_user_tag_matrix.power(2).sum(axis=1)).flatten())
+        row_norms = np.sqrt(np.array(user_tag_matrix.power(2).sum(axis=1)).flatten())
         row_norms[row_norms == 0] = 1  # 避免除零
-        _user_tag_matrix = _user_tag_matrix.multiply(1 / row_norms[:, np.newaxis]).tocsr()
+        user_tag_matrix = user_tag_matrix.multiply(1 / row_norms[:, np.newaxis]).tocsr()
+
+        # 构建完成后整体发布
+        _matrix_state = (user_tag_matrix, {uid: idx for idx, uid in enumerate(unique_users)}, unique_users)
+        logging.info(f"用户-标签矩阵已构建: {user_tag_matrix.shape}")
+        return _matrix_state
 
+
+@DataCache.on_clear
+def clear_cache():
+    """清除预计算的矩阵（等待正在进行的构建完成后再清除），下次查询时重新构建"""
+    global _matrix_state
+    with _matrix_lock:
+        _matrix_state = None
+
+@profiled('task1_find_similar_users')
+@memory_budget.track_memory('task1_find_similar_users')
 def find_similar_users(target_user_id):
     """任务1：寻找相似用户群"""
     try:
-        # 验证用户ID是否存在
-        operations_df = DataCache.load_operations()
-        if target_user_id not in operations_df['user_id'].unique():
+        # 确保矩阵已初始化
+        state = initialize_matrix()
+
+        # 验证用户ID是否存在（矩阵只含看过有标签视频的用户）
+        index = state[1].get(target_user_id)
+        if index is None:
+            if str(target_user_id) in DataCache.get_user_ids():
+                raise ValueError(f"用户ID {target_user_id} 没有观看过有标签的视频")
             raise ValueError(f"用户ID {target_user_id} 不存在")
-            
+
         logging.info(f"开始处理用户 {target_user_id} 的相似用户分析")
 
-        # 确保矩阵已初始化
-        initialize_matrix()
-        
-        # 获取目标用户的向量
-        target_idx = _user_to_idx[target_user_id]
-        target_vector = _user_tag_matrix[target_idx].tocsr()
-        
-        # 计算相似度（使用矩阵乘法）
-        similarities = _user_tag_matrix.dot(target_vector.T).toarray().flatten()
-        
-        # 使用 argpartition 快速找出前k个最大值
-        k = 6  # 需要5个最相似的用户，多取一个以排除自己
-        top_indices = np.argpartition(similarities, -k)[-k:]
-        top_indices = top_indices[np.argsort(similarities[top_indices])][::-1]
-        
-        # 排除目标用户自己
-        top_indices = top_indices[top_indices != target_idx][:5]
-        
-        # 构建结果
-        result = [
-            {"user_ID": int(_unique_users[idx]), 
-             "similarity": round(float(similarities[idx]), 4)}
-            for idx in top_indices
-        ]
-        
+        result = _top_similar_users(state, np.array([index]))[0]
+
         logging.info(f"成功找到用户 {target_user_id} 的相似用户")
         return result
 
     except Exception as e:
         logging.error(f"寻找相似用户失败: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+
+def _top_similar_users(state, target_indices, k=5):
+    """
+    对一批目标用户（state 中矩阵的行号）做一次矩阵乘法，返回每个用户最相似的前k个用户
+    """
+    user_tag_matrix, _, unique_users = state
+    # 计算相似度（一次稀疏矩阵乘法得到 批大小×用户数 的相似度矩阵）
+    similarities = (user_tag_matrix[target_indices] @ user_tag_matrix.T).toarray()
+
+    # 排除目标用户自己，再用 argpartition 找出前k个最大值
+    similarities[np.arange(len(target_indices)), target_indices] = -np.inf
+    k = min(k, similarities.shape[1] - 1)
+    if k <= 0:
+        # 只有一个用户或 k=0：没有可返回的相似用户（[:, -0:] 会取到整行）
+        return [[] for _ in target_indices]
+    top = np.argpartition(similarities, -k, axis=1)[:, -k:]
+    top_scores = np.take_along_axis(similarities, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+    # 构建结果
+    return [
+        [{"user_ID": int(unique_users[idx]), "similarity": round(float(score), 4)}
+         for idx, score in zip(row, scores)]
+        for row, scores in zip(top, top_scores)
+    ]
+
+
+@profiled('task1_find_similar_users_batch')
+@memory_budget.track_memory('task1_find_similar_users_batch')
+def find_similar_users_batch(target_user_ids, k=5):
+    """
+    批量寻找相似用户：所有目标用户共用一次矩阵乘法
+    Returns:
+        与 target_user_ids 对应的结果列表，不存在的用户对应 None
+    """
+    try:
+        state = initialize_matrix()
+        user_tag_matrix, user_to_idx, _ = state
+        indices = np.array([user_to_idx.get(user_id, -1) for user_id in target_user_ids], dtype=np.int64)
+        known = indices >= 0
+
+        results = [None] * len(indices)
+        positions = np.flatnonzero(known)
+        if len(positions) == 0:
+            logging.info(f"批量寻找相似用户完成: 0/{len(indices)} 个用户")
+            return results
+        # 相似度矩阵每行约占 用户数×16 字节（稀疏乘积与稠密结果），超出内存预算时分块相乘
+        rows_per_product = memory_budget.chunk_rows(user_tag_matrix.shape[0] * 16, len(positions))
+        for start in range(0, len(positions), rows_per_product):
+            block = positions[start:start + rows_per_product]
+            for position, result in zip(block, _top_similar_users(state, indices[block], k)):
+                results[position] = result
+        logging.info(f"批量寻找相似用户完成: {int(known.sum())}/{len(indices)} 个用户")
+        return results
+
+    except Exception as e:
+        logging.error(f"批量寻找相似用户失败: {str(e)}")
+        raise
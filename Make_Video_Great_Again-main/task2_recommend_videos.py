@@ -3,101 +3,343 @@ import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 import pandas as pd
 from data_cache import DataCache
+from profiling import profiled
+import memory_budget
 import logging
+import threading
+import time
 from scipy.sparse import csr_matrix
-from task1_similar_users import find_similar_users, initialize_matrix
+from task1_similar_users import find_similar_users, find_similar_users_batch, initialize_matrix
 from functools import lru_cache
 
+# 多样性重排：从综合得分前 CANDIDATE_POOL 个候选中用 MMR 选出前 TOP_N 个
+TOP_N = 10
+CANDIDATE_POOL = 200
+DIVERSITY_WEIGHT = 0.0  # 默认不重排（结果与只按综合得分排序相同）；越大越偏向与已选视频不同的标签/观看人群
+RERANK_BUDGET_MS = 20.0  # 服务使用的重排时间预算；默认不设预算，结果只由数据决定
+OVERLAP_WEIGHT = 0.5  # 候选向量中"被哪些相似用户看过"部分相对标签部分的权重
+
+# 按数据版本缓存的 用户 -> 操作行号 索引
+_user_rows_cache = {}
+_user_rows_lock = threading.Lock()
+
+
+def _user_operation_index():
+    """
+    按用户ID稳定排序当前缓存的操作行，返回 (有序用户ID, 排序后行号, 各用户起止位置)
+    各用户的行号为 order[starts[i]:ends[i]]；增量写入（见 ingestion.py）后分段之间可能有空隙
+    索引不早于调用前取得的操作表（调用方需忽略超出其操作表行数的行号）
+    """
+    index = _user_rows_cache.get(DataCache.get_data_version())
+    if index is None:
+        with _user_rows_lock:
+            # 增量写入全程持有该锁：锁内读到的数据版本与操作表一致
+            version = DataCache.get_data_version()
+            index = _user_rows_cache.get(version)
+            if index is None:
+                user_ids = DataCache.load_operations()['user_id'].to_numpy()
+                order = np.argsort(user_ids, kind='stable')
+                unique_users, starts = np.unique(user_ids[order], return_index=True)
+                ends = np.append(starts[1:], len(order))
+                index = (unique_users, order, starts, ends)
+                _user_rows_cache.clear()
+                _user_rows_cache[version] = index
+    return index
+
+
+def _compact_user_operation_index(index):
+    """去掉分段之间的空隙，返回分段首尾相接的等价索引（已紧凑时原样返回）"""
+    unique_users, order, starts, ends = index
+    lengths = ends - starts
+    new_starts = np.cumsum(lengths) - lengths
+    if np.array_equal(starts, new_starts) and len(order) == lengths.sum():
+        return index
+    positions = np.repeat(starts - new_starts, lengths) + np.arange(lengths.sum())
+    return unique_users, order[positions], new_starts, new_starts + lengths
+
+
+def _operations_of(operations_df, user_ids):
+    """取出指定用户的全部操作（与布尔筛选结果相同，保持原有行顺序），避免每次扫描整张操作表"""
+    unique_users, order, starts, ends = _user_operation_index()
+    user_ids = np.unique(np.asarray(user_ids))
+    positions = np.searchsorted(unique_users, user_ids)
+    positions = positions[(positions < len(unique_users))
+                          & (unique_users[np.minimum(positions, len(unique_users) - 1)] == user_ids)]
+    if len(positions) == 0:
+        return operations_df.iloc[:0]
+    rows = np.concatenate([order[starts[p]:ends[p]] for p in positions])
+    # 索引可能已包含刚追加的操作（见 ingestion.py），而调用方的操作表是追加前取得的
+    rows = rows[rows < len(operations_df)]
+    return operations_df.iloc[np.sort(rows)]
+
+
+def _candidate_vectors(pool_tags, pool_video_ids, video_ops_df, similar_users):
+    """
+    候选视频的单位向量：[标签独热, OVERLAP_WEIGHT × 看过该视频的相似用户指示]
+    两个向量的点积即视频间相似度（同标签、被同一批相似用户看过则更相似）
+    """
+    tag_codes, _ = pd.factorize(pool_tags, use_na_sentinel=False)
+    n_pool = len(pool_video_ids)
+    rows = pd.Index(pool_video_ids).get_indexer(video_ops_df['video_id'])
+    cols = pd.Index(similar_users).get_indexer(video_ops_df['user_id'])
+    keep = (rows >= 0) & (cols >= 0)
+    viewers = csr_matrix((np.ones(int(keep.sum())), (rows[keep], cols[keep])),
+                         shape=(n_pool, len(similar_users))).toarray()
+    viewers = np.minimum(viewers, 1)
+    viewers *= OVERLAP_WEIGHT / np.sqrt(np.maximum(viewers.sum(axis=1, keepdims=True), 1))
+
+    vectors = np.zeros((n_pool, tag_codes.max() + 1 + viewers.shape[1]))
+    vectors[np.arange(n_pool), tag_codes] = 1.0
+    vectors[:, tag_codes.max() + 1:] = viewers
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _mmr_rerank(relevance, vectors, n_top, diversity, budget_ms=None):
+    """
+    最大边际相关性（MMR）重排：每一步选 (1-λ)·相关性 - λ·与已选视频的最大相似度 最大的候选
+    Args:
+        relevance: 候选的相关性（按降序排列，归一化到 0-1）
+        vectors: 候选的单位向量
+        diversity: λ
+        budget_ms: 选择过程的时间预算（毫秒，不含相似度矩阵计算），超出时返回 None；None 表示不限
+    Returns:
+        选中候选的下标（按选择顺序）
+    """
+    similarity = vectors @ vectors.T
+    deadline = None if budget_ms is None else time.perf_counter() + budget_ms / 1000
+    max_similarity = np.zeros(len(relevance))
+    available = np.ones(len(relevance), dtype=bool)
+    selected = []
+    for _ in range(min(n_top, len(relevance))):
+        if deadline is not None and time.perf_counter() > deadline:
+            return None
+        mmr = np.where(available, (1 - diversity) * relevance - diversity * max_similarity, -np.inf)
+        pick = int(np.argmax(mmr))
+        selected.append(pick)
+        available[pick] = False
+        np.maximum(max_similarity, similarity[pick], out=max_similarity)
+    return np.array(selected, dtype=np.intp)
+
+
 @lru_cache(maxsize=1)
 def get_video_data():
     """缓存视频数据"""
     return DataCache.load_videos()
 
-def recommend_videos(target_user_id):
-    """任务2：推荐相关视频"""
+
+@DataCache.on_clear
+def clear_cache():
+    """清除用户操作索引和缓存的视频数据"""
+    with _user_rows_lock:
+        _user_rows_cache.clear()
+    get_video_data.cache_clear()
+
+def _similar_user_lists(similar_users_results, all_users):
+    """各用户的相似用户列表：task1 的结果，再补充 45 个其它用户（与全部用户列表的顺序一致）"""
+    lists = []
+    for similar_users_result in similar_users_results:
+        similar_users = [item["user_ID"] for item in similar_users_result]
+        # 排除已有的相似用户后取前45个，只需看全部用户的前 45+len(similar_users) 个
+        head = all_users[:45 + len(similar_users)]
+        similar_users.extend(head[~np.isin(head, similar_users)][:45])
+        lists.append(similar_users)
+    return lists
+
+
+def _candidate_stats(operations_df, target_user_ids, similar_user_lists):
+    """
+    一次性统计一批用户的候选视频（相似用户看过、目标用户没看过的视频）
+    Returns:
+        (候选操作表, 候选统计表)，两表都带请求序号列 request 且按请求顺序排列；
+        统计表按 (request, video_id) 排序，列为 count、like_rate、user_overlap
+    """
+    lengths = [len(similar_users) for similar_users in similar_user_lists]
+    pairs = pd.DataFrame({
+        'request': np.repeat(np.arange(len(similar_user_lists)), lengths),
+        'user_id': np.concatenate(similar_user_lists).astype(np.int64),
+        'top': np.concatenate([np.arange(n) < 5 for n in lengths])  # 前5个相似用户，用于计算用户重叠度
+    })
+    targets = pd.DataFrame({'request': np.arange(len(target_user_ids)),
+                            'user_id': np.asarray(target_user_ids, dtype=np.int64)})
+
+    # 目标用户和全部相似用户的操作只取一次
+    user_ops = _operations_of(operations_df, np.concatenate([targets['user_id'], pairs['user_id']]))
+    user_ops = user_ops[['user_id', 'video_id', 'liked']]
+    candidate_ops = pairs.merge(user_ops, on='user_id')
+    viewed = targets.merge(user_ops, on='user_id')
+
+    # 去掉目标用户已观看的视频：(请求序号, 视频ID) 编码为单个整数后做集合差
+    stride = int(user_ops['video_id'].max()) + 1 if len(user_ops) else 1
+    keep = ~np.isin(candidate_ops['request'].to_numpy() * stride + candidate_ops['video_id'].to_numpy(),
+                    viewed['request'].to_numpy() * stride + viewed['video_id'].to_numpy())
+    candidate_ops = candidate_ops[keep]
+
+    video_stats = candidate_ops.groupby(['request', 'video_id']).agg(
+        count=('user_id', 'count'),
+        like_rate=('liked', 'mean')
+    )
+    # 用户重叠度 = 看过该视频的前5个相似用户数 / 5
+    top_pairs = candidate_ops.loc[candidate_ops['top'], ['request', 'video_id', 'user_id']]
+    overlap_counts = top_pairs.drop_duplicates().groupby(['request', 'video_id']).size()
+    video_stats['user_overlap'] = overlap_counts.reindex(video_stats.index, fill_value=0).to_numpy() / 5
+    return candidate_ops, video_stats.reset_index()
+
+
+def _rank_candidates(target_user_id, video_stats, video_ops_df, similar_users, tags,
+                     diversity=DIVERSITY_WEIGHT, rerank_budget_ms=None):
+    """根据单个用户的候选统计计算综合得分并取前 TOP_N 个（没有候选视频时返回空列表）"""
+    if len(video_stats) == 0:
+        return []
+
+    # 构建特征矩阵
+    features = np.array([
+        video_stats['count'].values,         # 观看次数
+        video_stats['like_rate'].values,     # 点赞率
+        video_stats['user_overlap'].values   # 用户重叠度
+    ]).T
+    
+    # 标准化特征
+    features = (features - features.mean(axis=0)) / (features.std(axis=0) + 1e-8)
+    
+    # 计算综合得分
+    base_scores = video_stats['count'].values * \
+                 (1 + video_stats['like_rate'].values) * \
+                 (1 + video_stats['user_overlap'].values)
+    final_scores = base_scores * (1 + features[:, 2])  # 增加用户重叠度权重
+    
+    # 获取前10个推荐
+    n_top = min(TOP_N, len(final_scores))
+    top_indices = np.argpartition(final_scores, -n_top)[-n_top:]
+    top_indices = top_indices[np.argsort(final_scores[top_indices])][::-1]
+
+    # 多样性重排：候选池为综合得分前 CANDIDATE_POOL 个（设置了时间预算且超出时保留上面的前10个）
+    n_pool = min(max(CANDIDATE_POOL, TOP_N), len(final_scores))
+    if diversity > 0 and n_pool > TOP_N:
+        pool_indices = np.argpartition(final_scores, -n_pool)[-n_pool:]
+        pool_indices = pool_indices[np.argsort(final_scores[pool_indices])][::-1]
+        pool_video_ids = video_stats['video_id'].to_numpy()[pool_indices]
+        pool_scores = final_scores[pool_indices]
+        relevance = (pool_scores - pool_scores[-1]) / max(pool_scores[0] - pool_scores[-1], 1e-12)
+        vectors = _candidate_vectors(tags.reindex(pool_video_ids).to_numpy(), pool_video_ids,
+                                     video_ops_df, similar_users)
+        order = _mmr_rerank(relevance, vectors, TOP_N, diversity, rerank_budget_ms)
+        if order is None:
+            logging.warning(f"用户 {target_user_id} 的推荐重排超出时间预算 {rerank_budget_ms}ms，使用未重排结果")
+        else:
+            top_indices = pool_indices[order]
+
+    # 构建结果
+    top_video_ids = video_stats['video_id'].to_numpy()[top_indices]
+    top_tags = tags.reindex(top_video_ids).to_numpy()
+    result = []
+    for video_id, label, idx in zip(top_video_ids, top_tags, top_indices):
+        result.append({
+            "Video_ID": int(video_id),
+            "label": label,
+            "Overall_rating": round(float(final_scores[idx]), 2)
+        })
+    return result
+
+
+def _recommend_for_users(target_user_ids, similar_users_results, operations_df, videos_df, all_users,
+                         diversity=DIVERSITY_WEIGHT, rerank_budget_ms=None):
+    """
+    根据相似用户的结果为一批（已确认存在的）用户生成推荐
+    候选视频的筛选和分组统计对整批只做一次，之后每个用户只做小数组上的打分和排序
+    Returns:
+        与 target_user_ids 对应的推荐列表，没有候选视频的用户为空列表
+    """
+    if len(target_user_ids) == 0:
+        return []
+    similar_user_lists = _similar_user_lists(similar_users_results, all_users)
+    candidate_ops, video_stats = _candidate_stats(operations_df, target_user_ids, similar_user_lists)
+    logging.info(f"批量统计候选视频: {len(target_user_ids)} 个用户, {len(video_stats)} 个候选")
+
+    tags = pd.Series(videos_df['tag'].to_numpy(), index=videos_df['id'])
+    requests = np.arange(len(target_user_ids) + 1)
+    stats_bounds = np.searchsorted(video_stats['request'].to_numpy(), requests)
+    ops_bounds = np.searchsorted(candidate_ops['request'].to_numpy(), requests)
+
+    results = []
+    for i, target_user_id in enumerate(target_user_ids):
+        results.append(_rank_candidates(
+            target_user_id,
+            video_stats.iloc[stats_bounds[i]:stats_bounds[i + 1]],
+            candidate_ops.iloc[ops_bounds[i]:ops_bounds[i + 1]],
+            similar_user_lists[i], tags, diversity, rerank_budget_ms))
+    return results
+
+
+def _diversity_weight(diversity):
+    diversity = DIVERSITY_WEIGHT if diversity is None else float(diversity)
+    if not 0 <= diversity <= 1:
+        raise ValueError("多样性权重必须在 0 到 1 之间")
+    return diversity
+
+
+@profiled('task2_recommend_videos')
+@memory_budget.track_memory('task2_recommend_videos')
+def recommend_videos(target_user_id, diversity=None, rerank_budget_ms=None):
+    """
+    任务2：推荐相关视频
+    Args:
+        diversity: 多样性权重 λ（0-1），默认 DIVERSITY_WEIGHT（不重排），0 表示只按综合得分排序
+        rerank_budget_ms: 多样性重排的时间预算（毫秒），超出时返回未重排结果；默认不限，结果可复现
+    """
     try:
         # 使用缓存数据
         videos_df = get_video_data()
         operations_df = DataCache.load_operations()
         
         # 验证用户ID是否存在
-        if target_user_id not in operations_df['user_id'].unique():
+        all_users = operations_df['user_id'].unique()
+        if target_user_id not in all_users:
             raise ValueError(f"用户ID {target_user_id} 不存在")
             
         logging.info(f"开始处理用户 {target_user_id} 的视频推荐")
 
-        # 获取用户已观看的视频（使用集合操作）
-        user_viewed_videos = set(operations_df[operations_df['user_id'] == target_user_id]['video_id'])
-        logging.info(f"用户已观看视频数: {len(user_viewed_videos)}")
-
         # 获取相似用户（复用task1的结果和矩阵）
         similar_users_result = find_similar_users(target_user_id)
-        similar_users = [item["user_ID"] for item in similar_users_result]
-        
-        # 获取更多相似用户（使用numpy操作优化）
-        all_users = np.array(list(operations_df['user_id'].unique()))
-        mask = ~np.isin(all_users, similar_users)
-        additional_users = all_users[mask][:45]
-        similar_users.extend(additional_users)
-
-        # 使用向量化操作获取候选视频
-        similar_users_ops = operations_df[operations_df['user_id'].isin(similar_users)]
-        candidate_videos = set(similar_users_ops['video_id']) - user_viewed_videos
-
-        if len(candidate_videos) == 0:
+        result = _recommend_for_users([target_user_id], [similar_users_result], operations_df, videos_df,
+                                      all_users, _diversity_weight(diversity), rerank_budget_ms)[0]
+        if not result:
             raise ValueError("没有找到合适的推荐视频")
 
-        # 预处理视频数据
-        video_data = []
-        video_ids = list(candidate_videos)
-        
-        # 使用 DataFrame 操作代替循环
-        video_ops_df = similar_users_ops[similar_users_ops['video_id'].isin(candidate_videos)]
-        video_stats = video_ops_df.groupby('video_id').agg({
-            'user_id': ['count', lambda x: set(x)],
-            'liked': 'mean'
-        }).reset_index()
-        
-        # 计算特征（向量化操作）
-        top_similar_users = set(similar_users[:5])
-        video_stats['user_overlap'] = video_stats[('user_id', '<lambda_0>')].apply(
-            lambda x: len(x & top_similar_users) / 5
-        )
-        
-        # 构建特征矩阵
-        features = np.array([
-            video_stats[('user_id', 'count')].values,  # 观看次数
-            video_stats['liked']['mean'].values,       # 点赞率
-            video_stats['user_overlap'].values         # 用户重叠度
-        ]).T
-        
-        # 标准化特征
-        features = (features - features.mean(axis=0)) / (features.std(axis=0) + 1e-8)
-        
-        # 计算综合得分
-        base_scores = video_stats[('user_id', 'count')].values * \
-                     (1 + video_stats['liked']['mean'].values) * \
-                     (1 + video_stats['user_overlap'].values)
-        final_scores = base_scores * (1 + features[:, 2])  # 增加用户重叠度权重
-        
-        # 获取前10个推荐
-        top_indices = np.argpartition(final_scores, -10)[-10:]
-        top_indices = top_indices[np.argsort(final_scores[top_indices])][::-1]
-        
-        # 构建结果
-        result = []
-        for idx in top_indices:
-            video_id = video_stats['video_id'].iloc[idx]
-            video_tag = videos_df[videos_df['id'] == video_id]['tag'].iloc[0]
-            result.append({
-                "Video_ID": int(video_id),
-                "label": video_tag,
-                "Overall_rating": round(float(final_scores[idx]), 2)
-            })
-
         logging.info(f"成功为用户 {target_user_id} 生成 {len(result)} 个视频推荐")
         return result
 
     except Exception as e:
         logging.error(f"生成视频推荐失败: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+
+@profiled('task2_recommend_videos_batch')
+@memory_budget.track_memory('task2_recommend_videos_batch')
+def recommend_videos_batch(target_user_ids, diversity=None, rerank_budget_ms=None):
+    """
+    批量推荐视频：相似用户通过一次矩阵乘法批量求得，候选视频的筛选和统计对整批只做一次
+    diversity、rerank_budget_ms 含义同 recommend_videos
+    Returns:
+        与 target_user_ids 对应的结果列表，不存在的用户为 None，没有候选视频的用户为空列表
+    """
+    try:
+        videos_df = get_video_data()
+        operations_df = DataCache.load_operations()
+        all_users = operations_df['user_id'].unique()
+        diversity = _diversity_weight(diversity)
+
+        similar_users_results = find_similar_users_batch(target_user_ids)
+        found = [i for i, similar_users_result in enumerate(similar_users_results)
+                 if similar_users_result is not None]
+        recommendations = _recommend_for_users(
+            [target_user_ids[i] for i in found], [similar_users_results[i] for i in found],
+            operations_df, videos_df, all_users, diversity, rerank_budget_ms)
+
+        results = [None] * len(similar_users_results)
+        for i, result in zip(found, recommendations):
+            results[i] = result
+        return results
+
+    except Exception as e:
+        logging.error(f"批量生成视频推荐失败: {str(e)}")
+        raise
@@ -5,93 +5,265 @@ from scipy.sparse import csr_matrix
 from sklearn.cluster import MiniBatchKMeans
 from sklearn.decomposition import IncrementalPCA
 from sklearn.preprocessing import StandardScaler
-import matplotlib.pyplot as plt
+from sklearn.utils import gen_batches
 import os
 import logging
-from PyQt6.QtGui import QPixmap
+import threading
+from chart_renderer import make_chart, save_chart
+from cluster_sweep import sweep_k
+from data_cache import DataCache
+import model_store
+from profiling import profiled
+import memory_budget
+from user_features import build_user_feature_store, get_user_feature_store
 
 # 配置日志
 logging.basicConfig(filename='results/user_clustering.log', level=logging.INFO)
 
+# 流式模式下 k-means partial_fit 遍历全部批次的轮数
+KMEANS_STREAMING_EPOCHS = 3
 
-def plot_user_clusters(labels, reduced_data, n_clusters):
-    """绘制用户聚类结果图"""
-    plt.figure(figsize=(10, 8))
-    plt.rcParams['font.sans-serif'] = ['SimHei']  # 使用黑体
-    plt.rcParams['axes.unicode_minus'] = False  # 解决负号显示问题
+# 正式聚类与 k 值扫描共用的 MiniBatchKMeans 参数
+KMEANS_PARAMS = {"random_state": 42, "batch_size": 1000}
 
-    scatter = plt.scatter(reduced_data[:, 0], reduced_data[:, 1],
-                          c=labels, cmap='viridis',
-                          alpha=0.7, s=20, edgecolor='k', linewidth=0.3)
+# 按数据版本缓存的降维特征，以及按 (数据版本, k) 缓存的已拟合模型
+# 并发调用时同一份特征/模型只计算一次（其余线程等待并复用结果）
+_feature_cache = {}
+_model_cache = {}
+_feature_lock = threading.Lock()
+_model_lock = threading.Lock()
 
-    plt.title(f'用户聚类结果 (k={n_clusters})')
-    plt.xlabel('PCA 主成分 1')
-    plt.ylabel('PCA 主成分 2')
-    plt.colorbar(scatter, label='聚类')
-    plt.grid(True, alpha=0.2)
+# 持久化模型名称
+MODEL_NAME = 'user_clusters'
 
-    plot_path = 'results/user_clusters.png'
-    plt.savefig(plot_path, dpi=300, bbox_inches='tight')
-    plt.close()
-    return plot_path
+# 批量模式（操作表载入缓存后由特征库分块累加）与流式模式（分块读取 CSV）每条操作的估计内存
+BATCH_BYTES_PER_OP = 80
+STREAMING_BYTES_PER_OP = 64
 
 
-def cluster_users(n_clusters=10):
+@DataCache.on_clear
+def clear_cache():
+    """清除缓存的特征和已拟合的模型"""
+    with _feature_lock, _model_lock:
+        _feature_cache.clear()
+        _model_cache.clear()
+
+
+def _finish_clustering(users_df, user_ids, user_clusters, user_features_reduced, chart_params):
     """
-    基于观看兴趣相似性对用户进行聚类
-    返回包含聚类结果的字典
+    保存聚类结果并构造返回值（chart_params 需区分批量/流式结果，避免共用图表缓存）
+    user_ids 为 user_clusters 各行对应的用户ID；不在其中的用户（没有任何有标签观看记录）聚类为 -1
     """
-    try:
-        # 加载数据
-        users_df = pd.read_csv('data/users.csv')
-        videos_df = pd.read_csv('data/videos.csv')
-        operations_df = pd.read_csv('data/operations.csv')
+    # 按用户ID把聚类结果添加到用户数据中（派生新表，不修改缓存）
+    labels = pd.Series(user_clusters, index=user_ids).reindex(users_df['id'].to_numpy(), fill_value=-1)
+    users_df = users_df.assign(cluster=labels.to_numpy())
+
+    # 保存结果，图表由 chart_renderer 按需渲染
+    os.makedirs('results', exist_ok=True)
+    users_df.to_csv('data/users_clustered.csv', index=False)
+    chart = make_chart('user_clusters', chart_params, {
+        "labels": user_clusters,
+        "reduced": user_features_reduced[:, :2]
+    })
+
+    return {
+        "data": users_df[['id', 'age', 'cluster']].to_dict('records'),
+        "plot_path": save_chart(chart),
+        "chart": chart
+    }
+
+
+def _cluster_users_streaming(n_clusters, chunk_size, batch_size):
+    """流式用户聚类：特征库分块读取操作数据构建，标准化、PCA 和 k-means 均按批 partial_fit"""
+    users_df = DataCache.load_users()
+
+    # 总是分块读取 CSV 单独构建（不使用也不替换缓存的特征库），内存占用受块大小限制
+    store = build_user_feature_store(streaming=True, chunk_size=chunk_size)
+    user_ids = users_df['id'].to_numpy()
+    user_tag_counts = store.tag_view_rows(user_ids)
+    tags = list(store.tags)
+    n_users = len(users_df)
+
+    # 批次划分与 IncrementalPCA.fit 保持一致
+    n_components = min(20, len(tags) - 1)
+    batches = list(gen_batches(n_users, batch_size, min_batch_size=n_components))
+
+    scaler = StandardScaler(with_mean=False)
+    for batch in batches:
+        scaler.partial_fit(user_tag_counts[batch])
 
-        # 创建用户-标签矩阵
-        operations_with_tag = operations_df.merge(
-            videos_df[['id', 'tag']],
-            left_on='video_id',
-            right_on='id',
-            how='left'
-        )
+    pca = IncrementalPCA(n_components=n_components, batch_size=batch_size)
+    for batch in batches:
+        pca.partial_fit(scaler.transform(user_tag_counts[batch].astype(np.float64)))
 
-        # 构建稀疏矩阵
-        tags = operations_with_tag['tag'].unique()
-        user_tag_counts = operations_with_tag.groupby(['user_id', 'tag']).size().reset_index(name='count')
+    user_features_reduced = np.empty((n_users, n_components))
+    for batch in batches:
+        user_features_reduced[batch] = pca.transform(
+            scaler.transform(user_tag_counts[batch].astype(np.float64)))
 
-        user_to_idx = {user_id: idx for idx, user_id in enumerate(user_tag_counts['user_id'].unique())}
-        tag_to_idx = {tag: idx for idx, tag in enumerate(tags)}
+    # 多轮遍历各批次，使中心收敛程度接近 fit_predict
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=batch_size)
+    for _ in range(KMEANS_STREAMING_EPOCHS):
+        for batch in batches:
+            kmeans.partial_fit(user_features_reduced[batch])
 
-        rows = user_tag_counts['user_id'].map(user_to_idx)
-        cols = user_tag_counts['tag'].map(tag_to_idx)
-        data = user_tag_counts['count']
+    user_clusters = np.empty(n_users, dtype=np.int32)
+    for batch in batches:
+        user_clusters[batch] = kmeans.predict(user_features_reduced[batch])
 
-        user_tag_sparse = csr_matrix((data, (rows, cols)),
-                                     shape=(len(user_to_idx), len(tag_to_idx)))
+    pipeline = {"tags": tags, "scaler": scaler, "pca": pca}
+    _save_user_model(pipeline, kmeans, n_clusters, mode='streaming')
+
+    logging.info(f"流式用户聚类完成: {n_users} 个用户, 块大小 {chunk_size}")
+    chart_params = {"n_clusters": n_clusters, "mode": 'streaming', "batch_size": batch_size}
+    return _finish_clustering(users_df, user_ids, user_clusters, user_features_reduced, chart_params)
+
+
+def _prepare_user_features():
+    """
+    构建标准化、降维后的用户特征（同一数据版本只计算一次）
+    返回 (users_df, 特征各行对应的用户ID, 降维特征, 特征变换流水线)
+    """
+    version = DataCache.get_data_version()
+    cached = _feature_cache.get(version)
+    if cached is not None:
+        return cached
+    with _feature_lock:
+        cached = _feature_cache.get(version)
+        if cached is not None:
+            return cached
+        # 加载数据（共享缓存的只读视图），用户-标签观看次数取自用户特征库
+        users_df = DataCache.load_users()
+        store = get_user_feature_store()
+
+        # 构建稀疏矩阵（只含看过有标签视频的用户，按用户ID升序）
+        tags = store.tags
+        active = store.active_rows()
+        user_ids = store.user_ids[active]
+        user_tag_sparse = csr_matrix(store.tag_views[active])
 
         # 标准化数据
         scaler = StandardScaler(with_mean=False)
         user_features = scaler.fit_transform(user_tag_sparse)
 
-        # 降维和聚类
+        # 降维（IncrementalPCA 按批转为稠密矩阵，无需整体 toarray）
         pca = IncrementalPCA(n_components=min(20, len(tags) - 1), batch_size=1000)
-        user_features_reduced = pca.fit_transform(user_features.toarray())
+        user_features_reduced = pca.fit_transform(user_features)
+
+        _feature_cache.clear()
+        _model_cache.clear()
+        pipeline = {"tags": list(tags), "scaler": scaler, "pca": pca}
+        cached = (users_df, user_ids, user_features_reduced, pipeline)
+        _feature_cache[version] = cached
+
+    return cached
+
+
+def _prepare_user_features_cached():
+    """当前数据版本的特征已缓存时返回缓存，否则返回 None"""
+    return _feature_cache.get(DataCache.get_data_version())
+
+
+def _fit_user_kmeans(user_features_reduced, n_clusters):
+    """拟合用户 k-means，优先复用 k 值扫描时缓存的模型"""
+    key = (DataCache.get_data_version(), n_clusters)
+    model = _model_cache.get(key)
+    if model is None:
+        with _model_lock:
+            model = _model_cache.get(key)
+            if model is None:
+                kmeans = MiniBatchKMeans(n_clusters=n_clusters, **KMEANS_PARAMS)
+                model = (kmeans, kmeans.fit_predict(user_features_reduced))
+                _model_cache[key] = model
+    return model
 
-        kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=1000)
-        user_clusters = kmeans.fit_predict(user_features_reduced)
 
-        # 将聚类结果添加到用户数据中
-        users_df['cluster'] = user_clusters[:len(users_df)]
+def _save_user_model(pipeline, kmeans, n_clusters, mode):
+    """持久化特征变换和聚类中心（与最新版本参数相同时跳过）"""
+    meta = {"data_version": DataCache.get_data_version(), "n_clusters": n_clusters, "mode": mode}
+    latest = model_store.latest_meta(MODEL_NAME)
+    if latest and all(latest.get(key) == value for key, value in meta.items()):
+        return latest['version']
+    return model_store.save_model(MODEL_NAME, dict(pipeline, kmeans=kmeans), meta)
+
+
+def _user_tag_counts_for(user_ids, tags):
+    """从用户特征库取指定用户在各标签上的观看次数，列顺序与 tags 一致"""
+    return get_user_feature_store().tag_view_rows(user_ids, tags)
+
+
+def assign_user_clusters(user_ids, version=None):
+    """
+    用已保存的模型为用户分配聚类（新用户或行为有变化的用户无需重新拟合）
+    Args:
+        user_ids: 用户ID列表
+        version: 模型版本，默认使用最新版本
+    Returns:
+        与 user_ids 对应的聚类编号数组，没有任何观看记录的用户为 -1
+    """
+    try:
+        model = model_store.load_model(MODEL_NAME, version)
+        unique_ids, inverse = np.unique(np.asarray(user_ids), return_inverse=True)
+
+        counts = _user_tag_counts_for(unique_ids, model['tags'])
+        features = model['scaler'].transform(counts.astype(np.float64))
+        labels = model['kmeans'].predict(model['pca'].transform(features)).astype(np.int64)
+        labels[counts.sum(axis=1) == 0] = -1
+        return labels[inverse]
+
+    except Exception as e:
+        logging.error(f"用户聚类分配失败: {str(e)}", exc_info=True)
+        raise RuntimeError(f"用户聚类分配失败: {str(e)}")
+
+
+def sweep_user_clusters(k_values=range(2, 21), n_jobs=-1, sample_size=5000):
+    """
+    并行评估多个聚类数量，返回每个 k 的惯性、轮廓系数和 DB 指数
+    拟合好的模型会被缓存，之后以任一 k 调用 cluster_users 无需重新拟合
+    """
+    try:
+        _, _, user_features_reduced, _ = _prepare_user_features()
+        scores, models = sweep_k(user_features_reduced, k_values, KMEANS_PARAMS,
+                                 n_jobs=n_jobs, sample_size=sample_size)
+        version = DataCache.get_data_version()
+        with _model_lock:
+            for k, model in models.items():
+                _model_cache[(version, k)] = model
+        return scores
+
+    except Exception as e:
+        logging.error(f"用户聚类 k 值扫描失败: {str(e)}", exc_info=True)
+        raise RuntimeError(f"用户聚类 k 值扫描失败: {str(e)}")
+
+
+@profiled('task4_cluster_users')
+@memory_budget.track_memory('task4_cluster_users')
+def cluster_users(n_clusters=10, streaming=False, chunk_size=500_000, batch_size=1000):
+    """
+    基于观看兴趣相似性对用户进行聚类
+    返回包含聚类结果的字典
+    Args:
+        n_clusters: 聚类数量
+        streaming: 是否使用流式模式（分块读取操作数据，不使用已缓存的特征库，内存占用受块大小限制）；
+            批量模式预计超出内存预算（见 memory_budget）时自动启用
+        chunk_size: 流式模式下每次读取的操作条数
+        batch_size: 流式模式下 partial_fit 的批大小
+    """
+    try:
+        # 批量特征构建超出内存预算时自动改用流式模式，块大小也受预算约束
+        if not streaming and _prepare_user_features_cached() is None:
+            n_ops = memory_budget.estimate_csv_rows('data/operations.csv')
+            streaming = not memory_budget.fits(n_ops * BATCH_BYTES_PER_OP, "用户聚类（批量特征构建）")
+        if streaming:
+            chunk_size = memory_budget.chunk_rows(STREAMING_BYTES_PER_OP, chunk_size)
+            return _cluster_users_streaming(n_clusters, chunk_size, batch_size)
 
-        # 保存结果和可视化
-        os.makedirs('results', exist_ok=True)
-        plot_path = plot_user_clusters(user_clusters, user_features_reduced, n_clusters)
-        users_df.to_csv('data/users_clustered.csv', index=False)
+        users_df, user_ids, user_features_reduced, pipeline = _prepare_user_features()
+        kmeans, user_clusters = _fit_user_kmeans(user_features_reduced, n_clusters)
+        _save_user_model(pipeline, kmeans, n_clusters, mode='batch')
 
-        return {
-            "data": users_df[['id', 'age', 'cluster']].to_dict('records'),
-            "plot_path": plot_path
-        }
+        chart_params = {"n_clusters": n_clusters, "mode": 'batch'}
+        return _finish_clustering(users_df, user_ids, user_clusters, user_features_reduced, chart_params)
 
     except Exception as e:
         logging.error(f"用户聚类失败: {str(e)}", exc_info=True)
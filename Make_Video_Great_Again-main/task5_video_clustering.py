@@ -4,79 +4,93 @@ import pandas as pd
 import numpy as np
 from scipy.sparse import csr_matrix
 from sklearn.cluster import MiniBatchKMeans
-from sklearn.decomposition import TruncatedSVD
-import matplotlib.pyplot as plt
+from sklearn.decomposition import TruncatedSVD, PCA
 import os
+import time
 import logging
+import threading
 from sklearn.preprocessing import normalize
-from PyQt6.QtGui import QPixmap
+from chart_renderer import make_chart, save_chart
+from cluster_sweep import sweep_k
+from data_cache import DataCache
+from spherical_kmeans import SphericalKMeans
+import model_store
+from profiling import profiled
+import memory_budget
 
 # 配置日志
 logging.basicConfig(filename='results/clustering.log', level=logging.INFO)
 
-def plot_clusters(labels, reduced_data, n_clusters):
-    """绘制聚类结果图"""
-    plt.figure(figsize=(10, 8))
-    plt.rcParams['font.sans-serif'] = ['SimHei']  # 使用黑体
-    plt.rcParams['axes.unicode_minus'] = False  # 解决负号显示问题
-
-    # 绘制散点图
-    scatter = plt.scatter(reduced_data[:, 0], reduced_data[:, 1],
-                          c=labels, cmap='viridis',
-                          alpha=0.7, s=20, edgecolor='k', linewidth=0.3)
-
-    # 标记聚类中心
-    centers = np.array([reduced_data[labels == i].mean(axis=0) for i in range(n_clusters)])
-    plt.scatter(centers[:, 0], centers[:, 1],
-                c='red', s=200, alpha=0.9, marker='X', edgecolor='k')
-
-    # 添加标签和标题
-    plt.title(f'视频聚类结果 (k={n_clusters})')
-    plt.xlabel('SVD 主成分 1')
-    plt.ylabel('SVD 主成分 2')
-    plt.colorbar(scatter, label='聚类')
-    plt.grid(True, alpha=0.2)
-
-    # 保存图像
-    plot_path = 'results/video_clusters.png'
-    plt.savefig(plot_path, dpi=300, bbox_inches='tight')
-    plt.close()
-    return plot_path
-
-def cluster_videos(n_clusters=5, sample_size=5000):
-    """视频聚类分析"""
-    try:
-        # 1. 数据加载
-        videos_df = pd.read_csv('data/videos.csv')
-        operations_df = pd.read_csv('data/operations.csv')
+# 正式聚类与 k 值扫描共用的 MiniBatchKMeans 参数
+KMEANS_PARAMS = {"random_state": 42, "batch_size": 500, "max_iter": 100, "n_init": 5}
+
+# 按 (数据版本, 采样数) 缓存的降维特征，以及按 (数据版本, 采样数, k) 缓存的已拟合模型
+# 并发调用时同一份特征/模型只计算一次（其余线程等待并复用结果）
+_feature_cache = {}
+_model_cache = {}
+_feature_lock = threading.Lock()
+_model_lock = threading.Lock()
+
+# 持久化模型名称
+MODEL_NAME = 'video_clusters'
+
+
+@DataCache.on_clear
+def clear_cache():
+    """清除缓存的特征和已拟合的模型"""
+    with _feature_lock, _model_lock:
+        _feature_cache.clear()
+        _model_cache.clear()
+
 
-        # 2. 构建交互矩阵
-        video_ids = operations_df['video_id'].unique()
-        user_ids = operations_df['user_id'].unique()
+def _build_video_user_matrix():
+    """
+    构建 视频×用户 加权交互矩阵（观看权重1，点赞权重2），只保留有交互的视频
+    返回 (videos_df, video_ids, user_ids, video_user_matrix)
+    """
+    # 1. 数据加载（共享缓存的只读视图，不再重复读取 CSV）
+    videos_df = DataCache.load_videos()
+    operations_df = DataCache.load_operations()
 
-        video_to_idx = {video: idx for idx, video in enumerate(video_ids)}
-        user_to_idx = {user: idx for idx, user in enumerate(user_ids)}
+    # 2. 构建交互矩阵（按首次出现顺序编号）
+    cols, video_ids = pd.factorize(operations_df['video_id'])
+    rows, user_ids = pd.factorize(operations_df['user_id'])
+    video_ids, user_ids = np.asarray(video_ids), np.asarray(user_ids)
 
-        # 行为权重分配
-        operations_df['weight'] = 1.0
-        operations_df.loc[operations_df['liked'] == 1, 'weight'] = 2.0
+    # 行为权重分配（派生为独立数组，不向缓存表添加列）
+    data = np.where(operations_df['liked'].to_numpy() == 1, 2.0, 1.0)
 
-        rows = operations_df['user_id'].map(user_to_idx)
-        cols = operations_df['video_id'].map(video_to_idx)
-        data = operations_df['weight'].values
+    sparse_matrix = csr_matrix((data, (rows, cols)),
+                             shape=(len(user_ids), len(video_ids)))
 
-        sparse_matrix = csr_matrix((data, (rows, cols)),
-                                 shape=(len(user_ids), len(video_ids)))
+    # 3. 只取有交互的视频
+    video_user_matrix = sparse_matrix.T
+    nonzero_indices = np.array(video_user_matrix.getnnz(axis=1) > 0).flatten()
+    video_user_matrix = video_user_matrix[nonzero_indices]
+    video_ids = video_ids[nonzero_indices]
 
-        # 3. 只取有交互的视频
-        video_user_matrix = sparse_matrix.T
-        nonzero_indices = np.array(video_user_matrix.getnnz(axis=1) > 0).flatten()
-        video_user_matrix = video_user_matrix[nonzero_indices]
-        video_ids = video_ids[nonzero_indices]
+    return videos_df, video_ids, user_ids, video_user_matrix
 
-        # 4. 采样部分视频加速
+
+def _prepare_video_features(sample_size):
+    """
+    构建归一化、降维后的视频特征（同一数据版本和采样数只计算一次）
+    返回 (videos_df, video_ids, 降维特征, 特征变换流水线)
+    """
+    key = (DataCache.get_data_version(), sample_size)
+    cached = _feature_cache.get(key)
+    if cached is not None:
+        return cached
+    with _feature_lock:
+        cached = _feature_cache.get(key)
+        if cached is not None:
+            return cached
+        # 1-3. 构建只含有交互视频的 视频×用户 矩阵
+        videos_df, video_ids, user_ids, video_user_matrix = _build_video_user_matrix()
+
+        # 4. 采样部分视频加速（固定随机种子，保证同参数下结果与图表一致）
         if sample_size and video_user_matrix.shape[0] > sample_size:
-            idx = np.random.choice(video_user_matrix.shape[0], sample_size, replace=False)
+            idx = np.random.default_rng(42).choice(video_user_matrix.shape[0], sample_size, replace=False)
             video_user_matrix = video_user_matrix[idx]
             video_ids = video_ids[idx]
 
@@ -87,32 +101,192 @@ def cluster_videos(n_clusters=5, sample_size=5000):
         svd = TruncatedSVD(n_components=2, random_state=42)
         video_user_matrix_reduced = svd.fit_transform(video_user_matrix)
 
+        if _feature_cache and next(iter(_feature_cache))[0] != key[0]:
+            _feature_cache.clear()
+            _model_cache.clear()
+        pipeline = {"user_ids": user_ids, "svd": svd}
+        cached = (videos_df, video_ids, video_user_matrix_reduced, pipeline)
+        _feature_cache[key] = cached
+
+    return cached
+
+
+def _fit_video_kmeans(video_user_matrix_reduced, n_clusters, sample_size):
+    """拟合视频 k-means，优先复用 k 值扫描时缓存的模型"""
+    key = (DataCache.get_data_version(), sample_size, n_clusters)
+    model = _model_cache.get(key)
+    if model is None:
+        with _model_lock:
+            model = _model_cache.get(key)
+            if model is None:
+                kmeans = MiniBatchKMeans(n_clusters=n_clusters, **KMEANS_PARAMS)
+                model = (kmeans, kmeans.fit_predict(video_user_matrix_reduced))
+                _model_cache[key] = model
+    return model
+
+
+def _save_video_model(pipeline, kmeans, n_clusters, sample_size, n_components=2):
+    """持久化 SVD 和聚类中心（与最新版本参数相同时跳过）"""
+    meta = {"data_version": DataCache.get_data_version(), "n_clusters": n_clusters,
+            "sample_size": sample_size, "n_components": n_components}
+    latest = model_store.latest_meta(MODEL_NAME)
+    if latest and all(latest.get(key) == value for key, value in meta.items()):
+        return latest['version']
+    return model_store.save_model(MODEL_NAME, dict(pipeline, kmeans=kmeans), meta)
+
+
+def _video_user_rows_for(video_ids, user_ids):
+    """从缓存的操作数据中构建指定视频的 视频×用户 加权交互矩阵，列顺序与 user_ids 一致"""
+    operations_df = DataCache.load_operations()
+
+    video_index = pd.Index(video_ids)
+    video_ops = operations_df[operations_df['video_id'].isin(video_index)]
+    rows = video_index.get_indexer(video_ops['video_id'])
+    cols = pd.Index(user_ids).get_indexer(video_ops['user_id'])
+    weights = np.where(video_ops['liked'].to_numpy() == 1, 2.0, 1.0)
+
+    valid = cols >= 0
+    return csr_matrix((weights[valid], (rows[valid], cols[valid])),
+                      shape=(len(video_index), len(user_ids)))
+
+
+def assign_video_clusters(video_ids, version=None):
+    """
+    用已保存的模型为视频分配聚类（新视频或交互有变化的视频无需重新拟合）
+    Args:
+        video_ids: 视频ID列表
+        version: 模型版本，默认使用最新版本
+    Returns:
+        与 video_ids 对应的聚类编号数组，没有交互记录的视频为 -1
+    """
+    try:
+        model = model_store.load_model(MODEL_NAME, version)
+        unique_ids, inverse = np.unique(np.asarray(video_ids), return_inverse=True)
+
+        video_user_matrix = _video_user_rows_for(unique_ids, model['user_ids'])
+        features = normalize(video_user_matrix, norm='l2', axis=1)
+        if model['svd'] is not None:
+            features = model['svd'].transform(features)
+        labels = model['kmeans'].predict(features).astype(np.int64)
+        labels[video_user_matrix.getnnz(axis=1) == 0] = -1
+        return labels[inverse]
+
+    except Exception as e:
+        logging.error(f"视频聚类分配失败: {str(e)}", exc_info=True)
+        raise RuntimeError(f"视频聚类分配失败: {str(e)}")
+
+
+def sweep_video_clusters(k_values=range(2, 21), sample_size=5000, n_jobs=-1, metric_sample_size=5000):
+    """
+    并行评估多个聚类数量，返回每个 k 的惯性、轮廓系数和 DB 指数
+    拟合好的模型会被缓存，之后以任一 k 调用 cluster_videos 无需重新拟合
+    """
+    try:
+        _, _, video_user_matrix_reduced, _ = _prepare_video_features(sample_size)
+        scores, models = sweep_k(video_user_matrix_reduced, k_values, KMEANS_PARAMS,
+                                 n_jobs=n_jobs, sample_size=metric_sample_size)
+        version = DataCache.get_data_version()
+        with _model_lock:
+            for k, model in models.items():
+                _model_cache[(version, sample_size, k)] = model
+        return scores
+
+    except Exception as e:
+        logging.error(f"视频聚类 k 值扫描失败: {str(e)}", exc_info=True)
+        raise RuntimeError(f"视频聚类 k 值扫描失败: {str(e)}")
+
+
+def _finish_clustering(videos_df, video_ids, video_labels, reduced, chart_params, throughput=None):
+    """合并聚类标签并构造返回值"""
+    # 8. 结果处理
+    cluster_mapping = pd.DataFrame({
+        'video_id': video_ids,
+        'cluster': video_labels
+    })
+    result_df = videos_df.merge(cluster_mapping, left_on='id', right_on='video_id', how='left')
+    result_df = result_df.assign(cluster=result_df['cluster'].fillna(-1).astype(int))
+
+    # 9. 图表由 chart_renderer 按需渲染
+    chart = make_chart('video_clusters', chart_params, {
+        "labels": video_labels,
+        "reduced": reduced
+    })
+
+    result = {
+        "data": result_df[['id', 'tag', 'views', 'likes', 'cluster']].to_dict('records'),
+        "plot_path": save_chart(chart),
+        "chart": chart
+    }
+    if throughput is not None:
+        result["throughput"] = throughput
+    return result
+
+
+def _cluster_videos_full(n_clusters, n_components, n_jobs):
+    """
+    全量视频聚类：在L2归一化的稀疏 视频×用户 矩阵上直接运行球面 k-means
+    n_components 不为空时先用 TruncatedSVD 降到该维数再聚类
+    返回 (videos_df, video_ids, 标签, 二维坐标, 吞吐量信息)
+    """
+    videos_df, video_ids, user_ids, video_user_matrix = _build_video_user_matrix()
+
+    start = time.time()
+    features = normalize(video_user_matrix.tocsr(), norm='l2', axis=1)
+    svd = None
+    if n_components:
+        svd = TruncatedSVD(n_components=n_components, random_state=42)
+        features = normalize(svd.fit_transform(features), norm='l2', axis=1)
+
+    kmeans = SphericalKMeans(n_clusters=n_clusters, n_jobs=n_jobs)
+    video_labels = kmeans.fit_predict(features)
+    seconds = time.time() - start
+
+    throughput = {
+        "videos": int(len(video_ids)),
+        "seconds": round(seconds, 3),
+        "videos_per_sec": round(len(video_ids) / seconds, 1) if seconds > 0 else None,
+        "iterations": kmeans.n_iter_
+    }
+    logging.info(f"全量视频聚类完成: {throughput}")
+
+    # 绘图坐标：各视频与聚类中心相似度的前两个主成分
+    reduced = PCA(n_components=2, random_state=42).fit_transform(kmeans.transform(features))
+
+    _save_video_model({"user_ids": user_ids, "svd": svd}, kmeans, n_clusters,
+                      sample_size=None, n_components=n_components)
+    return videos_df, video_ids, video_labels, reduced, throughput
+
+
+@profiled('task5_cluster_videos')
+@memory_budget.track_memory('task5_cluster_videos')
+def cluster_videos(n_clusters=5, sample_size=5000, full=False, n_components=None, n_jobs=None):
+    """
+    视频聚类分析
+    Args:
+        n_clusters: 聚类数量
+        sample_size: 采样模式下参与聚类的视频数
+        full: 是否对全部有交互的视频聚类（球面 k-means，不采样）
+        n_components: 全量模式下的 SVD 维数，None 表示直接在稀疏矩阵上聚类
+        n_jobs: 全量模式下的线程数，默认使用全部CPU
+    """
+    try:
+        if full:
+            videos_df, video_ids, video_labels, reduced, throughput = _cluster_videos_full(
+                n_clusters, n_components, n_jobs)
+            chart_params = {"n_clusters": n_clusters, "full": True, "n_components": n_components}
+            return _finish_clustering(videos_df, video_ids, video_labels, reduced,
+                                      chart_params, throughput=throughput)
+
+        videos_df, video_ids, video_user_matrix_reduced, pipeline = _prepare_video_features(sample_size)
+
         # 7. 聚类
-        kmeans = MiniBatchKMeans(n_clusters=n_clusters,
-                               random_state=42,
-                               batch_size=500,
-                               max_iter=100,
-                               n_init=5)
-        video_labels = kmeans.fit_predict(video_user_matrix_reduced)
-
-        # 8. 结果处理
-        result_df = videos_df.copy()
-        cluster_mapping = pd.DataFrame({
-            'video_id': video_ids,
-            'cluster': video_labels
-        })
-        result_df = result_df.merge(cluster_mapping, left_on='id', right_on='video_id', how='left')
-        result_df['cluster'] = result_df['cluster'].fillna(-1).astype(int)
-
-        # 9. 保存结果和可视化
-        os.makedirs('results', exist_ok=True)
-        plot_path = plot_clusters(video_labels, video_user_matrix_reduced, n_clusters)
-
-        return {
-            "data": result_df[['id', 'tag', 'views', 'likes', 'cluster']].to_dict('records'),
-            "plot_path": plot_path
-        }
+        kmeans, video_labels = _fit_video_kmeans(video_user_matrix_reduced, n_clusters, sample_size)
+        _save_video_model(pipeline, kmeans, n_clusters, sample_size)
+
+        chart_params = {"n_clusters": n_clusters, "sample_size": sample_size}
+        return _finish_clustering(videos_df, video_ids, video_labels, video_user_matrix_reduced,
+                                  chart_params)
 
     except Exception as e:
         logging.error(f"聚类失败: {str(e)}", exc_info=True)
-        raise RuntimeError(f"视频聚类失败: {str(e)}")
\ No newline at end of file
+        raise RuntimeError(f"视频聚类失败: {str(e)}")
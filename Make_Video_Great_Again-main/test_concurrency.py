@@ -0,0 +1,223 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from data_cache import DataCache
+from generate_users_operations import generate_users_operations
+from generate_videos import generate_videos
+import task1_similar_users
+import task2_recommend_videos
+import task4_user_clustering
+import user_features
+
+# 每条日志对应一次真实加载/构建，用于统计并发时实际执行了几次
+LOAD_MESSAGES = {
+    "视频数据已加载到缓存": "videos",
+    "操作数据已加载到缓存": "operations",
+    "用户数据已加载到缓存": "users",
+    "视频每日计数矩阵已构建": "daily_counts",
+    "用户-标签矩阵": "user_tag_matrix",
+    "用户特征库已构建": "user_feature_store",
+}
+
+
+class LoadCounter(logging.Handler):
+    """统计各资源的加载次数"""
+
+    def __init__(self):
+        super().__init__(level=logging.INFO)
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        message = record.getMessage()
+        for prefix, name in LOAD_MESSAGES.items():
+            if message.startswith(prefix):
+                with self._lock:
+                    self.counts[name] += 1
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+
+
+def _reset_all():
+    # 同时清除各任务登记的派生缓存（用户特征库、任务1矩阵、任务2索引、任务4特征与模型）
+    DataCache.clear_cache()
+
+
+def _run_threads(n_threads, target):
+    """所有线程在同一时刻开始执行 target(线程号)，返回各线程抛出的异常"""
+    barrier = threading.Barrier(n_threads)
+    errors = []
+
+    def worker(i):
+        try:
+            barrier.wait()
+            target(i)
+        except Exception as e:
+            errors.append(f"线程 {i}: {type(e).__name__}: {str(e)}")
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def check_single_flight(n_threads, counter, with_clustering):
+    """冷缓存下多个线程同时请求：每种资源只加载一次，所有线程拿到同一份数据"""
+    _reset_all()
+    counter.reset()
+    seen = [None] * n_threads
+    user_id = 1
+
+    def target(i):
+        operations_df = DataCache.load_operations()
+        DataCache.load_videos()
+        DataCache.load_users()
+        daily_views, daily_likes = DataCache.load_daily_counts()
+        assert DataCache.get_user_ids() is not None, "用户ID集合未就绪"
+        assert daily_views.shape == daily_likes.shape, "每日计数矩阵不一致"
+        similar = task1_similar_users.find_similar_users_batch([user_id])[0]
+        recommendations = task2_recommend_videos.recommend_videos_batch([user_id])[0]
+        features = task4_user_clustering._prepare_user_features()[2] if with_clustering else None
+        seen[i] = (operations_df['user_id'].to_numpy().__array_interface__['data'][0],
+                   id(task1_similar_users.initialize_matrix()), id(features), str(similar), str(recommendations))
+
+    errors = _run_threads(n_threads, target)
+    expected = {"videos": 1, "operations": 1, "users": 1, "daily_counts": 1, "user_tag_matrix": 1,
+                "user_feature_store": 1}
+    for name, count in expected.items():
+        if counter.counts[name] != count:
+            errors.append(f"{name} 加载了 {counter.counts[name]} 次（应为 {count} 次）")
+    if len(set(seen)) != 1:
+        errors.append(f"各线程得到的数据或结果不一致: {len(set(seen))} 种")
+    return errors
+
+
+def check_clear_while_reading(n_threads, seconds):
+    """读取线程持续访问缓存的同时反复 clear_cache：不应出现异常或半初始化状态"""
+    _reset_all()
+    deadline = time.perf_counter() + seconds
+    reads = Counter()
+
+    def target(i):
+        if i == 0:
+            while time.perf_counter() < deadline:
+                DataCache.clear_cache()
+                time.sleep(0.05)
+            return
+        while time.perf_counter() < deadline:
+            operations_df = DataCache.load_operations()
+            assert operations_df is not None and len(operations_df) > 0, "读到空的操作数据"
+            assert DataCache.get_user_ids() is not None, "用户ID集合为 None"
+            daily_views, daily_likes = DataCache.load_daily_counts()
+            assert daily_views is not None and daily_likes is not None, "每日计数矩阵为 None"
+            views, likes = DataCache.get_video_daily_history(int(DataCache.load_videos()['id'].iloc[0]))
+            assert len(views) == len(likes), "每日历史长度不一致"
+            reads[i] += 1
+
+    errors = _run_threads(n_threads, target)
+    if sum(reads.values()) == 0:
+        errors.append("清除期间没有完成任何读取")
+    return errors
+
+
+@pytest.fixture(scope="module")
+def small_data(tmp_path_factory):
+    """在临时目录生成一份小数据集并切换工作目录到该目录"""
+    data_dir = tmp_path_factory.mktemp("video_data")
+    cwd = os.getcwd()
+    os.chdir(data_dir)
+    try:
+        np.random.seed(0)
+        generate_videos(force=True, num_videos=2000)
+        generate_users_operations(force=True, num_users=200, min_ops=20, max_ops=40)
+        yield data_dir
+    finally:
+        _reset_all()
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def load_counter():
+    """把 LoadCounter 挂到根日志上，测试结束后还原日志级别"""
+    root = logging.getLogger()
+    counter = LoadCounter()
+    level = root.level
+    root.addHandler(counter)
+    root.setLevel(logging.INFO)
+    try:
+        yield counter
+    finally:
+        root.removeHandler(counter)
+        root.setLevel(level)
+
+
+@pytest.mark.parametrize("n_threads", [2, 8])
+@pytest.mark.parametrize("with_clustering", [False, True])
+def test_single_flight(small_data, load_counter, n_threads, with_clustering):
+    errors = check_single_flight(n_threads, load_counter, with_clustering)
+    assert not errors, "\n".join(errors)
+
+
+@pytest.mark.parametrize("n_threads", [2, 8])
+def test_clear_while_reading(small_data, n_threads):
+    errors = check_clear_while_reading(n_threads, 0.5)
+    assert not errors, "\n".join(errors)
+
+
+def test_clear_cache_resets_derived(small_data):
+    """clear_cache 后任务1的矩阵和用户特征库都重新构建，不再沿用旧数据"""
+    _reset_all()
+    state = task1_similar_users.initialize_matrix()
+    store = user_features.get_user_feature_store()
+    DataCache.clear_cache()
+    assert task1_similar_users.initialize_matrix() is not state
+    assert user_features.get_user_feature_store() is not store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DataCache 与任务缓存的并发压力测试")
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--clear-seconds', type=float, default=3.0)
+    parser.add_argument('--with-clustering', action='store_true', help="同时测试任务4的特征缓存")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    counter = LoadCounter()
+    logging.getLogger().addHandler(counter)
+    logging.getLogger().setLevel(logging.INFO)
+    for handler in logging.getLogger().handlers:
+        if handler is not counter:
+            handler.setLevel(logging.WARNING)
+
+    failures = []
+    for round_idx in range(args.rounds):
+        start = time.perf_counter()
+        errors = check_single_flight(args.threads, counter, args.with_clustering)
+        print(f"单次加载 第{round_idx + 1}轮: {args.threads} 个线程, 耗时 {time.perf_counter() - start:.2f} 秒, "
+              f"加载次数 {dict(counter.counts)}, {'通过' if not errors else '失败'}")
+        failures.extend(errors)
+
+    errors = check_clear_while_reading(args.threads, args.clear_seconds)
+    print(f"并发清除缓存: {'通过' if not errors else '失败'}")
+    failures.extend(errors)
+
+    for error in failures:
+        print(f"  {error}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
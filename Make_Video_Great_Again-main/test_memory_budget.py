@@ -0,0 +1,49 @@
+# test_memory_budget.py —— 任务峰值内存记录的多线程测试
+import threading
+import time
+
+import pytest
+
+import memory_budget
+
+
+def _allocate():
+    """分配一些内存并短暂停留，使多个线程的任务互相重叠"""
+    buffer = bytearray(1 << 20)
+    time.sleep(0.02)
+    return len(buffer)
+
+
+def _monitor_threads():
+    return [thread for thread in threading.enumerate() if thread.name == 'rss-monitor']
+
+
+@pytest.mark.parametrize("n_threads", [3, 8])
+def test_tracked_memory_threads(n_threads):
+    """开启峰值内存记录后多个线程同时执行任务：共用的采样线程在最后一个任务结束时停止"""
+    allocate = memory_budget.track_memory('threads_case')(_allocate)
+    barrier = threading.Barrier(n_threads)
+    errors = []
+
+    def worker(i):
+        try:
+            barrier.wait()
+            allocate()
+        except Exception as e:
+            errors.append(f"线程 {i}: {type(e).__name__}: {str(e)}")
+
+    memory_budget.set_tracking(True)
+    try:
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        memory_budget.set_tracking(False)
+
+    assert not errors, "\n".join(errors)
+    for thread in _monitor_threads():
+        thread.join(timeout=1)
+    assert not _monitor_threads(), "采样线程没有停止"
+    assert memory_budget.last_peaks["threads_case"]["seconds"] >= 0
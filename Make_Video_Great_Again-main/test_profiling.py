@@ -0,0 +1,65 @@
+# test_profiling.py —— 剖析装饰器的多线程与写出失败测试
+import threading
+import time
+import tracemalloc
+
+import pytest
+
+import profiling
+
+
+@pytest.fixture
+def profiling_on(tmp_path, monkeypatch):
+    """在临时目录中开启剖析（不过滤短调用），测试结束后关闭"""
+    monkeypatch.chdir(tmp_path)
+    profiling.set_profiling(True, min_ms=0)
+    try:
+        yield tmp_path
+    finally:
+        profiling.set_profiling(False)
+
+
+def _allocate():
+    """分配一些内存并短暂停留，使多个线程的调用互相重叠"""
+    buffer = bytearray(1 << 20)
+    time.sleep(0.02)
+    return len(buffer)
+
+
+def _run_threads(n_threads, target):
+    """所有线程在同一时刻开始执行 target()，返回各线程抛出的异常"""
+    barrier = threading.Barrier(n_threads)
+    errors = []
+
+    def worker(i):
+        try:
+            barrier.wait()
+            target()
+        except Exception as e:
+            errors.append(f"线程 {i}: {type(e).__name__}: {str(e)}")
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+@pytest.mark.parametrize("n_threads", [3, 8])
+def test_profiled_threads(profiling_on, n_threads):
+    """多个线程同时执行被剖析的调用：共享的 tracemalloc 不应被某个线程提前停止，全部结束后停止"""
+    allocate = profiling.profiled('threads_case')(_allocate)
+    errors = _run_threads(n_threads, allocate)
+    assert not errors, "\n".join(errors)
+    assert not tracemalloc.is_tracing()
+    assert list((profiling_on / profiling.PROFILE_DIR).glob("threads_case_*.prof"))
+
+
+def test_profiled_report_failure(profiling_on, monkeypatch):
+    """写出剖析结果失败时被剖析函数的返回值照常返回"""
+    blocked = profiling_on / "blocked"
+    blocked.write_text("")  # 结果目录的上级是普通文件，创建目录会失败
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(blocked / "profiles"))
+    assert profiling.profiled("failing_report")(lambda: 42)() == 42
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,214 @@
+# trending.py —— 基于滑动天窗口的实时热门视频榜
+# -*- coding: utf-8 -*-
+import heapq
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from data_cache import DataCache, NUM_DAYS
+
+
+class _DayBucket:
+    """
+    单日（单标签）计数桶，最多保留约 2*capacity 个视频
+    超出后裁剪到前 capacity 个，被裁掉的最大计数记为 floor，
+    之后新出现的视频从 floor 开始计数（Space-Saving 思路，计数偏高不超过 floor）
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.floor = 0.0
+
+    def add(self, video_id, weight):
+        counts = self.counts
+        counts[video_id] = counts.get(video_id, self.floor) + weight
+        if len(counts) > 2 * self.capacity:
+            self._prune()
+
+    def add_many(self, video_ids, weights):
+        counts = self.counts
+        floor = self.floor
+        for video_id, weight in zip(video_ids, weights):
+            counts[video_id] = counts.get(video_id, floor) + weight
+            if len(counts) > 2 * self.capacity:
+                self._prune()
+                counts, floor = self.counts, self.floor
+
+    def _prune(self):
+        """裁剪到计数最高的 capacity 个视频"""
+        keys = np.fromiter(self.counts.keys(), dtype=np.int64, count=len(self.counts))
+        values = np.fromiter(self.counts.values(), dtype=np.float64, count=len(self.counts))
+        keep = np.argpartition(values, -self.capacity)[-self.capacity:]
+        dropped = np.ones(len(values), dtype=bool)
+        dropped[keep] = False
+        self.floor = max(self.floor, float(values[dropped].max()))
+        self.counts = dict(zip(keys[keep].tolist(), values[keep].tolist()))
+
+
+class TrendingEngine:
+    """
+    热门视频榜引擎
+    按 day 顺序消费操作流，只保留最近 window_days 天的计数桶；
+    每个 (天, 标签) 桶容量有上限，内存与操作总数无关。
+    视频得分 = Σ 当日权重 × decay^(距今天数)，权重 = 1 + like_weight × liked
+    """
+
+    def __init__(self, window_days=NUM_DAYS, capacity=5000, decay=1.0,
+                 like_weight=1.0, video_tags=None):
+        """
+        Args:
+            window_days: 滑动窗口天数
+            capacity: 每个 (天, 标签) 桶保留的视频数上限
+            decay: 每早一天得分乘以的衰减系数，1.0 表示不衰减
+            like_weight: 点赞相对观看的额外权重
+            video_tags: 以视频ID为索引的标签 Series，为 None 时不区分标签
+        """
+        if not 0 < decay <= 1:
+            raise ValueError("decay 必须在 (0, 1] 之间")
+        self.window_days = window_days
+        self.capacity = capacity
+        self.decay = decay
+        self.like_weight = like_weight
+        self.video_tags = video_tags
+
+        self.current_day = None
+        self._buckets = deque(maxlen=window_days)  # 每项为 {tag: _DayBucket}，最新一天在最右
+        self._version = 0
+        self._tag_versions = {}
+        self._leaderboards = {}  # (天数, 标签) -> (版本号, 按得分降序的 [(video_id, score)])
+
+    @classmethod
+    def from_data_cache(cls, **kwargs):
+        """用缓存中的视频标签和操作数据构建引擎"""
+        videos_df = DataCache.load_videos()
+        engine = cls(video_tags=pd.Series(videos_df['tag'].values, index=videos_df['id']), **kwargs)
+        engine.consume(DataCache.load_operations())
+        return engine
+
+    def _advance_to(self, day):
+        """切换到新的一天，必要时补齐中间的空桶"""
+        if self.current_day is not None and day < self.current_day:
+            raise ValueError(f"操作流必须按天递增: 当前第{self.current_day}天，收到第{day}天")
+        if self.current_day is None:
+            self._buckets.append({})
+        else:
+            for _ in range(min(day - self.current_day, self.window_days)):
+                self._buckets.append({})
+        if day != self.current_day:
+            self.current_day = day
+            self._version += 1
+            self._tag_versions.clear()
+
+    def _bucket(self, tag):
+        buckets = self._buckets[-1]
+        if tag not in buckets:
+            buckets[tag] = _DayBucket(self.capacity)
+        return buckets[tag]
+
+    def _touch(self, tag):
+        self._version += 1
+        self._tag_versions[tag] = self._tag_versions.get(tag, 0) + 1
+
+    def add_event(self, video_id, liked, day):
+        """消费单条操作"""
+        self._advance_to(day)
+        tag = self.video_tags.get(video_id) if self.video_tags is not None else None
+        self._bucket(tag).add(int(video_id), 1.0 + self.like_weight * liked)
+        self._touch(tag)
+
+    def consume(self, operations):
+        """
+        批量消费操作数据（DataFrame 需包含 video_id、liked、day 列）
+        同一天内先按视频聚合再写入计数桶
+        """
+        if not isinstance(operations, pd.DataFrame):
+            operations = pd.DataFrame(list(operations), columns=['user_id', 'video_id', 'liked', 'day'])
+        if operations.empty:
+            return
+
+        frame = pd.DataFrame({
+            'video_id': operations['video_id'].to_numpy(),
+            'day': operations['day'].to_numpy(),
+            'weight': 1.0 + self.like_weight * operations['liked'].to_numpy()
+        })
+        if self.video_tags is not None:
+            frame['tag'] = self.video_tags.reindex(frame['video_id']).to_numpy()
+        else:
+            frame['tag'] = None
+
+        grouped = frame.groupby(['day', 'tag', 'video_id'], sort=True, dropna=False)['weight'].sum()
+        for day, day_counts in grouped.groupby(level='day', sort=True):
+            self._advance_to(int(day))
+            for tag, tag_counts in day_counts.groupby(level='tag', sort=False, dropna=False):
+                tag = None if pd.isna(tag) else tag
+                video_ids = tag_counts.index.get_level_values('video_id').tolist()
+                self._bucket(tag).add_many(video_ids, tag_counts.to_numpy().tolist())
+                self._touch(tag)
+
+    def _compute_leaderboard(self, days, tag):
+        """合并最近 days 天的计数桶，返回按得分降序的前 capacity 个视频"""
+        scores = {}
+        recent = list(self._buckets)[-days:]
+        for age, buckets in enumerate(reversed(recent)):
+            factor = self.decay ** age
+            for bucket_tag, bucket in buckets.items():
+                if tag is not None and bucket_tag != tag:
+                    continue
+                for video_id, count in bucket.counts.items():
+                    scores[video_id] = scores.get(video_id, 0.0) + count * factor
+        return heapq.nlargest(self.capacity, scores.items(), key=lambda item: item[1])
+
+    def top(self, n=10, days=None, tag=None):
+        """
+        获取最近 days 天（默认整个窗口）得分最高的 n 个视频，可按标签过滤
+        榜单按需合并并缓存，没有新操作时查询仅为 O(n) 的切片
+        """
+        if not self._buckets:
+            return []
+        days = self.window_days if days is None else days
+        if not 1 <= days <= self.window_days:
+            raise ValueError(f"天数必须在1-{self.window_days}之间")
+        days = min(days, len(self._buckets))
+
+        version = self._version if tag is None else self._tag_versions.get(tag, 0)
+        cached = self._leaderboards.get((days, tag))
+        if cached is None or cached[0] != (self.current_day, version):
+            cached = ((self.current_day, version), self._compute_leaderboard(days, tag))
+            self._leaderboards[(days, tag)] = cached
+
+        result = []
+        for video_id, score in cached[1][:n]:
+            result.append({
+                "video_id": video_id,
+                "tag": self.video_tags.get(video_id) if self.video_tags is not None else None,
+                "score": round(score, 2)
+            })
+        return result
+
+    def stats(self):
+        """当前窗口内保留的视频条目数（用于观察内存占用）"""
+        return {
+            "current_day": self.current_day,
+            "buckets": len(self._buckets),
+            "entries": sum(len(b.counts) for buckets in self._buckets for b in buckets.values())
+        }
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_trending_videos(n=10, days=None, tag=None):
+    """基于缓存数据的热门视频榜（首次调用时构建引擎，并发调用时只构建一次）"""
+    global _engine
+    engine = _engine
+    if engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = TrendingEngine.from_data_cache()
+                logging.info(f"热门视频引擎已构建: {_engine.stats()}")
+            engine = _engine
+    return engine.top(n=n, days=days, tag=tag)
@@ -16,6 +16,8 @@ import task1_similar_users
 import task2_recommend_videos
 import task4_user_clustering
 import task5_video_clustering
+import chart_renderer
+from cluster_sweep import best_k
 import logging
 
 # ==================== 加载闪屏 ====================
@@ -53,6 +55,12 @@ class LoadingSplash(QSplashScreen):
         self.show()
         QApplication.processEvents()
 
+    def show_progress(self, event):
+        """显示预加载进度事件（preload.PreloadEvent）"""
+        percent = int(event.completed * 100 / event.total) if event.total else 100
+        self.progress_label.setText(f"{event.message}（{percent}%）")
+        QApplication.processEvents()
+
 class BackgroundWidget(QWidget):
     """ 自定义背景部件（唯一新增类） """
     def __init__(self, parent=None):
@@ -389,19 +397,31 @@ class HeatPlotWindow(QDialog):
         self.plot_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         layout.addWidget(self.plot_label)
 
-        # 加载默认图片（如果有）
-        self.load_image('data/heat_plot.png')
-
     def load_image(self, path):
         """ 加载并显示图片 """
         if os.path.exists(path):
-            pixmap = QPixmap(path)
-            pixmap = pixmap.scaled(self.size(),
-                                   Qt.AspectRatioMode.KeepAspectRatio,
-                                   Qt.TransformationMode.SmoothTransformation)
-            self.plot_label.setPixmap(pixmap)
+            self._show_pixmap(QPixmap(path))
         else:
             self.plot_label.setText("图表生成失败")
+
+    def load_chart(self, chart):
+        """ 渲染图表（重复查看时直接使用缓存）并显示 """
+        try:
+            png = chart_renderer.render_chart(chart)
+        except Exception as e:
+            logging.error(f"图表渲染失败: {str(e)}", exc_info=True)
+            self.plot_label.setText("图表生成失败")
+            return
+        pixmap = QPixmap()
+        pixmap.loadFromData(png, "PNG")
+        self._show_pixmap(pixmap)
+
+    def _show_pixmap(self, pixmap):
+        """ 按窗口大小缩放并显示图片 """
+        pixmap = pixmap.scaled(self.size(),
+                               Qt.AspectRatioMode.KeepAspectRatio,
+                               Qt.TransformationMode.SmoothTransformation)
+        self.plot_label.setPixmap(pixmap)
 # ==================== 新增 Task3Window 类 ====================
 class Task3Window(QDialog):
     """ 视频热度预测窗口 """
@@ -470,12 +490,11 @@ class Task3Window(QDialog):
     def _execute_task(self):
         """ 执行预测 """
         video_id = self.input_video.text().strip()
-        videos_df = pd.read_csv('data/videos.csv')
 
         if not video_id.isdigit():
             self._show_error("请输入有效的数字ID")
             return
-        if int(video_id) not in videos_df['id'].values:
+        if DataCache.get_video_row(int(video_id)) < 0:
             self._show_error("视频ID不存在")
             return
 
@@ -491,7 +510,7 @@ class Task3Window(QDialog):
                 self.result_table.setItem(i, 1, QTableWidgetItem(str(round(val, 2))))
             # 显示图表窗口
             self.plot_window = HeatPlotWindow()
-            self.plot_window.load_image('data/heat_plot.png')
+            self.plot_window.load_chart(result['chart'])
             self.plot_window.show()
         except Exception as e:
             self._show_error(str(e))
@@ -499,6 +518,21 @@ class Task3Window(QDialog):
     def _show_error(self, msg):
         QMessageBox.critical(self, "错误", msg)
 
+def show_sweep_results(table, scores):
+    """ 在表格中显示 k 值扫描结果 """
+    headers = ["聚类数量", "惯性", "轮廓系数", "DB指数"]
+    table.clear()
+    table.setRowCount(len(scores))
+    table.setColumnCount(len(headers))
+    table.setHorizontalHeaderLabels(headers)
+    for row_idx, row in enumerate(scores):
+        table.setItem(row_idx, 0, QTableWidgetItem(str(row['k'])))
+        table.setItem(row_idx, 1, QTableWidgetItem(f"{row['inertia']:.2f}"))
+        table.setItem(row_idx, 2, QTableWidgetItem(f"{row['silhouette']:.4f}"))
+        table.setItem(row_idx, 3, QTableWidgetItem(f"{row['davies_bouldin']:.4f}"))
+    table.resizeColumnsToContents()
+
+
 class Task4Window(QDialog):
     """用户聚类分析窗口"""
 
@@ -506,6 +540,9 @@ class Task4Window(QDialog):
         super().__init__(parent)
         self._init_ui()
 
+    def _sweep(self):
+        return task4_user_clustering.sweep_user_clusters()
+
     def _init_ui(self):
         self.setWindowTitle("用户聚类分析")
         self.setFixedSize(800, 600)
@@ -550,6 +587,11 @@ class Task4Window(QDialog):
         """)
         self.btn_execute.clicked.connect(self._execute_task)
 
+        # k 值评估按钮（并行扫描2-20，结果缓存后可直接聚类）
+        self.btn_sweep = QPushButton("评估聚类数量")
+        self.btn_sweep.setStyleSheet(self.btn_execute.styleSheet())
+        self.btn_sweep.clicked.connect(self._execute_sweep)
+
         # 结果显示区域
         self.plot_label = QLabel()
         self.plot_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -560,10 +602,24 @@ class Task4Window(QDialog):
 
         # 布局
         main_layout.addLayout(input_layout)
-        main_layout.addWidget(self.btn_execute, alignment=Qt.AlignmentFlag.AlignCenter)
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        button_layout.addWidget(self.btn_execute)
+        button_layout.addWidget(self.btn_sweep)
+        button_layout.addStretch()
+        main_layout.addLayout(button_layout)
         main_layout.addWidget(self.plot_label)
         main_layout.addWidget(self.result_table)
 
+    def _execute_sweep(self):
+        """评估各聚类数量，并将输入框设为轮廓系数最高的 k"""
+        try:
+            scores = self._sweep()
+            self.input_clusters.setText(str(best_k(scores)))
+            show_sweep_results(self.result_table, scores)
+        except Exception as e:
+            self._show_error(str(e))
+
     def _execute_task(self):
         """执行聚类分析"""
         try:
@@ -575,7 +631,7 @@ class Task4Window(QDialog):
 
             # 显示图表
             self.plot_window = HeatPlotWindow()
-            self.plot_window.load_image(result['plot_path'])
+            self.plot_window.load_chart(result['chart'])
             self.plot_window.show()
 
             # 显示数据
@@ -609,6 +665,9 @@ class Task5Window(QDialog):
         super().__init__(parent)
         self._init_ui()
 
+    def _sweep(self):
+        return task5_video_clustering.sweep_video_clusters()
+
     def _init_ui(self):
         self.setWindowTitle("视频聚类分析")
         self.setFixedSize(800, 600)
@@ -653,6 +712,11 @@ class Task5Window(QDialog):
         """)
         self.btn_execute.clicked.connect(self._execute_task)
 
+        # k 值评估按钮（并行扫描2-20，结果缓存后可直接聚类）
+        self.btn_sweep = QPushButton("评估聚类数量")
+        self.btn_sweep.setStyleSheet(self.btn_execute.styleSheet())
+        self.btn_sweep.clicked.connect(self._execute_sweep)
+
         # 结果显示区域
         self.plot_label = QLabel()
         self.plot_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -663,10 +727,24 @@ class Task5Window(QDialog):
 
         # 布局
         main_layout.addLayout(input_layout)
-        main_layout.addWidget(self.btn_execute, alignment=Qt.AlignmentFlag.AlignCenter)
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        button_layout.addWidget(self.btn_execute)
+        button_layout.addWidget(self.btn_sweep)
+        button_layout.addStretch()
+        main_layout.addLayout(button_layout)
         main_layout.addWidget(self.plot_label)
         main_layout.addWidget(self.result_table)
 
+    def _execute_sweep(self):
+        """评估各聚类数量，并将输入框设为轮廓系数最高的 k"""
+        try:
+            scores = self._sweep()
+            self.input_clusters.setText(str(best_k(scores)))
+            show_sweep_results(self.result_table, scores)
+        except Exception as e:
+            self._show_error(str(e))
+
     def _execute_task(self):
         """执行聚类分析"""
         try:
@@ -678,7 +756,7 @@ class Task5Window(QDialog):
 
             # 显示图表
             self.plot_window = HeatPlotWindow()
-            self.plot_window.load_image(result['plot_path'])
+            self.plot_window.load_chart(result['chart'])
             self.plot_window.show()
 
             # 显示数据
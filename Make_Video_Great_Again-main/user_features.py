@@ -0,0 +1,260 @@
+# user_features.py —— 用户特征库：一次遍历操作数据得到各任务共用的用户级特征，支持增量更新
+# -*- coding: utf-8 -*-
+"""
+按稠密用户下标（用户ID升序）存放的列式数组：
+    tag_views   (用户数, 标签数)  各标签观看次数
+    tag_likes   (用户数, 标签数)  各标签点赞次数
+    day_views   (用户数, 7)      每天观看次数
+    day_likes   (用户数, 7)      每天点赞次数
+    views/likes (用户数,)        总观看/点赞次数，like_rate = likes / views
+任务1 的用户-标签兴趣分数（观看 + 2×点赞）和任务4 的聚类特征（观看次数）都由这里派生，
+不再各自合并操作与视频表再分组
+"""
+import copy
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_cache import DataCache, NUM_DAYS
+import memory_budget
+
+# 分块累加时每条操作的估计内存（下标与权重数组）
+BYTES_PER_OP = 48
+CHUNK_SIZE = 1_000_000
+
+# 按数据版本缓存的特征库
+_store = None
+_store_lock = threading.Lock()
+
+
+def _accumulate(target, flat, weights=None):
+    """把 flat 下标上的计数累加到 target（展平视图）；小批量用 np.add.at，避免分配整块计数数组"""
+    flat_target = target.reshape(-1)
+    if len(flat) * 8 < flat_target.size:
+        np.add.at(flat_target, flat, 1 if weights is None else weights)
+    else:
+        flat_target += np.bincount(flat, weights=weights, minlength=flat_target.size).astype(target.dtype)
+
+
+class UserFeatureStore:
+    """用户特征库"""
+
+    def __init__(self, videos_df):
+        self.user_ids = np.empty(0, dtype=np.int64)
+        self.tag_views = np.zeros((0, 0), dtype=np.int32)
+        self.tag_likes = np.zeros((0, 0), dtype=np.int32)
+        self.day_views = np.zeros((0, NUM_DAYS), dtype=np.int32)
+        self.day_likes = np.zeros((0, NUM_DAYS), dtype=np.int32)
+        self.views = np.zeros(0, dtype=np.int64)
+        self.likes = np.zeros(0, dtype=np.int64)
+        self.tags = np.empty(0, dtype=object)
+        self._tag_lookup = np.empty(0, dtype=np.intp)  # 视频ID -> 标签列（-1 表示没有该视频）
+        self.n_operations = 0
+        self.skipped = 0  # 视频不存在（无标签）的操作数
+        self.version = None
+        self.set_videos(videos_df)
+
+    @property
+    def like_rate(self):
+        """各用户的点赞率（没有观看记录的用户为 0）"""
+        return self.likes / np.maximum(self.views, 1)
+
+    @property
+    def n_users(self):
+        return len(self.user_ids)
+
+    def set_videos(self, videos_df):
+        """更新 视频ID -> 标签列 的查找数组；出现新标签时按字母顺序插入新的标签列"""
+        tags = np.unique(np.concatenate([self.tags, videos_df['tag'].astype(str).unique()])).astype(object)
+        if len(tags) != len(self.tags):
+            positions = np.searchsorted(tags, self.tags)
+            for name in ('tag_views', 'tag_likes'):
+                old = getattr(self, name)
+                new = np.zeros((old.shape[0], len(tags)), dtype=old.dtype)
+                new[:, positions] = old
+                setattr(self, name, new)
+            self.tags = tags
+
+        video_ids = videos_df['id'].to_numpy()
+        size = max(int(video_ids.max()) + 1 if len(video_ids) else 0, len(self._tag_lookup))
+        tag_lookup = np.full(size, -1, dtype=np.intp)
+        tag_lookup[:len(self._tag_lookup)] = self._tag_lookup
+        tag_lookup[video_ids] = np.searchsorted(self.tags, videos_df['tag'].astype(str).to_numpy())
+        self._tag_lookup = tag_lookup
+
+    def _add_users(self, user_ids):
+        """插入尚未出现过的用户（保持用户ID升序），返回新增用户数"""
+        new_users = np.setdiff1d(user_ids, self.user_ids, assume_unique=True)
+        if len(new_users) == 0:
+            return 0
+        positions = np.searchsorted(self.user_ids, new_users)
+        self.user_ids = np.insert(self.user_ids, positions, new_users)
+        for name in ('tag_views', 'tag_likes', 'day_views', 'day_likes', 'views', 'likes'):
+            setattr(self, name, np.insert(getattr(self, name), positions, 0, axis=0))
+        return len(new_users)
+
+    def update(self, operations_df):
+        """
+        累加一批操作（构建时逐块调用，新增数据时增量调用），新用户自动插入
+        Args:
+            operations_df: 含 user_id, video_id, liked, day 列的操作数据
+        """
+        user_ids = operations_df['user_id'].to_numpy().astype(np.int64)
+        if len(user_ids) == 0:
+            return
+        self._add_users(np.unique(user_ids))
+
+        rows = np.searchsorted(self.user_ids, user_ids)
+        liked = operations_df['liked'].to_numpy() == 1
+        vids = operations_df['video_id'].to_numpy()
+        cols = np.full(len(vids), -1, dtype=np.intp)
+        in_range = (vids >= 0) & (vids < len(self._tag_lookup))
+        cols[in_range] = self._tag_lookup[vids[in_range]]
+        tagged = cols >= 0
+        self.skipped += int((~tagged).sum())
+
+        n_tags = len(self.tags)
+        flat = rows[tagged] * n_tags + cols[tagged]
+        _accumulate(self.tag_views, flat)
+        _accumulate(self.tag_likes, flat[liked[tagged]])
+
+        days = operations_df['day'].to_numpy() - 1
+        valid_day = (days >= 0) & (days < NUM_DAYS)
+        flat_day = rows[valid_day] * NUM_DAYS + days[valid_day]
+        _accumulate(self.day_views, flat_day)
+        _accumulate(self.day_likes, flat_day[liked[valid_day]])
+
+        _accumulate(self.views, rows)
+        _accumulate(self.likes, rows[liked])
+        self.n_operations += len(user_ids)
+
+    def rows_for(self, user_ids):
+        """用户ID -> 稠密下标，不存在的用户为 -1"""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        positions = np.searchsorted(self.user_ids, user_ids)
+        found = positions < len(self.user_ids)
+        found[found] = self.user_ids[positions[found]] == user_ids[found]
+        return np.where(found, positions, -1)
+
+    def tag_view_rows(self, user_ids, tags=None):
+        """
+        指定用户的各标签观看次数，不存在的用户为全 0 行
+        tags 指定列顺序（如已保存模型中的标签列表），特征库中没有的标签为 0
+        """
+        rows = self.rows_for(user_ids)
+        counts = np.zeros((len(rows), len(self.tags)), dtype=self.tag_views.dtype)
+        counts[rows >= 0] = self.tag_views[rows[rows >= 0]]
+        if tags is None:
+            return counts
+        cols = pd.Index(self.tags).get_indexer(list(tags))
+        result = np.zeros((len(rows), len(cols)), dtype=counts.dtype)
+        result[:, cols >= 0] = counts[:, cols[cols >= 0]]
+        return result
+
+    def tag_scores(self, rows=None):
+        """用户-标签兴趣分数：观看次数 + 2 × 点赞次数（rows 指定时只计算这些行）"""
+        if rows is None:
+            return self.tag_views.astype(np.int64) + 2 * self.tag_likes
+        return self.tag_views[rows].astype(np.int64) + 2 * self.tag_likes[rows]
+
+    def active_rows(self):
+        """至少观看过一个有标签视频的用户下标"""
+        return np.flatnonzero(self.tag_views.sum(axis=1) > 0)
+
+    # 快照读写的数组字段
+    ARRAY_FIELDS = ('user_ids', 'tag_views', 'tag_likes', 'day_views', 'day_likes', 'views', 'likes', '_tag_lookup')
+
+    def to_arrays(self):
+        """导出为 (数组字典, 元信息)，用于写入快照"""
+        arrays = {name.lstrip('_'): getattr(self, name) for name in self.ARRAY_FIELDS}
+        meta = {"tags": [str(tag) for tag in self.tags], "n_operations": self.n_operations, "skipped": self.skipped}
+        return arrays, meta
+
+    def copy(self):
+        """复制全部数组：在副本上 update 后再发布，读取方不会看到更新到一半的特征库"""
+        clone = copy.copy(self)
+        for name in self.ARRAY_FIELDS:
+            setattr(clone, name, getattr(self, name).copy())
+        return clone
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        """由 to_arrays 的结果重建（复制为可写数组，之后仍可增量更新）"""
+        store = cls.__new__(cls)
+        for name in cls.ARRAY_FIELDS:
+            setattr(store, name, np.array(arrays[name.lstrip('_')]))
+        store.tags = np.array(meta["tags"], dtype=object)
+        store.n_operations = meta["n_operations"]
+        store.skipped = meta["skipped"]
+        store.version = None
+        return store
+
+    def stats(self):
+        return {"users": self.n_users, "tags": len(self.tags), "operations": self.n_operations,
+                "skipped": self.skipped, "bytes": int(sum(getattr(self, name).nbytes for name in (
+                    'tag_views', 'tag_likes', 'day_views', 'day_likes', 'views', 'likes', 'user_ids')))}
+
+
+def build_user_feature_store(streaming=False, chunk_size=CHUNK_SIZE):
+    """
+    一次遍历操作数据构建特征库
+    Args:
+        streaming: True 时分块读取 data/operations.csv（不把操作表载入缓存），否则分块遍历缓存的操作表
+        chunk_size: 每块操作条数（受内存预算约束）
+    """
+    videos_df = DataCache.load_videos()
+    store = UserFeatureStore(videos_df)
+    chunk_size = memory_budget.chunk_rows(BYTES_PER_OP, chunk_size)
+    if streaming:
+        for chunk in pd.read_csv('data/operations.csv', usecols=['user_id', 'video_id', 'liked', 'day'],
+                                 chunksize=chunk_size):
+            store.update(chunk)
+    else:
+        operations_df = DataCache.load_operations()
+        for start in range(0, len(operations_df), chunk_size):
+            store.update(operations_df.iloc[start:start + chunk_size])
+    if store.skipped:
+        logging.warning(f"用户特征库忽略了 {store.skipped} 条找不到视频标签的操作")
+    logging.info(f"用户特征库已构建: {store.stats()}")
+    return store
+
+
+def get_user_feature_store(streaming=False, chunk_size=CHUNK_SIZE):
+    """当前数据版本的特征库（首次调用时构建，并发调用时只构建一次）"""
+    global _store
+    version = DataCache.get_data_version()
+    store = _store
+    if store is None or store.version != version:
+        with _store_lock:
+            if _store is None or _store.version != version:
+                store = build_user_feature_store(streaming, chunk_size)
+                store.version = version
+                _store = store
+            store = _store
+    return store
+
+
+def get_cached_store():
+    """当前数据版本的特征库已构建时返回它，否则返回 None"""
+    store = _store
+    if store is not None and store.version == DataCache.get_data_version():
+        return store
+    return None
+
+
+def set_store(store):
+    """发布一个已构建（或从快照恢复）的特征库，标记为当前数据版本"""
+    global _store
+    with _store_lock:
+        store.version = DataCache.get_data_version()
+        _store = store
+
+
+@DataCache.on_clear
+def clear_cache():
+    """清除已构建的特征库（等待正在进行的构建完成后再清除）"""
+    global _store
+    with _store_lock:
+        _store = None
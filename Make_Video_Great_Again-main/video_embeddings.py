@@ -0,0 +1,163 @@
+# video_embeddings.py —— 视频向量库与相似视频查询
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+from data_cache import DataCache
+
+EMBEDDING_DIR = 'data/embeddings'
+KEEP_FINGERPRINTS = 2  # 每种维数保留的最近数据指纹数，生成新向量时删除更早的文件
+DEFAULT_COMPONENTS = 64
+QUERY_CHUNK = 64  # 批量查询时每次参与矩阵乘法的查询数，控制相似度矩阵的内存
+
+# 已加载的向量库：维数 -> VideoEmbeddings
+_stores = {}
+_lock = threading.Lock()
+
+
+class VideoEmbeddings:
+    """内存映射的视频向量（行已 L2 归一化，float32）"""
+
+    def __init__(self, video_ids, vectors, meta):
+        self.video_ids = video_ids
+        self.vectors = vectors
+        self.meta = meta
+        self.video_index = pd.Index(video_ids)
+
+    def rows_for(self, video_ids):
+        """视频ID -> 向量行号（没有向量的视频为 -1）"""
+        return self.video_index.get_indexer(np.atleast_1d(video_ids))
+
+
+def _paths(fingerprint, n_components):
+    prefix = os.path.join(EMBEDDING_DIR, f"video_{fingerprint}_{n_components}")
+    return f"{prefix}_vectors.npy", f"{prefix}_ids.npy", f"{prefix}_meta.json"
+
+
+def _prune(n_components, keep):
+    """同一维数只保留最近生成的 keep 个数据指纹的文件"""
+    suffix = f"_{n_components}_meta.json"
+    metas = [os.path.join(EMBEDDING_DIR, name) for name in os.listdir(EMBEDDING_DIR)
+             if name.startswith('video_') and name.endswith(suffix)]
+    metas.sort(key=os.path.getmtime)
+    for meta_path in metas[:-keep]:
+        prefix = meta_path[:-len('_meta.json')]
+        for path in (f"{prefix}_vectors.npy", f"{prefix}_ids.npy", meta_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # 仍被内存映射时（Windows）无法删除，下次生成时再试
+                logging.warning(f"删除旧的视频向量文件失败: {str(e)}")
+
+
+def build_video_embeddings(n_components=DEFAULT_COMPONENTS):
+    """
+    在全量 视频×用户 矩阵上拟合 TruncatedSVD，保存为 float32 的 .npy 文件
+    文件名包含数据指纹，数据变化后会自动生成新版本（只保留最近 KEEP_FINGERPRINTS 个）
+    """
+    from task5_video_clustering import _build_video_user_matrix
+
+    fingerprint = DataCache.data_fingerprint()
+    vectors_path, ids_path, meta_path = _paths(fingerprint, n_components)
+
+    _, video_ids, _, video_user_matrix = _build_video_user_matrix()
+    matrix = normalize(video_user_matrix.tocsr(), norm='l2', axis=1)
+    n_fitted = min(n_components, matrix.shape[1] - 1)
+    svd = TruncatedSVD(n_components=n_fitted, random_state=42)
+    vectors = normalize(svd.fit_transform(matrix), norm='l2', axis=1).astype(np.float32)
+
+    os.makedirs(EMBEDDING_DIR, exist_ok=True)
+    np.save(vectors_path, vectors)
+    np.save(ids_path, np.asarray(video_ids, dtype=np.int64))
+    meta = {
+        "data_fingerprint": fingerprint,
+        "n_components": int(n_fitted),
+        "n_videos": int(len(video_ids)),
+        "explained_variance": round(float(svd.explained_variance_ratio_.sum()), 4)
+    }
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    _prune(n_components, KEEP_FINGERPRINTS)
+
+    logging.info(f"视频向量已生成: {meta}")
+    return vectors_path
+
+
+def load_video_embeddings(n_components=DEFAULT_COMPONENTS):
+    """加载（必要时先生成）与当前数据匹配的视频向量，向量以只读内存映射方式打开"""
+    fingerprint = DataCache.data_fingerprint()
+    with _lock:
+        store = _stores.get(n_components)
+        if store is not None and store.meta['data_fingerprint'] == fingerprint:
+            return store
+
+        vectors_path, ids_path, meta_path = _paths(fingerprint, n_components)
+        if not os.path.exists(meta_path):
+            build_video_embeddings(n_components)
+
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        store = VideoEmbeddings(np.load(ids_path), np.load(vectors_path, mmap_mode='r'), meta)
+        _stores[n_components] = store
+        return store
+
+
+def _top_k(similarities, k, exclude):
+    """对每行相似度取前k（排除查询视频自身）"""
+    similarities[np.arange(len(exclude)), exclude] = -np.inf
+    k = min(k, similarities.shape[1] - 1)
+    if k <= 0:
+        # 只有一个视频或 k=0：没有可返回的近邻（[:, -0:] 会取到整行）
+        empty = np.empty((len(exclude), 0), dtype=np.intp)
+        return empty, similarities[:, :0]
+    top = np.argpartition(similarities, -k, axis=1)[:, -k:]
+    order = np.argsort(np.take_along_axis(similarities, top, axis=1), axis=1)[:, ::-1]
+    top = np.take_along_axis(top, order, axis=1)
+    return top, np.take_along_axis(similarities, top, axis=1)
+
+
+def find_similar_videos_batch(video_ids, k=10, n_components=DEFAULT_COMPONENTS):
+    """
+    批量查询相似视频（向量内积即余弦相似度）
+    Returns:
+        与 video_ids 对应的结果列表，每项为 [{"Video_ID", "label", "similarity"}, ...]
+    """
+    store = load_video_embeddings(n_components)
+    rows = store.rows_for(video_ids)
+    if (rows < 0).any():
+        missing = np.atleast_1d(video_ids)[rows < 0]
+        raise ValueError(f"视频ID {missing.tolist()[:10]} 没有交互记录或不存在")
+
+    videos_df = DataCache.load_videos()
+    tags = pd.Series(videos_df['tag'].to_numpy(), index=videos_df['id'])
+
+    results = []
+    for start in range(0, len(rows), QUERY_CHUNK):
+        chunk = rows[start:start + QUERY_CHUNK]
+        similarities = np.asarray(store.vectors[chunk] @ store.vectors.T, dtype=np.float32)
+        top, scores = _top_k(similarities, k, chunk)
+        for top_row, score_row in zip(top, scores):
+            neighbour_ids = store.video_ids[top_row]
+            labels = tags.reindex(neighbour_ids).to_numpy()
+            results.append([
+                {"Video_ID": int(vid), "label": label, "similarity": round(float(score), 4)}
+                for vid, label, score in zip(neighbour_ids, labels, score_row)
+            ])
+    return results
+
+
+def find_similar_videos(video_id, k=10, n_components=DEFAULT_COMPONENTS):
+    """查询与指定视频最相似的 k 个视频"""
+    try:
+        return find_similar_videos_batch([video_id], k, n_components)[0]
+    except Exception as e:
+        logging.error(f"查询相似视频失败: {str(e)}")
+        raise